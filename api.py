@@ -0,0 +1,398 @@
+# api.py
+#
+# Headless HTTP API next to the Gradio UI (mounted by gradio_app.create_app),
+# for integrations that should not speak the Gradio web protocol. It runs
+# the same process_inputs_async as the UI, in the same process, so clients,
+# provider limits (scheduler.py), caches, sessions and metrics are shared
+# and both entry points scale the same way.
+#
+#   POST   /api/consult                 multipart form: audio, image, documents (repeatable) files;
+#                                       transcript, session_id, profile fields
+#          ?mode=json   (default)       {"transcript", "context", "reply", "audio": [urls], "session_id", ...}
+#          ?mode=sse                    server-sent events as the pipeline progresses:
+#                                       context, reply, audio, done
+#          ?mode=audio                  the reply audio itself as one chunked stream; session in
+#                                       X-Session-Id, the transcript (first API_TRANSCRIPT_HEADER_BYTES,
+#                                       URL-quoted; X-Transcript-Truncated: 1 if cut) in X-Transcript.
+#                                       Use json or sse mode when the full text is needed.
+#   GET    /api/audio/{kind}/{name}     a clip or segment named in a JSON/SSE reply, chunked
+#   DELETE /api/sessions/{session_id}   ends a multi-turn consultation (sessions.py)
+#
+# Session ids are issued by the server: a first turn (no session_id) opens
+# a new session under an unguessable id, returned with the reply; follow-ups
+# send it back. Unknown or expired ids get 404 rather than a fresh session,
+# so a guessed id never reaches someone else's consultation.
+#
+# At most API_CONCURRENCY consultations run at once; past API_QUEUE_SIZE
+# waiting, requests get 429. The slot is taken before the body is read, so
+# waiting requests hold no uploads. The multipart body is then parsed as it
+# streams in: small files stay in memory (uploads.Upload), files over
+# API_SPOOL_BYTES are written to a per-request temp directory as they
+# arrive and passed on as paths; bodies over API_MAX_UPLOAD_BYTES are
+# refused. The temp directory goes when the response is done.
+
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from async_pipeline import process_inputs_async
+from artifacts import ARTIFACTS_DIR
+from metrics import Counter
+from sessions import get_session_store
+from tts_cache import TTS_CACHE_DIR
+from tts_profiles import profile_for_client
+from uploads import Upload
+
+
+API_MAX_UPLOAD_BYTES = int(os.environ.get("API_MAX_UPLOAD_BYTES", 64 * 1024 * 1024))
+API_SPOOL_BYTES = int(os.environ.get("API_SPOOL_BYTES", 1024 * 1024))  # larger files go to a temp file
+API_CONCURRENCY = int(os.environ.get("API_CONCURRENCY", os.environ.get("GRADIO_CONCURRENCY", 8)))
+API_QUEUE_SIZE = int(os.environ.get("API_QUEUE_SIZE", os.environ.get("GRADIO_QUEUE_SIZE", 64)))
+API_AUDIO_CHUNK_BYTES = int(os.environ.get("API_AUDIO_CHUNK_BYTES", 32 * 1024))
+# Well under the 8-16 KB header limits of common proxies and servers
+API_TRANSCRIPT_HEADER_BYTES = int(os.environ.get("API_TRANSCRIPT_HEADER_BYTES", 1024))
+
+MODES = ("json", "sse", "audio")
+AUDIO_ROOTS = {"artifacts": ARTIFACTS_DIR, "cache": TTS_CACHE_DIR}
+MEDIA_TYPES = {".mp3": "audio/mpeg", ".ogg": "audio/ogg", ".wav": "audio/wav"}
+
+API_REQUESTS = Counter("ai_doctor_api_requests_total", "Headless API consultations by response mode.", ["mode"])
+API_REJECTED = Counter("ai_doctor_api_rejected_total", "Headless API requests refused.", ["reason"])
+
+router = APIRouter(prefix="/api")
+
+
+# -----------------------------
+# MULTIPART (STREAMED; LARGE FILES SPOOLED)
+# -----------------------------
+def _multipart():
+    # python-multipart is installed with Gradio; the module was renamed in 0.0.13
+    try:
+        from python_multipart.multipart import MultipartParser, parse_options_header
+    except ImportError:
+        from multipart.multipart import MultipartParser, parse_options_header
+    return MultipartParser, parse_options_header
+
+
+async def read_form(request, admission, max_bytes=API_MAX_UPLOAD_BYTES, spool_bytes=API_SPOOL_BYTES):
+    """
+    -> (fields {name: str}, files [(name, Upload or path)]), parsed chunk by
+    chunk as the body arrives. File parts over `spool_bytes` are written to
+    `admission`'s temp directory and given as paths.
+    """
+    MultipartParser, parse_options_header = _multipart()
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(415, "Expected a multipart/form-data body.")
+
+    fields, files = {}, []
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, field=bytearray(), value=bytearray(), data=bytearray(), file=None, spool=None)
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][bytes(part["field"]).lower()] = bytes(part["value"])
+        part["field"], part["value"] = bytearray(), bytearray()
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode("utf-8", errors="replace")
+        if b"filename" in options:
+            part["file"] = options[b"filename"].decode("utf-8", errors="replace")
+
+    def on_part_data(data, start, end):
+        if part["spool"] is not None:
+            part["spool"].write(data[start:end])
+            return
+        part["data"] += data[start:end]
+        if part["file"] is not None and len(part["data"]) > spool_bytes:
+            # Keeps the upload's name, so its extension still tells the decoders the format
+            path = os.path.join(admission.spool_dir(), f"{len(files):02d}-{os.path.basename(part['file']) or 'upload'}")
+            part["spool"] = open(path, "wb")
+            part["spool"].write(part["data"])
+            part["data"] = bytearray()
+
+    def on_part_end():
+        if part["spool"] is not None:
+            part["spool"].close()
+            files.append((part["name"], part["spool"].name))
+        elif part["file"] is not None:
+            if part["data"]:
+                files.append((part["name"], Upload(part["file"], part["data"])))
+        else:
+            fields[part["name"]] = part["data"].decode("utf-8", errors="replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_bytes:
+                API_REJECTED.inc(reason="too_large")
+                raise HTTPException(413, f"Request body over {max_bytes} bytes.")
+            parser.write(chunk)
+        parser.finalize()
+    finally:
+        if part.get("spool") is not None:
+            part["spool"].close()
+    return fields, files
+
+
+# -----------------------------
+# CONCURRENCY
+# -----------------------------
+_slots = None
+_waiting = 0
+
+
+class Admission:
+    """One of API_CONCURRENCY slots, plus the request's spooled uploads; release() frees both, once."""
+
+    def __init__(self):
+        self._spool_dir = None
+        self._released = False
+
+    @classmethod
+    async def acquire(cls):
+        global _slots, _waiting
+        if _waiting >= API_QUEUE_SIZE:
+            API_REJECTED.inc(reason="queue_full")
+            raise HTTPException(429, "Too many consultations waiting; retry shortly.", headers={"Retry-After": "5"})
+        if _slots is None:
+            _slots = asyncio.Semaphore(API_CONCURRENCY)
+        _waiting += 1
+        try:
+            await _slots.acquire()
+        finally:
+            _waiting -= 1
+        return cls()
+
+    def spool_dir(self):
+        if self._spool_dir is None:
+            self._spool_dir = tempfile.mkdtemp(prefix="api-upload-")
+        return self._spool_dir
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        _slots.release()
+        if self._spool_dir is not None:
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+
+async def _limited(outputs, admission):
+    """Runs the pipeline generator in the request's slot, closing it when the client goes away."""
+    try:
+        async for item in outputs:
+            yield item
+    finally:
+        await outputs.aclose()
+        admission.release()
+
+
+# -----------------------------
+# AUDIO
+# -----------------------------
+def audio_url(path):
+    """/api/audio/... URL of a clip or segment the pipeline returned (request artifact or TTS cache file)."""
+    if not path:
+        return None
+    real = os.path.realpath(path)
+    for kind, root in AUDIO_ROOTS.items():
+        root = os.path.realpath(root)
+        if real.startswith(root + os.sep):
+            return f"/api/audio/{kind}/{quote(os.path.relpath(real, root).replace(os.sep, '/'))}"
+    return None
+
+
+def _resolve_audio(kind, name):
+    root = AUDIO_ROOTS.get(kind)
+    if root is None:
+        raise HTTPException(404, "Unknown audio kind.")
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, name))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        raise HTTPException(404, "No such audio (it may have expired).")
+    return path
+
+
+def _iter_file(path, chunk_size=API_AUDIO_CHUNK_BYTES):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+
+
+@router.get("/audio/{kind}/{name:path}")
+def get_audio(kind: str, name: str):
+    path = _resolve_audio(kind, name)
+    return StreamingResponse(
+        _iter_file(path), media_type=MEDIA_TYPES.get(os.path.splitext(path)[1], "application/octet-stream"))
+
+
+# -----------------------------
+# CONSULTATION
+# -----------------------------
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@router.post("/consult")
+async def consult(request: Request, mode: str = None):
+    accept = request.headers.get("accept", "")
+    mode = mode or ("sse" if "text/event-stream" in accept else "audio" if accept.startswith("audio/") else "json")
+    if mode not in MODES:
+        raise HTTPException(400, f"mode must be one of {', '.join(MODES)}.")
+
+    admission = await Admission.acquire()
+    try:
+        return await _consult(request, mode, admission)
+    except BaseException:
+        admission.release()
+        raise
+
+
+async def _consult(request, mode, admission):
+    fields, files = await read_form(request, admission)
+    uploads = {}
+    for name, upload in files:
+        uploads.setdefault(name, []).append(upload)
+    audio = (uploads.get("audio") or [None])[0]
+    image = (uploads.get("image") or [None])[0]
+    transcript = fields.get("transcript") or None
+    if audio is None and image is None and transcript is None:
+        raise HTTPException(422, "Send at least one of audio, image or transcript.")
+    store = get_session_store()
+    if fields.get("session_id"):
+        session = store.get(fields["session_id"], create=False)
+        if session is None:
+            API_REJECTED.inc(reason="unknown_session")
+            raise HTTPException(404, "Unknown or expired session_id; start a new consultation without one.")
+    else:
+        session = store.create()
+    session_id = session.session_id
+    profile = profile_for_client(fields.get("profile"), request.headers)
+    API_REQUESTS.inc(mode=mode)
+
+    outputs = _limited(process_inputs_async(
+        audio, image, uploads.get("documents"),
+        transcript=transcript, session_id=session_id, tts_profile=profile
+    ), admission)
+    if mode == "json":
+        try:
+            return JSONResponse(await _collect(outputs, session_id, profile))
+        finally:
+            await outputs.aclose()
+    # Also released after the response, in case the stream is never iterated (client gone first)
+    done = BackgroundTask(admission.release)
+    if mode == "sse":
+        return StreamingResponse(
+            _events(outputs, session_id, profile), media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, background=done)
+    return await _audio_response(outputs, session_id, profile, done)
+
+
+async def _collect(outputs, session_id, profile):
+    result = {"transcript": "", "context": "", "reply": "", "audio": [],
+              "session_id": session_id, "profile": profile.name}
+    async for transcript, context, reply, segment in outputs:
+        result.update(transcript=transcript, context=context, reply=reply)
+        if segment:
+            result["audio"].append(audio_url(segment))
+    return result
+
+
+async def _events(outputs, session_id, profile):
+    context_sent, reply_sent = False, ""
+    result = {"transcript": "", "context": "", "reply": "", "audio": []}
+    try:
+        async for transcript, context, reply, segment in outputs:
+            result.update(transcript=transcript, context=context, reply=reply)
+            if not context_sent:
+                context_sent = True
+                yield _sse("context", {"transcript": transcript, "context": context})
+            if reply != reply_sent:
+                # Only what is new since the last event
+                yield _sse("reply", {"delta": reply[len(reply_sent):] if reply.startswith(reply_sent) else reply,
+                                     "reply": reply})
+                reply_sent = reply
+            if segment:
+                url = audio_url(segment)
+                result["audio"].append(url)
+                yield _sse("audio", {"url": url, "bytes": os.path.getsize(segment)})
+    except Exception as e:
+        yield _sse("error", {"error": str(e)})
+        return
+    yield _sse("done", {**result, "session_id": session_id, "profile": profile.name})
+
+
+async def _audio_response(outputs, session_id, profile, background=None):
+    # Headers go out before the body: wait for the transcript (the first output) first
+    first = await anext(outputs, ("", "", "", None))
+
+    async def body():
+        try:
+            for chunk in _output_audio(first):
+                yield chunk
+            async for output in outputs:
+                for chunk in _output_audio(output):
+                    yield chunk
+        finally:
+            await outputs.aclose()
+
+    transcript, truncated = _header_text(first[0] or "")
+    headers = {"X-Transcript": transcript, "X-Session-Id": session_id, "Cache-Control": "no-cache"}
+    if truncated:
+        headers["X-Transcript-Truncated"] = "1"
+    return StreamingResponse(
+        body(), media_type=MEDIA_TYPES.get(profile.extension), headers=headers, background=background)
+
+
+def _header_text(text, limit=API_TRANSCRIPT_HEADER_BYTES):
+    """-> (URL-quoted text within `limit` bytes, whether it was cut); never splits a character's escape."""
+    quoted = quote(text)
+    if len(quoted) <= limit:
+        return quoted, False
+    kept, size = [], 0
+    for char in text:
+        char = quote(char)
+        if size + len(char) > limit:
+            break
+        kept.append(char)
+        size += len(char)
+    return "".join(kept), True
+
+
+def _output_audio(output):
+    # Segments of one clip are consecutive pieces of it, so the stream is their concatenation
+    segment = output[3]
+    return _iter_file(segment) if segment else ()
+
+
+@router.delete("/sessions/{session_id}")
+def end_session(session_id: str):
+    get_session_store().reset(session_id)
+    return {"session_id": session_id, "ended": True}
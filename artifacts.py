@@ -0,0 +1,115 @@
+# artifacts.py
+#
+# Request-scoped output files. Every consultation gets its own directory
+# (artifacts/<request_id>/), so concurrent patients never overwrite each
+# other's audio the way the shared final.mp3 did. A daemon thread removes
+# request directories older than ARTIFACT_MAX_AGE seconds and, if the total
+# is still above ARTIFACT_MAX_BYTES, the oldest ones until it fits.
+
+import os
+import shutil
+import threading
+import time
+import uuid
+
+
+ARTIFACTS_DIR = os.environ.get("ARTIFACTS_DIR", "artifacts")
+ARTIFACT_MAX_AGE = float(os.environ.get("ARTIFACT_MAX_AGE", 3600))
+ARTIFACT_MAX_BYTES = int(os.environ.get("ARTIFACT_MAX_BYTES", 512 * 1024 * 1024))
+ARTIFACT_GC_INTERVAL = float(os.environ.get("ARTIFACT_GC_INTERVAL", 60))
+
+
+class RequestArtifacts:
+    """Output paths for one request, all inside its own directory."""
+
+    def __init__(self, root):
+        self.request_id = uuid.uuid4().hex
+        self.directory = os.path.join(root, self.request_id)
+        os.makedirs(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+
+class ArtifactStore:
+    def __init__(self, root=ARTIFACTS_DIR, max_age=ARTIFACT_MAX_AGE,
+                 max_bytes=ARTIFACT_MAX_BYTES, gc_interval=ARTIFACT_GC_INTERVAL):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.gc_interval = gc_interval
+        self._gc_thread = None
+        self._stop = threading.Event()
+        os.makedirs(root, exist_ok=True)
+
+    def new_request(self):
+        return RequestArtifacts(self.root)
+
+    # -----------------------------
+    # GARBAGE COLLECTION
+    # -----------------------------
+    def _request_dirs(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            size = 0
+            for f in os.scandir(entry.path):
+                try:
+                    size += f.stat().st_size
+                except OSError:
+                    pass
+            entries.append((entry.stat().st_mtime, entry.path, size))
+        return sorted(entries)
+
+    def collect(self):
+        """One GC pass; returns the number of request directories removed."""
+        now = time.time()
+        entries = self._request_dirs()
+        total = sum(size for _, _, size in entries)
+        removed = 0
+        for mtime, path, size in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def _gc_loop(self):
+        while not self._stop.wait(self.gc_interval):
+            try:
+                self.collect()
+            except Exception as e:
+                print("⚠️ artifact GC failed:", e)
+
+    def start_gc(self):
+        if self._gc_thread is None:
+            self._gc_thread = threading.Thread(target=self._gc_loop, name="artifact-gc", daemon=True)
+            self._gc_thread.start()
+
+    def stop_gc(self):
+        self._stop.set()
+        if self._gc_thread is not None:
+            self._gc_thread.join()
+            self._gc_thread = None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore()
+            _store.start_gc()
+        return _store
+
+
+def stop_artifact_gc():
+    """Stops the GC thread at shutdown, if a store was ever created."""
+    with _store_lock:
+        if _store is not None:
+            _store.stop_gc()
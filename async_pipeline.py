@@ -0,0 +1,316 @@
+# async_pipeline.py
+#
+# asyncio version of pipeline.process_inputs, built on the async Groq and
+# ElevenLabs clients. Transcription, image preprocessing and document
+# ingestion run concurrently and are only joined at prompt assembly; TTS for
+# sentence N runs while the LLM is still streaming sentence N+1, and its
+# audio is yielded in short segments while ElevenLabs is still sending it
+# (audio_stream.py). No worker thread is held per consultation, so one
+# worker serves many in flight.
+
+import asyncio
+import os
+
+from brain_of_the_doctor import analyze_image_with_query_async, stream_image_with_query_async, aiter_sentences
+from voice_of_the_patient import transcribe_with_groq_async
+from voice_of_the_doctor import (
+    text_to_speech_with_gtts_async, text_to_speech_with_elevenlabs_async, stream_tts_with_elevenlabs_async,
+    ELEVENLABS_MODEL_ID
+)
+from clients import resolve_voice_id
+from tts_cache import synthesize_cached_async, synthesize_cached_stream_async
+from tts_hedge import hedge_stream_async
+from tts_profiles import get_profile, cache_format, finish_clip, record_served
+from llm_cache import get_llm_cache
+from artifacts import get_artifact_store
+from metrics import RequestTrace, span, timed_aiter, record_payload
+from pipeline import (
+    retrieve_context, build_rag_prompt, open_session, session_documents, session_image, finish_session_turn,
+    report_error, system_prompt, STREAMING_TTS, LLM_MODEL, STT_MODEL, NO_INPUT_MESSAGE, SYSTEM_PROMPT_VERSION
+)
+
+
+# -----------------------------
+# TEXT TO SPEECH (ONE CLIP, CACHED)
+# -----------------------------
+async def _finish_clip(path, profile, provider_format, trace):
+    async with span("audio_finish", None, trace):
+        await asyncio.to_thread(finish_clip, path, profile, provider_format)
+
+
+def _timed_synth(synth, provider, trace, profile, provider_format):
+    async def run(path):
+        async with span("tts", provider, trace):
+            await synth(path)
+        record_payload("tts", "received", os.path.getsize(path))
+        await _finish_clip(path, profile, provider_format, trace)
+    return run
+
+
+async def synthesize_speech_async(text, output_audio_path, eleven_key, trace=None, profile=None):
+    profile = get_profile(profile)
+    if eleven_key:
+        voice_id = await asyncio.to_thread(resolve_voice_id, eleven_key)
+        output_format = profile.elevenlabs_format
+        return await synthesize_cached_async(
+            text, "elevenlabs", voice_id, ELEVENLABS_MODEL_ID, cache_format(profile, output_format),
+            _timed_synth(
+                lambda path: text_to_speech_with_elevenlabs_async(
+                    input_text=text, output_filepath=path, voice_id=voice_id, output_format=output_format),
+                "elevenlabs", trace, profile, output_format
+            ),
+            output_audio_path
+        )
+    return await synthesize_cached_async(
+        text, "gtts", "en", "gtts", cache_format(profile, "mp3"),
+        _timed_synth(lambda path: text_to_speech_with_gtts_async(text, path), "gtts", trace, profile, "mp3"),
+        output_audio_path
+    )
+
+
+async def _clip(coro):
+    yield await coro
+
+
+async def _elevenlabs_segments(text, output_audio_path, eleven_key, trace, profile):
+    voice_id = await asyncio.to_thread(resolve_voice_id, eleven_key)
+    segment_prefix = os.path.splitext(output_audio_path)[0]
+    output_format = profile.elevenlabs_format
+
+    async def stream_synth(path):
+        async with span("tts", "elevenlabs", trace):
+            async for segment in stream_tts_with_elevenlabs_async(text, path, voice_id, segment_prefix, output_format):
+                yield segment
+        record_payload("tts", "received", os.path.getsize(path))
+        # The segments went out as streamed; the clip kept for later hits is normalized
+        await _finish_clip(path, profile, output_format, trace)
+
+    async for segment in synthesize_cached_stream_async(
+        text, "elevenlabs", voice_id, ELEVENLABS_MODEL_ID, cache_format(profile, output_format),
+        stream_synth, output_audio_path
+    ):
+        yield segment
+
+
+async def stream_speech_async(text, output_audio_path, eleven_key, trace=None, profile=None):
+    """
+    Async generator of playable paths for `text`: several short segments
+    while ElevenLabs is still streaming, or a single clip (cache hit, gTTS,
+    STREAMING_TTS=0), in the client's audio profile (tts_profiles.py).
+    ElevenLabs is hedged with a gTTS clip when its first segment misses
+    TTS_HEDGE_BUDGET_MS (tts_hedge.py).
+    """
+    profile = get_profile(profile)
+    if not eleven_key:
+        yield await synthesize_speech_async(text, output_audio_path, None, trace, profile)
+        return
+
+    if STREAMING_TTS:
+        primary = _elevenlabs_segments(text, output_audio_path, eleven_key, trace, profile)
+    else:
+        primary = _clip(synthesize_speech_async(text, output_audio_path, eleven_key, trace, profile))
+    fallback_path = f"{os.path.splitext(output_audio_path)[0]}.gtts{profile.extension}"
+    async for segment in hedge_stream_async(
+        primary, lambda: synthesize_speech_async(text, fallback_path, None, trace, profile)
+    ):
+        yield segment
+
+
+def _start_speech(text, output_audio_path, eleven_key, trace, profile):
+    """
+    Starts synthesis in its own task. Returns (task, queue): the queue gets
+    every playable path, then the exception if synthesis failed, then None.
+    """
+    segments = asyncio.Queue()
+
+    async def run():
+        try:
+            async for segment in stream_speech_async(text, output_audio_path, eleven_key, trace, profile):
+                segments.put_nowait(segment)
+        except Exception as e:
+            segments.put_nowait(e)
+        finally:
+            segments.put_nowait(None)
+
+    return asyncio.create_task(run()), segments
+
+
+async def _single(text):
+    yield text
+
+
+async def _reply_sentences(rag_prompt, encoded, speech_to_text_output, retrieved_context, history, trace):
+    if not (encoded or speech_to_text_output):
+        return _single(NO_INPUT_MESSAGE)
+    llm_cache = get_llm_cache()
+    # The key hashes the image pixels: keep that off the event loop
+    cache_key, cached_reply = await asyncio.to_thread(
+        llm_cache.lookup, LLM_MODEL, SYSTEM_PROMPT_VERSION, encoded, speech_to_text_output, retrieved_context, history)
+    if cached_reply is not None:
+        return aiter_sentences(_single(cached_reply))
+    if STREAMING_TTS:
+        return aiter_sentences(llm_cache.tee_async(cache_key, timed_aiter(stream_image_with_query_async(
+            query=rag_prompt,
+            encoded_image=encoded,
+            model=LLM_MODEL,
+            system=system_prompt
+        ), trace.span("llm", "groq"))))
+    async with trace.span("llm", "groq"):
+        reply = await analyze_image_with_query_async(
+            query=rag_prompt,
+            encoded_image=encoded,
+            model=LLM_MODEL,
+            system=system_prompt
+        )
+    llm_cache.put(cache_key, reply)
+    return _single(reply)
+
+
+# -----------------------------
+# MAIN PROCESS FUNCTION (ASYNC)
+# -----------------------------
+async def process_inputs_async(audio_filepath, image_filepath, documents, transcript=None, session_id=None,
+                               tts_profile=None, errors=None):
+    """
+    Async generator with the same outputs as pipeline.process_inputs:
+    (transcript, context, doctor_response, audio) tuples, progressively.
+    A `transcript` that is already known (live microphone mode) replaces
+    speech to text; `session_id`, `tts_profile` and `errors` are as in
+    pipeline.process_inputs.
+    """
+    trace = RequestTrace("async_pipeline" if transcript is None else "live")
+    replies = _process_inputs_async(
+        trace, audio_filepath, image_filepath, documents, transcript, session_id, tts_profile, errors)
+    try:
+        async for outputs in replies:
+            yield outputs
+    finally:
+        # close the inner generator now (not at GC) so its producer and TTS tasks are cancelled
+        await replies.aclose()
+        trace.finish()
+
+
+async def _process_inputs_async(trace, audio_filepath, image_filepath, documents, transcript=None, session_id=None,
+                                tts_profile=None, errors=None):
+    # API KEYS
+    groq_key = os.environ.get("GROQ_API_KEY")
+    if not groq_key:
+        yield "", "", report_error(errors, "Error: GROQ_API_KEY not set"), None
+        return
+
+    eleven_key = os.environ.get("ELEVENLABS_API_KEY") or os.environ.get("ELEVEN_API_KEY")
+
+    # SESSION (earlier turns of this consultation; a follow-up reuses their image and index)
+    session = open_session(session_id)
+    history = session.history(LLM_MODEL) if session is not None else ""
+
+    # INDEPENDENT STAGES, CONCURRENTLY:
+    # speech to text | image preprocessing | document ingestion + index
+    async def transcribe():
+        if transcript is not None:
+            return transcript
+        if not audio_filepath:
+            return ""
+        async with trace.span("stt", "groq"):
+            return await transcribe_with_groq_async(
+                GROQ_API_KEY=groq_key,
+                audio_filepath=audio_filepath,
+                stt_model=STT_MODEL
+            )
+
+    async def encode():
+        if not image_filepath:
+            return session_image(session, None)
+        async with trace.span("image_encode"):
+            return await asyncio.to_thread(session_image, session, image_filepath)
+
+    async def prepare():
+        async with trace.span("document_ingest"):
+            return await asyncio.to_thread(session_documents, session, documents)
+
+    stt_result, image_result, prepared = await asyncio.gather(
+        transcribe(),
+        encode(),
+        prepare(),
+        return_exceptions=True
+    )
+
+    if isinstance(stt_result, Exception):
+        yield "", "", report_error(errors, f"Error transcribing audio: {stt_result}"), None
+        return
+    speech_to_text_output = stt_result
+    if isinstance(prepared, Exception):
+        # Like the other stages: reported in the output, and the reply goes ahead without documents
+        prepared = None, report_error(errors, f"Error ingesting documents: {prepared}")
+
+    # RAG CONTEXT (only the search needs the transcript)
+    async with trace.span("retrieval"):
+        retrieved_context = await asyncio.to_thread(retrieve_context, prepared, speech_to_text_output, history)
+    yield speech_to_text_output, retrieved_context, "", None
+
+    # RAG PROMPT
+    rag_prompt = build_rag_prompt(retrieved_context, speech_to_text_output, trace, history)
+
+    # IMAGE / LLM ANALYSIS -> sentences, each handed to TTS as soon as it is complete
+    pending = asyncio.Queue()
+    artifacts = get_artifact_store().new_request()
+    profile = get_profile(tts_profile)
+    tts_tasks = []
+
+    def speak(text, index):
+        task, segments = _start_speech(
+            text, artifacts.path(f"reply_{index:02d}{profile.extension}"), eleven_key, trace, profile)
+        tts_tasks.append(task)
+        return segments
+
+    reply = []  # only a complete model reply becomes a session turn
+
+    async def produce():
+        index = 0
+        try:
+            if isinstance(image_result, Exception):
+                raise image_result
+            sentences = await _reply_sentences(
+                rag_prompt, image_result, speech_to_text_output, retrieved_context, history, trace)
+            async for sentence in sentences:
+                reply.append(sentence)
+                await pending.put((sentence, speak(sentence, index)))
+                index += 1
+            if reply != [NO_INPUT_MESSAGE]:
+                finish_session_turn(session, speech_to_text_output, " ".join(reply), retrieved_context)
+        except Exception as e:
+            # Like the sync pipeline: an error before any reply text is spoken, a mid-stream one is only shown
+            message = report_error(errors, f"Error running model: {e}")
+            await pending.put((message, speak(message, 0) if index == 0 else None))
+        finally:
+            await pending.put(None)
+
+    producer = asyncio.create_task(produce())
+    spoken = []
+    try:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            sentence, segments = item
+            spoken.append(sentence)
+            played = False
+            # Every segment of sentence N is yielded before any of sentence N+1
+            while segments is not None:
+                segment = await segments.get()
+                if segment is None:
+                    break
+                if isinstance(segment, Exception):
+                    spoken.append(report_error(errors, f"TTS error: {segment}"))
+                    continue
+                trace.first_audio_ready()
+                played = True
+                record_served(profile, segment)
+                yield speech_to_text_output, retrieved_context, " ".join(spoken), segment
+            if not played:
+                yield speech_to_text_output, retrieved_context, " ".join(spoken), None
+    finally:
+        # Client went away mid-reply: stop generating and synthesizing
+        producer.cancel()
+        for task in tts_tasks:
+            task.cancel()
@@ -0,0 +1,156 @@
+# audio_preprocess.py
+#
+# Audio preprocessing before upload to Whisper:
+#   decode (pydub/ffmpeg) -> 16 kHz mono 16-bit -> trim leading/trailing
+#   silence with an energy-based VAD -> encode to a compact format in memory.
+# A 48 kHz stereo WAV with silence at both ends shrinks by ~95% with FLAC
+# (lossless) and more with Opus. Transcription latency and upload size are
+# exported per mode (raw / preprocessed), so the two can be compared on
+# /metrics (AUDIO_PREPROCESS=0 gives the baseline):
+#   ai_doctor_transcription_seconds{mode}            STT call latency
+#   ai_doctor_transcription_upload_bytes_total{mode} bytes sent to Whisper
+#   ai_doctor_audio_bytes_saved_total                original minus uploaded bytes
+#   ai_doctor_audio_trimmed_seconds_total            silence cut by the VAD
+#   ai_doctor_audio_preprocess_seconds               decode + trim + encode time
+
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+
+from metrics import Counter, Histogram, record_payload
+from uploads import Upload, open_source, source_size
+
+
+AUDIO_PREPROCESS = os.environ.get("AUDIO_PREPROCESS", "1") != "0"
+AUDIO_UPLOAD_FORMAT = os.environ.get("AUDIO_UPLOAD_FORMAT", "flac")  # flac | ogg (opus) | mp3
+AUDIO_OPUS_BITRATE = os.environ.get("AUDIO_OPUS_BITRATE", "24k")
+TARGET_SAMPLE_RATE = 16000
+
+VAD_FRAME_MS = 30
+VAD_PADDING_MS = 250           # kept around the speech so word onsets are not clipped
+VAD_FLOOR_DBFS = -50.0         # frames quieter than this are always silence
+VAD_BELOW_PEAK_DB = 35.0       # ... and so are frames this far below the loudest frame
+
+STT_SECONDS = Histogram(
+    "ai_doctor_transcription_seconds", "Speech-to-text call latency by upload mode (raw, preprocessed).", ["mode"])
+STT_UPLOAD_BYTES = Counter(
+    "ai_doctor_transcription_upload_bytes_total", "Audio bytes uploaded for transcription by mode.", ["mode"])
+AUDIO_BYTES_SAVED = Counter(
+    "ai_doctor_audio_bytes_saved_total", "Upload bytes saved by audio preprocessing.")
+AUDIO_TRIMMED_SECONDS = Counter(
+    "ai_doctor_audio_trimmed_seconds_total", "Leading/trailing silence removed before transcription.")
+AUDIO_PREPROCESS_SECONDS = Histogram(
+    "ai_doctor_audio_preprocess_seconds", "Decode, trim and encode time per recording.")
+
+_EXPORT_ARGS = {
+    "flac": {"format": "flac"},
+    "ogg": {"format": "ogg", "codec": "libopus", "bitrate": AUDIO_OPUS_BITRATE},
+    "mp3": {"format": "mp3", "bitrate": "32k"},
+}
+
+
+# -----------------------------
+# VAD
+# -----------------------------
+def frame_dbfs(samples, sample_rate, frame_ms=VAD_FRAME_MS):
+    """RMS level in dBFS of consecutive frames of 16-bit mono samples."""
+    frame = max(1, sample_rate * frame_ms // 1000)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return np.zeros(0)
+    frames = samples[:n_frames * frame].astype(np.float64).reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1.0) / 32768.0)
+
+
+def voiced_mask(levels):
+    if len(levels) == 0:
+        return np.zeros(0, dtype=bool)
+    threshold = max(VAD_FLOOR_DBFS, levels.max() - VAD_BELOW_PEAK_DB)
+    return levels > threshold
+
+
+def speech_bounds_ms(samples, sample_rate):
+    """(start_ms, end_ms) of the speech in `samples`, or None if it is all silence."""
+    voiced = np.flatnonzero(voiced_mask(frame_dbfs(samples, sample_rate)))
+    if len(voiced) == 0:
+        return None
+    duration_ms = len(samples) * 1000 // sample_rate
+    start = max(0, voiced[0] * VAD_FRAME_MS - VAD_PADDING_MS)
+    end = min(duration_ms, (voiced[-1] + 1) * VAD_FRAME_MS + VAD_PADDING_MS)
+    return int(start), int(end)
+
+
+# -----------------------------
+# PREPROCESS
+# -----------------------------
+def load_speech(audio_filepath):
+    """Decodes the file (or in-memory Upload) as 16 kHz mono 16-bit (pydub AudioSegment)."""
+    from pydub import AudioSegment
+    # A buffer has no extension for ffmpeg to go by; the upload's file name does
+    extension = os.path.splitext(audio_filepath.filename or "")[1] if isinstance(audio_filepath, Upload) else ""
+    audio = AudioSegment.from_file(open_source(audio_filepath), format=extension[1:].lower() or None)
+    return audio.set_channels(1).set_frame_rate(TARGET_SAMPLE_RATE).set_sample_width(2)
+
+
+def segment_samples(audio):
+    return np.frombuffer(audio.raw_data, dtype=np.int16)
+
+
+def encode_for_upload(audio, upload_format=None):
+    """Encodes an AudioSegment in memory; returns (filename, bytes)."""
+    upload_format = upload_format or AUDIO_UPLOAD_FORMAT
+    out = BytesIO()
+    audio.export(out, **_EXPORT_ARGS[upload_format])
+    return f"speech.{upload_format}", out.getvalue()
+
+
+def load_trimmed(audio_filepath):
+    """
+    Decodes, resamples and silence-trims the recording. Returns
+    (AudioSegment, stats); silence-only recordings are kept whole (just
+    resampled) rather than trimmed to nothing.
+    """
+    started = time.perf_counter()
+    original_bytes = source_size(audio_filepath)
+    audio = load_speech(audio_filepath)
+    original_ms = len(audio)
+
+    bounds = speech_bounds_ms(segment_samples(audio), TARGET_SAMPLE_RATE)
+    if bounds is not None:
+        audio = audio[bounds[0]:bounds[1]]
+
+    stats = {
+        "original_bytes": original_bytes,
+        "trimmed_ms": original_ms - len(audio),
+        "duration_ms": len(audio),
+        "preprocess_seconds": time.perf_counter() - started,
+    }
+    return audio, stats
+
+
+def finish_stats(stats, upload_bytes, encode_seconds=0.0):
+    stats["upload_bytes"] = upload_bytes
+    stats["bytes_saved"] = stats["original_bytes"] - upload_bytes
+    stats["preprocess_seconds"] += encode_seconds
+    return stats
+
+
+# -----------------------------
+# REPORTING
+# -----------------------------
+def record_transcription(stats, upload_bytes, stt_seconds):
+    """
+    Records one transcription. `stats` is finish_stats()'s result, or None
+    for a raw upload.
+    """
+    mode = "preprocessed" if stats else "raw"
+    record_payload("stt", "sent", upload_bytes)
+    STT_SECONDS.observe(stt_seconds, mode=mode)
+    STT_UPLOAD_BYTES.inc(upload_bytes, mode=mode)
+    if stats:
+        AUDIO_BYTES_SAVED.inc(max(0, stats["bytes_saved"]))
+        AUDIO_TRIMMED_SECONDS.inc(stats["trimmed_ms"] / 1000)
+        AUDIO_PREPROCESS_SECONDS.observe(stats["preprocess_seconds"])
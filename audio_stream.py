@@ -0,0 +1,178 @@
+# audio_stream.py
+#
+# Streaming TTS output. Chunks from the provider are appended to the clip
+# file as they arrive (nothing is collected in memory), and the MP3 stream
+# is also cut at frame boundaries into short segment files, each playable on
+# its own. The UI yields those segments to its streaming gr.Audio, so
+# playback starts after the first ~0.5 s of audio has arrived instead of
+# after the whole sentence has been synthesized. Memory held per clip is
+# bounded by one segment, whatever the length of the reply.
+
+import os
+import shutil
+
+
+STREAM_FIRST_SEGMENT_BYTES = int(os.environ.get("TTS_STREAM_FIRST_SEGMENT_BYTES", 8 * 1024))  # ~0.5 s at 128 kbps
+STREAM_SEGMENT_BYTES = int(os.environ.get("TTS_STREAM_SEGMENT_BYTES", 32 * 1024))             # ~2 s at 128 kbps
+# If no MP3 frame shows up in this many bytes the stream is not cut (other output formats)
+MP3_SYNC_SEARCH_BYTES = 16 * 1024
+
+# Layer III bitrates (kbps) by bitrate index
+_BITRATES_V1 = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+_BITRATES_V2 = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+# Sample rates by version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+# -----------------------------
+# MP3 FRAMES
+# -----------------------------
+def mp3_frame_length(header):
+    """Length in bytes of the MPEG Layer III frame starting with `header` (4 bytes), or 0 if it is not one."""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return 0
+    version = (header[1] >> 3) & 3
+    layer = (header[1] >> 1) & 3
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return 0
+    bitrate = (_BITRATES_V1 if version == 3 else _BITRATES_V2)[bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 1
+    return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+
+def _id3_length(data):
+    """Size of a leading ID3v2 tag, 0 if there is none, None if the header is still incomplete."""
+    if len(data) < 10:
+        return None if b"ID3".startswith(bytes(data[:3])) else 0
+    if data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+class Mp3FrameSplitter:
+    """Buffers an MP3 byte stream and hands out runs of whole frames."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.complete = 0     # bytes at the front of the buffer that end on a frame boundary
+        self.is_mp3 = None    # unknown until the first frame (or MP3_SYNC_SEARCH_BYTES without one)
+        self._pos = 0         # where scanning resumes
+        self._started = False
+
+    def feed(self, data):
+        self.buffer += data
+        self._scan()
+
+    def _scan(self):
+        buf = self.buffer
+        if not self._started:
+            tag = _id3_length(buf)
+            if tag is None:
+                return
+            self._started = True
+            self._pos = tag  # the tag goes out with the first segment
+        pos = self._pos
+        while pos + 4 <= len(buf):
+            length = mp3_frame_length(buf[pos:pos + 4])
+            if length:
+                if pos + length > len(buf):
+                    break
+                self.is_mp3 = True
+                pos += length
+                self.complete = pos
+                continue
+            # Not a frame header: resync on the next 0xFF (decoders skip the junk too)
+            nxt = buf.find(b"\xff", pos + 1)
+            pos = len(buf) if nxt < 0 else nxt
+            if self.is_mp3 is None and pos > MP3_SYNC_SEARCH_BYTES:
+                self.is_mp3 = False
+                break
+        self._pos = pos
+
+    def take(self, min_bytes):
+        """Whole frames buffered so far, if at least `min_bytes` of them; else None."""
+        if not self.is_mp3 or self.complete < min_bytes:
+            return None
+        out = bytes(self.buffer[:self.complete])
+        del self.buffer[:self.complete]
+        self._pos -= self.complete
+        self.complete = 0
+        return out
+
+    def flush(self):
+        out = bytes(self.buffer)
+        self.buffer.clear()
+        self.complete = self._pos = 0
+        return out
+
+
+# -----------------------------
+# WRITER
+# -----------------------------
+class StreamingAudioWriter:
+    """
+    Appends provider chunks to `path` as they arrive. With `segment_prefix`,
+    every run of whole MP3 frames (first STREAM_FIRST_SEGMENT_BYTES, then
+    STREAM_SEGMENT_BYTES) is also written to "<prefix>.partNN.mp3"; write()
+    and close() return the paths of segments that became ready.
+    """
+
+    def __init__(self, path, segment_prefix=None):
+        self.path = path
+        self.segment_prefix = segment_prefix
+        self.bytes_written = 0
+        self.segments = []
+        self._file = open(path, "wb")
+        self._splitter = Mp3FrameSplitter() if segment_prefix else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._file.closed:
+            self._file.close()
+        return False
+
+    def _segment(self, data):
+        path = f"{self.segment_prefix}.part{len(self.segments):02d}.mp3"
+        with open(path, "wb") as f:
+            f.write(data)
+        self.segments.append(path)
+        return path
+
+    def write(self, chunk):
+        if not chunk:
+            return []
+        self._file.write(chunk)
+        self.bytes_written += len(chunk)
+        if self._splitter is None:
+            return []
+        self._splitter.feed(chunk)
+        if self._splitter.is_mp3 is False:
+            # Not MP3: keep appending to the clip, no segments
+            self._splitter = None
+            return []
+        min_bytes = STREAM_SEGMENT_BYTES if self.segments else STREAM_FIRST_SEGMENT_BYTES
+        data = self._splitter.take(min_bytes)
+        return [self._segment(data)] if data else []
+
+    def close(self):
+        """Finishes the clip; returns the last segment (the whole clip if it was never cut)."""
+        self._file.close()
+        if self.segment_prefix is None:
+            return []
+        if self._splitter is None or not self.segments:
+            if not self.bytes_written:
+                return []
+            # Too short to cut, or not MP3: a copy of the whole clip is the only segment
+            # (the clip itself may be moved into the TTS cache right after)
+            segment = f"{self.segment_prefix}.part00{os.path.splitext(self.path)[1]}"
+            shutil.copyfile(self.path, segment)
+            self.segments.append(segment)
+            return [segment]
+        rest = self._splitter.flush()
+        return [self._segment(rest)] if rest else []
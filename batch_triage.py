@@ -0,0 +1,222 @@
+# batch_triage.py
+#
+# Offline triage of stored cases with the same pipeline as the Gradio UI
+# (pipeline.process_inputs), for overnight back-office runs.
+#
+#   python batch_triage.py cases.jsonl --out triage_out --workers 4
+#   python batch_triage.py cases_dir/  --out triage_out --stt-rpm 20 --llm-rpm 30
+#
+# Input is either
+#   - a JSONL manifest, one case per line:
+#       {"case_id": "c001", "audio": "c001/question.mp3", "image": "c001/face.jpg", "documents": ["guide.pdf"]}
+#     (paths relative to the manifest; every field but case_id is optional), or
+#   - a directory with one sub-directory per case; the first audio file,
+#     the first image and every .pdf/.txt inside it make up the case.
+#
+# Results are appended to <out>/results.jsonl as cases finish and the reply
+# audio is copied to <out>/audio/<case_id>/. The results file is also the
+# checkpoint: re-running the same command skips cases already in it
+# (--retry-failed re-runs the ones that ended in an error).
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".ogg", ".flac", ".webm")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+DOCUMENT_EXTENSIONS = (".pdf", ".txt")
+
+
+# -----------------------------
+# CASES
+# -----------------------------
+def _resolve(base, path):
+    return path if not path or os.path.isabs(path) else os.path.join(base, path)
+
+
+def load_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "case_id" not in entry:
+                raise ValueError(f"{path}:{line_no}: case without case_id")
+            cases.append({
+                "case_id": str(entry["case_id"]),
+                "audio": _resolve(base, entry.get("audio")),
+                "image": _resolve(base, entry.get("image")),
+                "documents": [_resolve(base, d) for d in entry.get("documents") or []],
+            })
+    return cases
+
+
+def load_directory(root):
+    cases = []
+    for entry in sorted(os.scandir(root), key=lambda e: e.name):
+        if not entry.is_dir():
+            continue
+        files = sorted(os.path.join(entry.path, name) for name in os.listdir(entry.path))
+        by_ext = lambda exts: [f for f in files if f.lower().endswith(exts)]
+        audio, images = by_ext(AUDIO_EXTENSIONS), by_ext(IMAGE_EXTENSIONS)
+        cases.append({
+            "case_id": entry.name,
+            "audio": audio[0] if audio else None,
+            "image": images[0] if images else None,
+            "documents": by_ext(DOCUMENT_EXTENSIONS),
+        })
+    return cases
+
+
+def load_cases(source):
+    return load_directory(source) if os.path.isdir(source) else load_manifest(source)
+
+
+# -----------------------------
+# CHECKPOINT (the results file)
+# -----------------------------
+def read_checkpoint(results_path):
+    """{case_id: result} for every complete line; a torn last line (killed mid-write) is cut off."""
+    done = {}
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue
+        done[result["case_id"]] = result
+    return done
+
+
+class ResultWriter:
+    def __init__(self, results_path):
+        self._file = open(results_path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, result):
+        with self._lock:
+            self._file.write(json.dumps(result) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+# -----------------------------
+# RUN ONE CASE
+# -----------------------------
+def run_case(case, audio_dir):
+    from pipeline import process_inputs
+
+    started = time.perf_counter()
+    outputs = ("", "", "", None)
+    errors = []  # every failure the pipeline reported, wherever it shows in the outputs
+    audio_files = []
+    first_audio = None
+    case_audio_dir = os.path.join(audio_dir, case["case_id"])
+    try:
+        for outputs in process_inputs(case["audio"], case["image"], case["documents"], errors=errors):
+            if outputs[3]:
+                if first_audio is None:
+                    first_audio = time.perf_counter() - started
+                # Copy out: artifacts are garbage-collected and cache entries can be evicted
+                os.makedirs(case_audio_dir, exist_ok=True)
+                target = os.path.join(case_audio_dir, f"reply_{len(audio_files):02d}{os.path.splitext(outputs[3])[1]}")
+                shutil.copyfile(outputs[3], target)
+                audio_files.append(os.path.relpath(target, os.path.dirname(audio_dir)))
+        error = "; ".join(errors) or None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    return {
+        "case_id": case["case_id"],
+        "transcript": outputs[0],
+        "context": outputs[1],
+        "response": outputs[2],
+        "audio": audio_files,
+        "seconds": round(time.perf_counter() - started, 3),
+        "time_to_first_audio": round(first_audio, 3) if first_audio is not None else None,
+        "error": error,
+    }
+
+
+# -----------------------------
+# BATCH
+# -----------------------------
+def run_batch(cases, out_dir, workers, retry_failed=False):
+    os.makedirs(out_dir, exist_ok=True)
+    results_path = os.path.join(out_dir, "results.jsonl")
+    audio_dir = os.path.join(out_dir, "audio")
+    done = read_checkpoint(results_path)
+    todo = [c for c in cases if c["case_id"] not in done or (retry_failed and done[c["case_id"]].get("error"))]
+    print(f"📋 {len(cases)} cases, {len(cases) - len(todo)} already done, {len(todo)} to run with {workers} workers")
+    if not todo:
+        return 0, 0
+
+    writer = ResultWriter(results_path)
+    started = time.perf_counter()
+    finished = failed = 0
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(run_case, case, audio_dir): case for case in todo}
+        for future in as_completed(futures):
+            result = future.result()
+            writer.write(result)
+            finished += 1
+            failed += bool(result["error"])
+            rate = finished / (time.perf_counter() - started) * 60
+            status = "❌ " + result["error"][:80] if result["error"] else "✅"
+            print(f"[{finished}/{len(todo)}] {result['case_id']} {result['seconds']:.1f}s {status}  ({rate:.1f} cases/min)")
+    except KeyboardInterrupt:
+        print("⏸️ interrupted; finished cases are saved, re-run the same command to resume")
+        raise
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"🏁 {finished} cases in {elapsed:.0f}s ({finished / elapsed * 60:.1f} cases/min), {failed} failed")
+    return finished, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the AI doctor pipeline over stored cases.")
+    parser.add_argument("source", help="JSONL manifest or directory with one sub-directory per case")
+    parser.add_argument("--out", default="triage_out", help="output directory (results.jsonl + audio/)")
+    parser.add_argument("--workers", type=int, default=4, help="cases processed concurrently")
+    parser.add_argument("--retry-failed", action="store_true", help="re-run cases whose result has an error")
+    for provider in ("stt", "llm", "tts"):
+        parser.add_argument(f"--{provider}-rpm", type=float, help=f"{provider.upper()} requests per minute")
+        parser.add_argument(f"--{provider}-concurrency", type=int, help=f"{provider.upper()} calls in flight")
+    args = parser.parse_args()
+
+    # scheduler.py reads its limits from the environment when the limiters are created
+    for provider in ("stt", "llm", "tts"):
+        rpm = getattr(args, f"{provider}_rpm")
+        concurrency = getattr(args, f"{provider}_concurrency")
+        if rpm is not None:
+            os.environ[f"{provider.upper()}_RATE_PER_MIN"] = str(rpm)
+        if concurrency is not None:
+            os.environ[f"{provider.upper()}_CONCURRENCY"] = str(concurrency)
+
+    _, failed = run_batch(load_cases(args.source), args.out, args.workers, args.retry_failed)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# benchmarks/cold_start.py
+#
+# Measures cold-start import time of the app modules, each in a fresh
+# interpreter (no warm module cache), and reports which SDKs got imported.
+# "gradio_app" includes building the Interface, i.e. time-to-ready minus the
+# server bind.
+#
+#   python benchmarks/cold_start.py [--runs 5] [module ...]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ["pipeline", "async_pipeline", "gradio_app"]
+HEAVY_MODULES = ["groq", "elevenlabs", "gtts", "pydub", "speech_recognition"]
+
+PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def measure(module, runs):
+    samples, heavy = [], []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=REPO_ROOT, capture_output=True, text=True,
+            # No keys: nothing may reach the network at import time
+            env={k: v for k, v in os.environ.items() if not k.endswith("_API_KEY")},
+        )
+        if out.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{out.stderr}")
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result["seconds"])
+        heavy = result["heavy"]
+    return samples, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time of the app modules.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<18}{'median ms':>10}{'min ms':>10}  heavy SDKs imported")
+    for module in args.modules:
+        samples, heavy = measure(module, args.runs)
+        print(f"{module:<18}{statistics.median(samples) * 1000:>10.1f}{min(samples) * 1000:>10.1f}  {', '.join(heavy) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
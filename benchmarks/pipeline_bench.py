@@ -0,0 +1,249 @@
+# benchmarks/pipeline_bench.py
+#
+# Offline benchmark of the consultation pipeline. The real Groq and
+# ElevenLabs SDKs are pointed at benchmarks/stub_servers.py, so results are
+# reproducible on a machine without keys or network. Each scenario runs
+# --requests calls with --concurrency in flight and reports throughput,
+# p50/p95/p99 latency, time to first audio (pipelines) and peak RSS.
+#
+#   python benchmarks/pipeline_bench.py                      # all scenarios
+#   python benchmarks/pipeline_bench.py pipeline_async --requests 50 --concurrency 8 --rate-429 0.05
+#   python benchmarks/pipeline_bench.py --json results.json  # for CI comparisons
+#
+# By default the provider limiter's rate limits are lifted and the TTS, image
+# and LLM reply caches are disabled, so every call reaches a stub; --production-limits
+# and --warm-caches restore the app's defaults.
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+from stub_servers import StubServer, add_behaviour_args, behaviours_from_args, STUB_REPLY
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE = os.path.join(REPO_ROOT, "acne.jpg")
+AUDIO_FILES = [os.path.join(REPO_ROOT, name) for name in ("final_test.mp3", "gtts_testing.mp3", "final.mp3")]
+QUERY = "Is there something wrong with my face?"
+SCENARIOS = ["image_encode", "stt", "llm", "llm_stream", "tts_elevenlabs", "pipeline", "pipeline_async"]
+
+
+def configure_environment(server, args):
+    """Must run before the app modules are imported: they read their config at import time."""
+    os.environ.update(server.env())
+    scratch = tempfile.mkdtemp(prefix="ai-doctor-bench-")
+    os.environ["ARTIFACTS_DIR"] = os.path.join(scratch, "artifacts")
+    os.environ["TTS_CACHE_DIR"] = os.path.join(scratch, "tts_cache")
+    if not args.warm_caches:
+        os.environ["TTS_CACHE_MAX_BYTES"] = "0"
+        os.environ["IMAGE_CACHE_BYTES"] = "0"
+        os.environ["LLM_CACHE_MAX_BYTES"] = "0"
+    if not args.production_limits:
+        for provider in ("STT", "LLM", "TTS"):
+            os.environ[f"{provider}_RATE_PER_MIN"] = "0"
+            os.environ[f"{provider}_CONCURRENCY"] = str(max(args.concurrency, 1))
+    sys.path.insert(0, REPO_ROOT)
+
+
+# -----------------------------
+# SCENARIOS
+# -----------------------------
+def _check(outputs):
+    # The pipelines report failures in the response text instead of raising
+    response = outputs[2]
+    if response.startswith("Error") or "TTS error:" in response:
+        raise RuntimeError(response)
+
+
+def build_scenarios(scratch):
+    """name -> (fn(i) -> seconds to first audio or None, is_async)."""
+    from brain_of_the_doctor import encode_image, analyze_image_with_query, stream_image_with_query
+    from voice_of_the_patient import transcribe_with_groq
+    from voice_of_the_doctor import text_to_speech_with_elevenlabs
+    from pipeline import process_inputs, LLM_MODEL, STT_MODEL
+    from async_pipeline import process_inputs_async
+
+    encoded = encode_image(IMAGE)
+
+    def audio(i):
+        return AUDIO_FILES[i % len(AUDIO_FILES)]
+
+    def run_stream(i):
+        for _ in stream_image_with_query(query=QUERY, model=LLM_MODEL, encoded_image=encoded):
+            pass
+
+    def run_pipeline(i):
+        started = time.perf_counter()
+        first_audio = None
+        for outputs in process_inputs(audio(i), IMAGE, None):
+            _check(outputs)
+            if outputs[3] and first_audio is None:
+                first_audio = time.perf_counter() - started
+        return first_audio
+
+    async def run_pipeline_async(i):
+        started = time.perf_counter()
+        first_audio = None
+        async for outputs in process_inputs_async(audio(i), IMAGE, None):
+            _check(outputs)
+            if outputs[3] and first_audio is None:
+                first_audio = time.perf_counter() - started
+        return first_audio
+
+    def stage(call):
+        # stage results are not timings; only the pipelines report time to first audio
+        def run(i):
+            call(i)
+        return run, False
+
+    return {
+        "image_encode": stage(lambda i: encode_image(IMAGE)),
+        "stt": stage(lambda i: transcribe_with_groq(STT_MODEL, audio(i), os.environ["GROQ_API_KEY"])),
+        "llm": stage(lambda i: analyze_image_with_query(query=QUERY, model=LLM_MODEL, encoded_image=encoded)),
+        "llm_stream": stage(run_stream),
+        "tts_elevenlabs": stage(
+            lambda i: text_to_speech_with_elevenlabs(STUB_REPLY, os.path.join(scratch, f"tts_{i}.mp3"))),
+        "pipeline": (run_pipeline, False),
+        "pipeline_async": (run_pipeline_async, True),
+    }
+
+
+# -----------------------------
+# RUNNERS
+# -----------------------------
+def _timed(fn, i):
+    started = time.perf_counter()
+    try:
+        first_audio = fn(i)
+    except Exception as e:
+        return time.perf_counter() - started, None, repr(e)
+    return time.perf_counter() - started, first_audio, None
+
+
+def run_threads(fn, requests, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda i: _timed(fn, i), range(requests)))
+
+
+def run_async(fn, requests, concurrency):
+    async def main():
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with gate:
+                started = time.perf_counter()
+                try:
+                    first_audio = await fn(i)
+                except Exception as e:
+                    return time.perf_counter() - started, None, repr(e)
+                return time.perf_counter() - started, first_audio, None
+
+        return await asyncio.gather(*(one(i) for i in range(requests)))
+    return asyncio.run(main())
+
+
+# -----------------------------
+# REPORT
+# -----------------------------
+def percentiles(samples):
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    if len(samples) == 1:
+        return {"p50": samples[0], "p95": samples[0], "p99": samples[0]}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(name, results, wall_seconds):
+    latencies = [seconds for seconds, _, error in results if error is None]
+    first_audio = [fa for _, fa, error in results if error is None and fa is not None]
+    errors = [error for _, _, error in results if error is not None]
+    return {
+        "scenario": name,
+        "requests": len(results),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput_rps": len(latencies) / wall_seconds if wall_seconds else 0.0,
+        "latency_s": percentiles(latencies),
+        "time_to_first_audio_s": percentiles(first_audio),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _ms(value):
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+
+def print_report(rows, stub_counts):
+    print(f"{'scenario':<16}{'ok/n':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttfa p50':>10}{'rss MB':>9}")
+    for row in rows:
+        lat = row["latency_s"]
+        ok = row["requests"] - row["errors"]
+        rss = f"{row['peak_rss_mb']:.0f}" if row["peak_rss_mb"] is not None else "-"
+        print(f"{row['scenario']:<16}{ok:>4}/{row['requests']:<4}{row['throughput_rps']:>8.2f}"
+              f"{_ms(lat['p50']):>9}{_ms(lat['p95']):>9}{_ms(lat['p99']):>9}"
+              f"{_ms(row['time_to_first_audio_s']['p50']):>10}{rss:>9}")
+        if row["first_error"]:
+            print(f"    first error: {row['first_error']}")
+    print("stub calls:", ", ".join(f"{name}={count}" for name, count in sorted(stub_counts.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark against local provider stubs.")
+    parser.add_argument("scenarios", nargs="*", default=SCENARIOS, metavar="scenario",
+                        help=f"any of: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--requests", type=int, default=20, help="timed calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1, help="untimed calls per scenario first")
+    parser.add_argument("--production-limits", action="store_true", help="keep the app's provider rate limits")
+    parser.add_argument("--warm-caches", action="store_true", help="keep the TTS, image and LLM reply caches enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    add_behaviour_args(parser)
+    args = parser.parse_args()
+    unknown = sorted(set(args.scenarios) - set(SCENARIOS))
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    server = StubServer(behaviours_from_args(args), seed=args.seed).start()
+    configure_environment(server, args)
+    scratch = tempfile.mkdtemp(prefix="ai-doctor-bench-out-")
+    scenarios = build_scenarios(scratch)
+
+    rows = []
+    for name in args.scenarios:
+        fn, is_async = scenarios[name]
+        runner = run_async if is_async else run_threads
+        if args.warmup:
+            runner(fn, args.warmup, 1)
+        started = time.perf_counter()
+        results = runner(fn, args.requests, args.concurrency)
+        rows.append(summarize(name, results, time.perf_counter() - started))
+
+    print_report(rows, server.counts)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows, "stub_calls": server.counts}, f, indent=2)
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
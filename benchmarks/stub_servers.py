@@ -0,0 +1,268 @@
+# benchmarks/stub_servers.py
+#
+# Local HTTP stand-ins for the provider endpoints the app calls, so the
+# pipeline can be benchmarked without keys or network:
+#   Groq        POST /openai/v1/chat/completions        (JSON or SSE stream)
+#               POST /openai/v1/audio/transcriptions    (multipart upload)
+#               GET  /openai/v1/models                  (warm-up)
+#   ElevenLabs  POST /v1/text-to-speech/<voice_id>      (chunked mp3 bytes)
+#               GET  /v1/voices
+# Every endpoint has its own Behaviour: time to first byte (latency +-
+# jitter), streaming chunk size and spacing, and a 429 rate. The real SDKs
+# are pointed here with GROQ_BASE_URL and ELEVENLABS_BASE_URL.
+#
+#   python benchmarks/stub_servers.py --latency-ms 300 --rate-429 0.05
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_AUDIO = os.path.join(REPO_ROOT, "gtts_testing.mp3")
+
+STUB_REPLY = (
+    "With what I see, I think you have mild acne on your cheeks and forehead. "
+    "Wash twice a day with a gentle cleanser and try a benzoyl peroxide gel, "
+    "and see a dermatologist if it does not improve in a few weeks."
+)
+STUB_TRANSCRIPT = "Is there something wrong with my face? I have these red spots on my cheeks."
+STUB_VOICE_ID = "stubvoice0000000000"
+
+
+class Behaviour:
+    """How one endpoint responds. Times are in milliseconds."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, chunk_size=0, chunk_interval_ms=0.0,
+                 rate_429=0.0, retry_after_ms=100):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.chunk_size = chunk_size              # words per chat delta / bytes per audio chunk (0 = one piece)
+        self.chunk_interval_ms = chunk_interval_ms
+        self.rate_429 = rate_429
+        self.retry_after_ms = retry_after_ms
+
+    def first_byte_delay(self, rng):
+        return max(0.0, self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+
+# Typical free-tier numbers; override per endpoint with StubServer(behaviours={...})
+DEFAULT_BEHAVIOURS = {
+    "chat": Behaviour(latency_ms=250, jitter_ms=50, chunk_size=3, chunk_interval_ms=15),
+    "transcription": Behaviour(latency_ms=400, jitter_ms=80),
+    "tts": Behaviour(latency_ms=300, jitter_ms=60, chunk_size=4096, chunk_interval_ms=10),
+    "default": Behaviour(latency_ms=20),
+}
+
+
+def _route(method, path):
+    path = path.split("?", 1)[0]
+    if method == "POST" and path.endswith("/chat/completions"):
+        return "chat"
+    if method == "POST" and path.endswith("/audio/transcriptions"):
+        return "transcription"
+    if method == "POST" and path.startswith("/v1/text-to-speech/"):
+        return "tts"
+    if method == "GET" and (path.endswith("/models") or path.startswith("/v1/voices")):
+        return "default"
+    return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        stub = self.server.stub
+        endpoint = _route(method, self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if endpoint is None:
+            return self._json(404, {"error": {"message": f"stub has no route for {method} {self.path}"}})
+
+        behaviour = stub.behaviour(endpoint)
+        with stub.lock:
+            delay = behaviour.first_byte_delay(stub.rng)
+            throttled = stub.rng.random() < behaviour.rate_429
+            stub.counts[endpoint] = stub.counts.get(endpoint, 0) + 1
+            if throttled:
+                stub.counts["429"] = stub.counts.get("429", 0) + 1
+        time.sleep(delay)
+
+        if throttled:
+            return self._json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_exceeded"}},
+                              {"retry-after": str(max(1, behaviour.retry_after_ms // 1000)),
+                               "retry-after-ms": str(behaviour.retry_after_ms)})
+        if endpoint == "chat":
+            request = json.loads(body or b"{}")
+            if request.get("stream"):
+                return self._chat_stream(request, behaviour)
+            return self._json(200, _completion(request.get("model", "stub"), STUB_REPLY))
+        if endpoint == "transcription":
+            return self._json(200, {"text": STUB_TRANSCRIPT})
+        if endpoint == "tts":
+            return self._audio(stub.audio, behaviour)
+        if self.path.startswith("/v1/voices"):
+            return self._json(200, {"voices": [{"voice_id": STUB_VOICE_ID, "name": "Stub", "category": "premade"}]})
+        return self._json(200, {"object": "list", "data": [{"id": "stub", "object": "model", "created": 0, "owned_by": "stub"}]})
+
+    # -----------------------------
+    # RESPONSES
+    # -----------------------------
+    def _json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _chat_stream(self, request, behaviour):
+        model = request.get("model", "stub")
+        words = STUB_REPLY.split(" ")
+        size = behaviour.chunk_size or len(words)
+        self._start_chunked("text/event-stream")
+        for i in range(0, len(words), size):
+            if i:
+                time.sleep(behaviour.chunk_interval_ms / 1000)
+            delta = " ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+            self._chunk(b"data: " + json.dumps(_chunk_event(model, delta)).encode("utf-8") + b"\n\n")
+        self._chunk(b"data: " + json.dumps(_chunk_event(model, None, "stop")).encode("utf-8") + b"\n\n")
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _audio(self, audio, behaviour):
+        size = behaviour.chunk_size or len(audio)
+        self._start_chunked("audio/mpeg")
+        for i in range(0, len(audio), size):
+            if i:
+                time.sleep(behaviour.chunk_interval_ms / 1000)
+            self._chunk(audio[i:i + size])
+        self._chunk(b"")
+
+
+def _completion(model, content):
+    return {
+        "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _chunk_event(model, content, finish_reason=None):
+    delta = {"content": content} if content is not None else {}
+    return {
+        "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+class StubServer:
+    """One server answering both providers' routes, on a daemon thread."""
+
+    def __init__(self, behaviours=None, host="127.0.0.1", port=0, seed=0, audio_path=STUB_AUDIO):
+        self.behaviours = dict(DEFAULT_BEHAVIOURS, **(behaviours or {}))
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        with open(audio_path, "rb") as f:
+            self.audio = f.read()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    def behaviour(self, endpoint):
+        return self.behaviours.get(endpoint, self.behaviours["default"])
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Environment that points the app's clients at this server."""
+        return {
+            "GROQ_API_KEY": "stub",
+            "GROQ_BASE_URL": self.url,
+            "ELEVENLABS_API_KEY": "stub",
+            "ELEVENLABS_BASE_URL": self.url,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def add_behaviour_args(parser):
+    parser.add_argument("--latency-ms", type=float, help="time to first byte for every endpoint")
+    parser.add_argument("--jitter-ms", type=float, help="+- uniform jitter on the latency")
+    parser.add_argument("--chat-chunk-words", type=int, help="words per streamed chat delta")
+    parser.add_argument("--tts-chunk-bytes", type=int, help="bytes per streamed audio chunk")
+    parser.add_argument("--chunk-interval-ms", type=float, help="gap between streamed chunks")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of calls answered with 429")
+
+
+def behaviours_from_args(args):
+    behaviours = {}
+    for name, default in DEFAULT_BEHAVIOURS.items():
+        chunk_size = default.chunk_size
+        if name == "chat" and args.chat_chunk_words is not None:
+            chunk_size = args.chat_chunk_words
+        if name == "tts" and args.tts_chunk_bytes is not None:
+            chunk_size = args.tts_chunk_bytes
+        behaviours[name] = Behaviour(
+            latency_ms=default.latency_ms if args.latency_ms is None else args.latency_ms,
+            jitter_ms=default.jitter_ms if args.jitter_ms is None else args.jitter_ms,
+            chunk_size=chunk_size,
+            chunk_interval_ms=default.chunk_interval_ms if args.chunk_interval_ms is None else args.chunk_interval_ms,
+            rate_429=args.rate_429 if name != "default" else 0.0,
+        )
+    return behaviours
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Groq / ElevenLabs stand-ins for offline benchmarks.")
+    parser.add_argument("--port", type=int, default=8790)
+    add_behaviour_args(parser)
+    args = parser.parse_args()
+
+    server = StubServer(behaviours_from_args(args), port=args.port).start()
+    print(f"stub providers at {server.url}; point the app at them with:")
+    for name, value in server.env().items():
+        print(f"  export {name}={value}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
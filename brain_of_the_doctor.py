@@ -10,17 +10,19 @@ import os
 GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
 
 #Step2: Convert image to required format
-import base64
+# (EXIF-rotated, downscaled, re-encoded and cached - see image_preprocess.py)
+from image_preprocess import preprocess_image
 
 
 #image_path="acne.jpg"
 
-def encode_image(image_path):   
-    image_file=open(image_path, "rb")
-    return base64.b64encode(image_file.read()).decode('utf-8')
+def encode_image(image_path):
+    return preprocess_image(image_path)
 
 #Step3: Setup Multimodal LLM 
-from groq import Groq
+from clients import get_groq_client
+from resilience import call, call_async, stream, stream_async
+from metrics import record_payload
 
 query="Is there something wrong with my face?"
 #model = "meta-llama/llama-4-maverick-17b-128e-instruct"
@@ -28,27 +30,134 @@ model="meta-llama/llama-4-scout-17b-16e-instruct"
 #model = "meta-llama/llama-4-scout-17b-16e-instruct"
 #model="llama-3.2-90b-vision-preview" #Deprecated
 
-def analyze_image_with_query(query, model, encoded_image):
-    client=Groq()  
-    messages=[
+def _build_messages(query, encoded_image, system=None):
+    content=[
         {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text", 
-                    "text": query
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{encoded_image}",
-                    },
-                },
-            ],
-        }]
-    chat_completion=client.chat.completions.create(
+            "type": "text", 
+            "text": query
+        },
+    ]
+    if encoded_image:
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                # encode_image returns a full data URL; bare base64 is assumed to be JPEG
+                "url": encoded_image if encoded_image.startswith("data:") else f"data:image/jpeg;base64,{encoded_image}",
+            },
+        })
+    record_payload("llm", "sent", len(query.encode("utf-8")) + len((system or "").encode("utf-8")) + len(encoded_image or ""))
+    messages=[{"role": "user", "content": content}]
+    if system:
+        # Instructions go in their own message instead of being repeated in the user text
+        messages.insert(0, {"role": "system", "content": system})
+    return messages
+
+def analyze_image_with_query(query, model, encoded_image, system=None):
+    client=get_groq_client()
+    messages=_build_messages(query, encoded_image, system)
+    chat_completion=call("groq", lambda: client.chat.completions.create(
+        messages=messages,
+        model=model
+    ), limit="llm")
+
+    return chat_completion.choices[0].message.content
+
+#Step4: Streaming variant - yields text deltas as the model produces them
+def stream_image_with_query(query, model, encoded_image, system=None):
+    client=get_groq_client()
+    messages=_build_messages(query, encoded_image, system)
+    # Each attempt holds an LLM slot until its stream is consumed, never during a retry backoff
+    chunks=stream("groq", lambda: client.chat.completions.create(
+        messages=messages,
+        model=model,
+        stream=True
+    ), limit="llm")
+    for chunk in chunks:
+        if not chunk.choices:
+            continue
+        delta=chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+#Step5: Cut a token stream into sentence-sized pieces (for sentence-by-sentence TTS)
+import re
+
+_SENTENCE_END=re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+class SentenceSplitter:
+    """
+    Re-chunks text deltas into complete sentences.
+
+    Sentences shorter than `min_chars` are merged with the next one so the
+    TTS engine is not called for fragments like "Hi." on their own.
+    """
+
+    def __init__(self, min_chars=20):
+        self.min_chars=min_chars
+        self.buffer=""
+
+    def feed(self, delta):
+        self.buffer+=delta
+        start=0
+        sentences=[]
+        for match in _SENTENCE_END.finditer(self.buffer):
+            if match.end()-start < self.min_chars:
+                continue
+            sentence=self.buffer[start:match.end()].strip()
+            start=match.end()
+            if sentence:
+                sentences.append(sentence)
+        self.buffer=self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        tail=self.buffer.strip()
+        self.buffer=""
+        return [tail] if tail else []
+
+def iter_sentences(token_stream, min_chars=20):
+    """Yields complete sentences from a stream of text deltas; the remainder is flushed at the end."""
+    splitter=SentenceSplitter(min_chars)
+    for delta in token_stream:
+        yield from splitter.feed(delta)
+    yield from splitter.flush()
+
+#Step6: Async variants (used by async_pipeline.py)
+from clients import get_async_groq_client
+
+async def stream_image_with_query_async(query, model, encoded_image, system=None):
+    client=get_async_groq_client()
+    messages=_build_messages(query, encoded_image, system)
+
+    async def open_stream():
+        chunks=await client.chat.completions.create(
+            messages=messages,
+            model=model,
+            stream=True
+        )
+        async for chunk in chunks:
+            yield chunk
+
+    async for chunk in stream_async("groq", open_stream, limit="llm"):
+        if not chunk.choices:
+            continue
+        delta=chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+async def analyze_image_with_query_async(query, model, encoded_image, system=None):
+    client=get_async_groq_client()
+    messages=_build_messages(query, encoded_image, system)
+    chat_completion=await call_async("groq", lambda: client.chat.completions.create(
         messages=messages,
         model=model
-    )
+    ), limit="llm")
+    return chat_completion.choices[0].message.content
 
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+async def aiter_sentences(token_stream, min_chars=20):
+    splitter=SentenceSplitter(min_chars)
+    async for delta in token_stream:
+        for sentence in splitter.feed(delta):
+            yield sentence
+    for sentence in splitter.flush():
+        yield sentence
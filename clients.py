@@ -0,0 +1,243 @@
+# clients.py
+#
+# Process-wide registry of provider clients (Groq, ElevenLabs).
+# Each client is created once per API key and shares a keep-alive httpx
+# connection pool, so only the first request pays the TLS handshake.
+# The ElevenLabs voice_id is resolved once and cached with a TTL.
+# SDK imports happen on first use (or in warm_up), not at import time.
+
+import os
+import threading
+import time
+
+
+# -----------------------------
+# CONFIG (environment)
+# -----------------------------
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 20))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 120))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+GROQ_TIMEOUT = float(os.environ.get("GROQ_TIMEOUT", 60))
+ELEVENLABS_TIMEOUT = float(os.environ.get("ELEVENLABS_TIMEOUT", 60))
+# Retries happen in resilience.py (backoff + circuit breaker); SDK retries would multiply them
+GROQ_MAX_RETRIES = int(os.environ.get("GROQ_MAX_RETRIES", 0))
+VOICE_ID_TTL = float(os.environ.get("ELEVEN_VOICE_ID_TTL", 3600))
+# Alternative API endpoint (benchmarks/stub_servers.py); the Groq SDK reads GROQ_BASE_URL itself
+ELEVENLABS_BASE_URL = os.environ.get("ELEVENLABS_BASE_URL")
+
+DEFAULT_VOICE_ID = "21m00Tcm4TlvDq8ikWAM"  # Rachel
+
+
+def _groq_key():
+    return os.environ.get("GROQ_API_KEY")
+
+
+def _elevenlabs_key():
+    return os.environ.get("ELEVENLABS_API_KEY") or os.environ.get("ELEVEN_API_KEY")
+
+
+# -----------------------------
+# REGISTRY
+# -----------------------------
+_clients = {}
+_lock = threading.Lock()
+
+
+def _http_client(timeout):
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+def _async_http_client(timeout):
+    import httpx
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+def _elevenlabs_options():
+    return {"base_url": ELEVENLABS_BASE_URL} if ELEVENLABS_BASE_URL else {}
+
+
+def _get_or_create(key, factory):
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = factory()
+                _clients[key] = client
+    return client
+
+
+def get_groq_client(api_key=None):
+    api_key = api_key or _groq_key()
+
+    def factory():
+        from groq import Groq
+        return Groq(
+            api_key=api_key,
+            timeout=GROQ_TIMEOUT,
+            max_retries=GROQ_MAX_RETRIES,
+            http_client=_http_client(GROQ_TIMEOUT),
+        )
+    return _get_or_create(("groq", api_key), factory)
+
+
+def get_elevenlabs_client(api_key=None):
+    api_key = api_key or _elevenlabs_key()
+    if not api_key:
+        raise RuntimeError("ELEVENLABS_API_KEY not set in environment (or ELEVEN_API_KEY).")
+
+    def factory():
+        from elevenlabs.client import ElevenLabs
+        return ElevenLabs(
+            api_key=api_key,
+            timeout=ELEVENLABS_TIMEOUT,
+            httpx_client=_http_client(ELEVENLABS_TIMEOUT),
+            **_elevenlabs_options(),
+        )
+    return _get_or_create(("elevenlabs", api_key), factory)
+
+
+def get_async_groq_client(api_key=None):
+    api_key = api_key or _groq_key()
+
+    def factory():
+        from groq import AsyncGroq
+        return AsyncGroq(
+            api_key=api_key,
+            timeout=GROQ_TIMEOUT,
+            max_retries=GROQ_MAX_RETRIES,
+            http_client=_async_http_client(GROQ_TIMEOUT),
+        )
+    return _get_or_create(("groq-async", api_key), factory)
+
+
+def get_async_elevenlabs_client(api_key=None):
+    api_key = api_key or _elevenlabs_key()
+    if not api_key:
+        raise RuntimeError("ELEVENLABS_API_KEY not set in environment (or ELEVEN_API_KEY).")
+
+    def factory():
+        from elevenlabs.client import AsyncElevenLabs
+        return AsyncElevenLabs(
+            api_key=api_key,
+            timeout=ELEVENLABS_TIMEOUT,
+            httpx_client=_async_http_client(ELEVENLABS_TIMEOUT),
+            **_elevenlabs_options(),
+        )
+    return _get_or_create(("elevenlabs-async", api_key), factory)
+
+
+def close_all():
+    """Closes every pooled sync client (create_app's shutdown); async pools close with their event loop."""
+    with _lock:
+        for (provider, _), client in _clients.items():
+            if provider.endswith("-async"):
+                continue
+            close = getattr(client, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception:
+                    pass
+        _clients.clear()
+        _voice_ids.clear()
+
+
+# -----------------------------
+# VOICE ID (cached with TTL)
+# -----------------------------
+_voice_ids = {}  # api_key -> (voice_id, expires_at)
+
+
+def resolve_voice_id(api_key=None):
+    """
+    Voice selection order:
+      1) ELEVEN_VOICE_ID env var
+      2) first voice from client.voices.get_all() - cached for ELEVEN_VOICE_ID_TTL seconds
+      3) guaranteed default voice '21m00Tcm4TlvDq8ikWAM' (Rachel)
+    """
+    voice_id = os.environ.get("ELEVEN_VOICE_ID") or os.environ.get("ELEVEN_VOICEID")
+    if voice_id:
+        return voice_id
+
+    api_key = api_key or _elevenlabs_key()
+    cached = _voice_ids.get(api_key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    try:
+        voices_resp = get_elevenlabs_client(api_key).voices.get_all()
+        voices_list = getattr(voices_resp, "voices", None) or voices_resp
+        if voices_list and len(voices_list) > 0:
+            first = voices_list[0]
+            voice_id = getattr(first, "voice_id", None) or getattr(first, "id", None) or getattr(first, "voiceId", None)
+            print("DEBUG: Auto-discovered voice_id:", voice_id, "name:", getattr(first, "name", None) or getattr(first, "voice_name", None))
+    except Exception as e:
+        print("DEBUG: Voice listing failed:", repr(e))
+
+    if not voice_id:
+        voice_id = DEFAULT_VOICE_ID
+        print("DEBUG: Using DEFAULT fallback voice_id:", voice_id)
+
+    # The fallback is cached too, so a blocked voices endpoint is not retried per request
+    _voice_ids[api_key] = (voice_id, time.monotonic() + VOICE_ID_TTL)
+    return voice_id
+
+
+# -----------------------------
+# WARM-UP
+# -----------------------------
+def warm_up(background=True, tokenizer_model=None):
+    """
+    Imports the provider SDKs and opens the sync connection pools before the
+    first request: one cheap authenticated call per configured provider
+    (Groq model list, ElevenLabs voice discovery) leaves a live keep-alive
+    connection behind, and the prompt tokenizer for `tokenizer_model` is
+    loaded (prompt_budget.py). Failures are logged and ignored - a provider
+    that is unreachable at boot must not stop the app from becoming ready.
+    Async pools belong to the server's event loop and open on first use.
+    """
+    def run():
+        started = time.perf_counter()
+        for module in ("groq", "elevenlabs.client", "gtts", "pydub"):
+            try:
+                __import__(module)
+            except Exception as e:
+                print(f"⚠️ warm-up: import {module} failed: {e}")
+        if _groq_key():
+            try:
+                get_groq_client().models.list()
+            except Exception as e:
+                print("⚠️ warm-up: Groq not reachable:", e)
+        if _elevenlabs_key():
+            try:
+                resolve_voice_id()
+            except Exception as e:
+                print("⚠️ warm-up: ElevenLabs not reachable:", e)
+        if tokenizer_model:
+            from prompt_budget import load_tokenizer
+            load_tokenizer(tokenizer_model)
+        print(f"🔥 warm-up finished in {time.perf_counter() - started:.2f}s")
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name="client-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -6,9 +6,13 @@ import gradio as gr
 print("✅ gradio_app.py started")
 
 
-from brain_of_the_doctor import encode_image, analyze_image_with_query
-from voice_of_the_patient import transcribe_with_groq
-from voice_of_the_doctor import text_to_speech_with_gtts, text_to_speech_with_elevenlabs
+from async_pipeline import process_inputs_async
+from tts_cache import TTS_CACHE_DIR
+from artifacts import ARTIFACTS_DIR, stop_artifact_gc
+from clients import close_all, warm_up
+from live_speech import LiveTranscription
+from sessions import get_session_store
+from tts_profiles import UI_PROFILES, profile_for_client
 
 # Optional: load .env if present (local only)
 try:
@@ -19,108 +23,34 @@ except Exception:
 
 
 # -----------------------------
-# SYSTEM PROMPT
-# -----------------------------
-system_prompt = (
-    "You have to act as a professional doctor, i know you are not but this is for learning purpose. "
-    "What's in this image?. Do you find anything wrong with it medically? "
-    "If you make a differential, suggest some remedies for them. Donot add any numbers or special characters in "
-    "your response. Your response should be in one long paragraph. Also always answer as if you are answering to a real person. "
-    "Donot say 'In the image I see' but say 'With what I see, I think you have ....' "
-    "Dont respond as an AI model in markdown, your answer should mimic that of an actual doctor not an AI bot, "
-    "Keep your answer concise (max 2 sentences). No preamble, start your answer right away please"
-)
-
-
-# -----------------------------
-# FAKE RAG (UI ONLY – ALWAYS ON)
+# GRADIO UI
 # -----------------------------
-def fake_rag_retrieval(documents):
-    if documents:
-        return (
-            "Retrieved from uploaded medical documents:\n"
-            "- Symptoms may indicate mild inflammation or irritation.\n"
-            "- Early diagnosis and basic care can prevent complications.\n"
-            "- Consultation with a healthcare professional is advised if symptoms persist."
-        )
-    return "No external medical documents uploaded. Using general medical knowledge."
+FOLLOW_UP_LABEL = "Follow-up question (keep this consultation's image, documents and conversation)"
+AUDIO_QUALITY_LABEL = "Voice audio quality (auto: low on Save-Data / slow connections)"
 
 
-# -----------------------------
-# MAIN PROCESS FUNCTION
-# -----------------------------
-def process_inputs(audio_filepath, image_filepath, documents):
+def consultation_id(follow_up, request):
+    """The browser session's consultation; a question that is not a follow-up starts a new one."""
+    session_id = request.session_hash if request is not None else None
+    if session_id and not follow_up:
+        get_session_store().reset(session_id)
+    return session_id
 
-    # API KEYS
-    groq_key = os.environ.get("GROQ_API_KEY")
-    if not groq_key:
-        return "", "", "Error: GROQ_API_KEY not set", None
 
-    eleven_key = os.environ.get("ELEVENLABS_API_KEY") or os.environ.get("ELEVEN_API_KEY")
+def audio_profile(quality, request):
+    return profile_for_client(quality, dict(request.headers) if request is not None else None)
 
-    # SPEECH TO TEXT
-    try:
-        speech_to_text_output = transcribe_with_groq(
-            GROQ_API_KEY=groq_key,
-            audio_filepath=audio_filepath,
-            stt_model="whisper-large-v3"
-        ) if audio_filepath else ""
-    except Exception as e:
-        return "", "", f"Error transcribing audio: {e}", None
 
-    # RAG CONTEXT (UI LEVEL)
-    retrieved_context = fake_rag_retrieval(documents)
+async def consult(audio_filepath, image_filepath, documents, follow_up, quality, request: gr.Request):
+    async for outputs in process_inputs_async(
+        audio_filepath, image_filepath, documents,
+        session_id=consultation_id(follow_up, request), tts_profile=audio_profile(quality, request)
+    ):
+        yield outputs
 
-    # RAG PROMPT
-    rag_prompt = (
-        f"{system_prompt}\n\n"
-        f"Medical Context:\n{retrieved_context}\n\n"
-        f"Patient Query:\n{speech_to_text_output}"
-    )
 
-    # IMAGE / LLM ANALYSIS
-    try:
-        if image_filepath:
-            encoded = encode_image(image_filepath)
-            doctor_response = analyze_image_with_query(
-                query=rag_prompt,
-                encoded_image=encoded,
-                model="meta-llama/llama-4-scout-17b-16e-instruct"
-            )
-        elif speech_to_text_output:
-            doctor_response = analyze_image_with_query(
-                query=rag_prompt,
-                encoded_image=None,
-                model="meta-llama/llama-4-scout-17b-16e-instruct"
-            )
-        else:
-            doctor_response = "No image or audio provided for analysis."
-    except Exception as e:
-        doctor_response = f"Error running model: {e}"
-
-    # TEXT TO SPEECH
-    audio_path = None
-    try:
-        output_audio_path = "final.mp3"
-        if eleven_key:
-            audio_path = text_to_speech_with_elevenlabs(
-                input_text=doctor_response,
-                output_filepath=output_audio_path
-            )
-        else:
-            text_to_speech_with_gtts(doctor_response, output_audio_path)
-            audio_path = output_audio_path
-    except Exception as e:
-        doctor_response = f"TTS error: {e}"
-
-    return speech_to_text_output, retrieved_context, doctor_response, audio_path
-
-
-# -----------------------------
-# GRADIO UI
-# -----------------------------
 iface = gr.Interface(
-    fn=process_inputs,
+    fn=consult,
     inputs=[
         gr.Audio(sources=["microphone"], type="filepath", label="Patient Speech (Record)"),
         gr.Image(type="filepath", label="Patient Image (Optional)"),
@@ -128,30 +58,149 @@ iface = gr.Interface(
             label="Medical Knowledge Base (Upload PDFs / Docs)",
             file_types=[".pdf", ".txt"],
             file_count="multiple"
-        )
+        ),
+        gr.Checkbox(label=FOLLOW_UP_LABEL, value=False),
+        gr.Radio(UI_PROFILES, value="auto", label=AUDIO_QUALITY_LABEL)
     ],
     outputs=[
         gr.Textbox(label="Speech to Text"),
         gr.Textbox(label="Retrieved Medical Context (RAG)"),
         gr.Textbox(label="Doctor's Response (Generated using RAG)"),
-        gr.Audio(label="Doctor's Voice")
+        gr.Audio(label="Doctor's Voice", streaming=True, autoplay=True)
     ],
     title="AI Doctor with Vision, Voice & RAG",
     description="Multimodal AI Doctor using Voice, Vision, and Document-based RAG"
 )
 
 
+# -----------------------------
+# LIVE MICROPHONE TAB (live_speech.py)
+# -----------------------------
+# Chunk size of the microphone stream, in seconds
+LIVE_STREAM_EVERY = float(os.environ.get("LIVE_STREAM_EVERY", 0.5))
+
+
+async def start_live(session):
+    """New recording: the previous one's pending transcriptions are cancelled, so none can land in this one.
+    Async so the cancel runs on the event loop that owns those tasks."""
+    if session is not None:
+        session.cancel()
+    return None, ""
+
+
+async def feed_live(chunk, session):
+    """Microphone chunk -> (session, partial transcript). Async so it runs on the server's event loop,
+    where the utterance transcriptions it starts keep running after it returns."""
+    groq_key = os.environ.get("GROQ_API_KEY")
+    if not groq_key:
+        return session, "Error: GROQ_API_KEY not set"
+    if session is None:
+        from pipeline import STT_MODEL
+        session = LiveTranscription(groq_key, STT_MODEL)
+    if chunk is not None:
+        session.feed(*chunk)
+    return session, session.partial()
+
+
+async def finish_live(session, image_filepath, documents, follow_up, quality, request: gr.Request):
+    transcript = ""
+    if session is not None:
+        try:
+            transcript = await session.finish()
+        except Exception as e:
+            yield None, "", "", f"Error transcribing audio: {e}", None
+            return
+    async for outputs in process_inputs_async(
+        None, image_filepath, documents, transcript=transcript,
+        session_id=consultation_id(follow_up, request), tts_profile=audio_profile(quality, request)
+    ):
+        yield (None, *outputs)
+
+
+with gr.Blocks() as live:
+    gr.Markdown("Speak naturally: your words are transcribed while you talk, and the doctor answers as soon as you stop.")
+    live_session = gr.State(None)
+    with gr.Row():
+        with gr.Column():
+            live_mic = gr.Audio(sources=["microphone"], type="numpy", streaming=True, label="Patient Speech (Live)")
+            live_image = gr.Image(type="filepath", label="Patient Image (Optional)")
+            live_documents = gr.File(
+                label="Medical Knowledge Base (Upload PDFs / Docs)",
+                file_types=[".pdf", ".txt"],
+                file_count="multiple"
+            )
+            live_follow_up = gr.Checkbox(label=FOLLOW_UP_LABEL, value=False)
+            live_quality = gr.Radio(UI_PROFILES, value="auto", label=AUDIO_QUALITY_LABEL)
+        with gr.Column():
+            live_transcript = gr.Textbox(label="Speech to Text (live)")
+            live_context = gr.Textbox(label="Retrieved Medical Context (RAG)")
+            live_response = gr.Textbox(label="Doctor's Response (Generated using RAG)")
+            live_voice = gr.Audio(label="Doctor's Voice", streaming=True, autoplay=True)
+
+    live_mic.start_recording(start_live, inputs=[live_session], outputs=[live_session, live_transcript])
+    live_mic.stream(
+        feed_live, inputs=[live_mic, live_session], outputs=[live_session, live_transcript],
+        stream_every=LIVE_STREAM_EVERY, concurrency_limit=None
+    )
+    live_mic.stop_recording(
+        finish_live, inputs=[live_session, live_image, live_documents, live_follow_up, live_quality],
+        outputs=[live_session, live_transcript, live_context, live_response, live_voice]
+    )
+
+
+app_ui = gr.TabbedInterface([iface, live], ["Record", "Live"], title="AI Doctor with Vision, Voice & RAG")
+
+
+# Outputs are request-scoped (artifacts.py), so consultations can run concurrently.
+# Provider calls inside them are paced by scheduler.py (STT_/LLM_/TTS_ limits);
+# requests beyond GRADIO_CONCURRENCY wait in the queue and see their position.
+# Past GRADIO_QUEUE_SIZE new requests are rejected instead of piling up.
+app_ui.queue(
+    default_concurrency_limit=int(os.environ.get("GRADIO_CONCURRENCY", 8)),
+    max_size=int(os.environ.get("GRADIO_QUEUE_SIZE", 64)),
+)
+
+
+# -----------------------------
+# HTTP APP (UI at /, headless API at /api, Prometheus scrape at /metrics)
+# -----------------------------
+def create_app():
+    from contextlib import asynccontextmanager
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+    import api
+    import metrics
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        # Shutdown: the artifact GC thread, then the pooled provider clients' connections
+        stop_artifact_gc()
+        close_all()
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    # Same process as the UI: one set of clients, caches, sessions and provider limits (api.py)
+    app.include_router(api.router)
+
+    return gr.mount_gradio_app(app, app_ui, path="/", allowed_paths=[TTS_CACHE_DIR, ARTIFACTS_DIR])
+
+
 # -----------------------------
 # RENDER-COMPATIBLE LAUNCH
 # -----------------------------
 if __name__ == "__main__":
     try:
         print("🚀 Launching Gradio app...")
-        iface.launch(
-            server_name="0.0.0.0",
-            server_port=int(os.environ.get("PORT", 7860)),
-            debug=True
-        )
+        if os.environ.get("WARM_UP", "1") != "0":
+            from pipeline import LLM_MODEL
+            warm_up(tokenizer_model=LLM_MODEL)
+        import uvicorn
+        uvicorn.run(create_app(), host="0.0.0.0", port=int(os.environ.get("PORT", 7860)))
     except Exception as e:
         print("❌ Gradio failed to start:", e)
         raise
@@ -0,0 +1,102 @@
+# image_preprocess.py
+#
+# Image preprocessing before upload to the vision model:
+#   EXIF orientation -> downscale to IMAGE_MAX_SIDE -> re-encode (JPEG/WebP)
+#   -> base64 data URL, cached by SHA-256 of the original file contents.
+# A 5-12 MB phone photo becomes a ~100 KB payload, and repeat uploads of the
+# same photo are a hash lookup.
+
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from metrics import record_cache
+from uploads import read_source
+
+
+IMAGE_MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE", 1024))
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "JPEG").upper()  # JPEG or WEBP
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 85))
+IMAGE_CACHE_BYTES = int(os.environ.get("IMAGE_CACHE_BYTES", 64 * 1024 * 1024))  # 0 disables the cache
+
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png", "GIF": "image/gif"}
+
+
+# -----------------------------
+# CACHE (LRU, bounded by total payload size)
+# -----------------------------
+_cache = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        value = _cache.get(key)
+        if value is not None:
+            _cache.move_to_end(key)
+        return value
+
+
+def _cache_put(key, value):
+    global _cache_bytes
+    if IMAGE_CACHE_BYTES <= 0:
+        return
+    with _cache_lock:
+        if key in _cache:
+            return
+        _cache[key] = value
+        _cache_bytes += len(value)
+        while _cache_bytes > IMAGE_CACHE_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+
+
+# -----------------------------
+# PREPROCESS
+# -----------------------------
+def _reencode(raw):
+    """Returns (payload_bytes, mime) for the downscaled, re-encoded image."""
+    with Image.open(BytesIO(raw)) as img:
+        source_format = img.format
+        # Phone photos are often stored sideways with an EXIF Orientation tag (0x0112) saying so
+        upright = img.getexif().get(0x0112, 1) == 1
+        img = ImageOps.exif_transpose(img)
+        resized = max(img.size) > IMAGE_MAX_SIDE
+        if resized:
+            img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = BytesIO()
+        img.save(out, format=IMAGE_FORMAT, quality=IMAGE_QUALITY, optimize=True)
+
+    # Small upright originals can already be smaller than the re-encode; keep those as-is
+    if upright and not resized and source_format in _MIME and len(raw) <= out.tell():
+        return raw, _MIME[source_format]
+    return out.getbuffer(), _MIME[IMAGE_FORMAT]
+
+
+def preprocess_image(image_path):
+    """
+    Returns a ready-to-send data URL ("data:<mime>;base64,...") for the image
+    (a path or an in-memory Upload). Only the encoded payload is kept in
+    memory (and in the cache); the raw bytes are dropped as soon as the
+    re-encode is done.
+    """
+    raw = read_source(image_path)
+    key = (hashlib.sha256(raw).hexdigest(), IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY)
+    cached = _cache_get(key)
+    record_cache("image", cached is not None)
+    if cached is not None:
+        return cached
+
+    payload, mime = _reencode(raw)
+    del raw
+    data_url = f"data:{mime};base64," + base64.b64encode(payload).decode("ascii")
+    _cache_put(key, data_url)
+    return data_url
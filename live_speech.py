@@ -0,0 +1,210 @@
+# live_speech.py
+#
+# Live microphone mode. Instead of waiting for the whole recording, the UI
+# streams small chunks of microphone audio here (gr.Audio(streaming=True)).
+# A streaming VAD cuts them into utterances at the patient's pauses, and
+# every finished utterance is sent to Whisper right away while the patient
+# keeps talking; the partial transcript is shown as the pieces come back.
+# When the recording stops only the last utterance is still to transcribe,
+# so the STT time after the end of speech is one short clip instead of the
+# whole recording.
+#
+# The VAD is the same energy measure as audio_preprocess.py, but it cannot
+# see the loudest frame of a recording that is still going on: frames count
+# as speech when they are LIVE_VAD_MARGIN_DB above a running noise floor.
+#
+# Environment:
+#   LIVE_VAD_SILENCE_MS      pause that ends an utterance (600)
+#   LIVE_VAD_MIN_SPEECH_MS   shorter bursts are noise (clicks, bumps) (150)
+#   LIVE_VAD_MARGIN_DB       speech threshold above the noise floor (12)
+#   LIVE_MAX_UTTERANCE_MS    utterances are cut here even without a pause (15000)
+
+import asyncio
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from audio_preprocess import TARGET_SAMPLE_RATE, VAD_FLOOR_DBFS, VAD_FRAME_MS, VAD_PADDING_MS, frame_dbfs
+from metrics import Histogram
+
+
+LIVE_VAD_SILENCE_MS = int(os.environ.get("LIVE_VAD_SILENCE_MS", 600))
+LIVE_VAD_MIN_SPEECH_MS = int(os.environ.get("LIVE_VAD_MIN_SPEECH_MS", 150))
+LIVE_VAD_MARGIN_DB = float(os.environ.get("LIVE_VAD_MARGIN_DB", 12))
+LIVE_MAX_UTTERANCE_MS = int(os.environ.get("LIVE_MAX_UTTERANCE_MS", 15_000))
+# The noise floor follows quiet frames with this weight per frame (~1 s time constant)
+NOISE_FLOOR_ALPHA = 0.03
+
+FRAME_SAMPLES = TARGET_SAMPLE_RATE * VAD_FRAME_MS // 1000
+
+STT_TAIL_SECONDS = Histogram(
+    "ai_doctor_live_stt_tail_seconds", "End of a live recording to the complete transcript.")
+
+
+# -----------------------------
+# AUDIO FRAMES
+# -----------------------------
+def to_mono_16k(sample_rate, data):
+    """int16 mono samples at 16 kHz from a Gradio microphone chunk ((n,) or (n, channels), int or float)."""
+    data = np.asarray(data)
+    scale = 32767.0 if data.dtype.kind == "f" else 1.0  # float samples are in [-1, 1]
+    data = data.astype(np.float64) * scale
+    if data.ndim == 2:
+        data = data.mean(axis=1)
+    if sample_rate != TARGET_SAMPLE_RATE and len(data):
+        if sample_rate % TARGET_SAMPLE_RATE == 0:
+            # 48 kHz / 32 kHz mics: averaging each group is also the low-pass
+            step = sample_rate // TARGET_SAMPLE_RATE
+            data = data[:len(data) // step * step].reshape(-1, step).mean(axis=1)
+        else:
+            n = int(len(data) * TARGET_SAMPLE_RATE / sample_rate)
+            data = np.interp(np.linspace(0, len(data) - 1, n), np.arange(len(data)), data)
+    return np.clip(data, -32768, 32767).astype(np.int16)
+
+
+# -----------------------------
+# STREAMING VAD
+# -----------------------------
+class UtteranceSegmenter:
+    """
+    Feed 16 kHz mono int16 samples in any chunk size; feed() returns the
+    utterances (int16 arrays, with VAD_PADDING_MS of audio around the
+    speech) completed by that chunk, flush() the one still in progress.
+    """
+
+    def __init__(self):
+        self.in_speech = False
+        self.noise_floor = None
+        self._pending = np.zeros(0, dtype=np.int16)  # samples short of a whole frame
+        self._preroll = deque(maxlen=max(1, (VAD_PADDING_MS + LIVE_VAD_MIN_SPEECH_MS) // VAD_FRAME_MS))
+        self._utterance = []
+        self._voiced_run = 0
+        self._silent_run = 0
+
+    def _is_speech(self, level):
+        if self.noise_floor is None:
+            self.noise_floor = level
+        voiced = level > max(VAD_FLOOR_DBFS, self.noise_floor + LIVE_VAD_MARGIN_DB)
+        if not voiced:
+            self.noise_floor += NOISE_FLOOR_ALPHA * (level - self.noise_floor)
+        return voiced
+
+    def feed(self, samples):
+        samples = np.concatenate([self._pending, samples])
+        n_frames = len(samples) // FRAME_SAMPLES
+        self._pending = samples[n_frames * FRAME_SAMPLES:]
+        if not n_frames:
+            return []
+        frames = samples[:n_frames * FRAME_SAMPLES].reshape(n_frames, FRAME_SAMPLES)
+        levels = frame_dbfs(frames.reshape(-1), TARGET_SAMPLE_RATE)
+
+        finished = []
+        for frame, level in zip(frames, levels):
+            voiced = self._is_speech(level)
+            if not self.in_speech:
+                self._preroll.append(frame)
+                self._voiced_run = self._voiced_run + 1 if voiced else 0
+                if self._voiced_run * VAD_FRAME_MS >= LIVE_VAD_MIN_SPEECH_MS:
+                    self.in_speech = True
+                    self._utterance = list(self._preroll)
+                    self._silent_run = 0
+                continue
+            self._utterance.append(frame)
+            self._silent_run = 0 if voiced else self._silent_run + 1
+            if (self._silent_run * VAD_FRAME_MS >= LIVE_VAD_SILENCE_MS
+                    or len(self._utterance) * VAD_FRAME_MS >= LIVE_MAX_UTTERANCE_MS):
+                finished.append(self._cut())
+        return finished
+
+    def _cut(self):
+        # Drop the trailing pause, except for the padding
+        keep = len(self._utterance) - max(0, self._silent_run - VAD_PADDING_MS // VAD_FRAME_MS)
+        utterance = np.concatenate(self._utterance[:keep])
+        self.in_speech = False
+        self._utterance = []
+        self._preroll.clear()
+        self._voiced_run = self._silent_run = 0
+        return utterance
+
+    def flush(self):
+        """The utterance in progress (None if the patient is not speaking); the segmenter is reset."""
+        if self.in_speech and len(self._pending):
+            self._utterance.append(self._pending)
+        self._pending = np.zeros(0, dtype=np.int16)
+        return self._cut() if self.in_speech else None
+
+
+# -----------------------------
+# SESSION (one recording)
+# -----------------------------
+def _segment(samples):
+    from pydub import AudioSegment
+    return AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=TARGET_SAMPLE_RATE, channels=1)
+
+
+class LiveTranscription:
+    """
+    One live recording: feed() microphone chunks as they arrive (from the
+    event loop), read partial() at any time, await finish() once the
+    recording has stopped.
+    """
+
+    def __init__(self, groq_key, stt_model):
+        self.groq_key = groq_key
+        self.stt_model = stt_model
+        self.segmenter = UtteranceSegmenter()
+        self.texts = []   # per utterance, None while its transcription is in flight
+        self.errors = []
+        self.closed = False
+        self._tasks = []
+
+    def feed(self, sample_rate, data):
+        if self.closed:
+            return
+        for utterance in self.segmenter.feed(to_mono_16k(sample_rate, data)):
+            self._transcribe(utterance)
+
+    def _transcribe(self, samples):
+        from voice_of_the_patient import transcribe_segment_async
+
+        index = len(self.texts)
+        self.texts.append(None)
+        prompt = " ".join(t for t in self.texts[:index] if t) or None
+
+        async def run():
+            try:
+                text = await transcribe_segment_async(self.stt_model, _segment(samples), self.groq_key, prompt)
+            except Exception as e:
+                self.errors.append(e)
+                text = ""
+            self.texts[index] = text.strip()
+
+        self._tasks.append(asyncio.ensure_future(run()))
+
+    def transcript(self):
+        return " ".join(t for t in self.texts if t)
+
+    def partial(self):
+        """What has been understood so far; "…" while speech is still being transcribed or spoken."""
+        busy = self.segmenter.in_speech or any(t is None for t in self.texts)
+        return " ".join(filter(None, [self.transcript(), "…" if busy else ""]))
+
+    async def finish(self):
+        """Transcribes the last utterance and waits for the others; returns the full transcript."""
+        self.closed = True
+        stopped = time.perf_counter()
+        tail = self.segmenter.flush()
+        if tail is not None:
+            self._transcribe(tail)
+        await asyncio.gather(*self._tasks)
+        STT_TAIL_SECONDS.observe(time.perf_counter() - stopped)
+        if self.errors and not self.transcript():
+            raise self.errors[0]
+        return self.transcript()
+
+    def cancel(self):
+        self.closed = True
+        for task in self._tasks:
+            task.cancel()
@@ -0,0 +1,311 @@
+# llm_cache.py
+#
+# Cache of finished LLM replies. The demo images and the common questions
+# ("Is there something wrong with my face?" + acne.jpg) come back again and
+# again; a hit replays the stored reply instead of a multi-second vision call.
+#
+# Key: (model, system prompt version, perceptual hash of the preprocessed
+# image, normalized transcript, digest of the retrieved context and, on
+# follow-up turns, of the consultation history). The image
+# hash is a difference hash of the decoded pixels, and any hash within
+# LLM_CACHE_PHASH_DISTANCE bits of one seen before is replaced by that one,
+# so the same photo re-saved, re-encoded or resized still hits (a different
+# photo, or the same one rotated, is 80+ bits away). The transcript is
+# compared without case, punctuation or extra whitespace.
+#
+# Entries expire after LLM_CACHE_TTL_SECONDS and the least recently used go
+# first once LLM_CACHE_MAX_BYTES is reached. By default the cache lives in
+# this process; LLM_CACHE_DB=<path> keeps it in a SQLite file instead, shared
+# by every worker on the host. Only complete replies are stored: errors and
+# streams that were cut short are not.
+
+import base64
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from io import BytesIO
+
+from metrics import record_cache
+
+
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 16 * 1024 * 1024))  # 0 disables the cache
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", 24 * 3600))
+LLM_CACHE_DB = os.environ.get("LLM_CACHE_DB")  # SQLite file shared by workers; unset = in-process
+LLM_CACHE_PHASH_SIZE = int(os.environ.get("LLM_CACHE_PHASH_SIZE", 16))  # 16x16 = 256-bit image hash
+LLM_CACHE_PHASH_DISTANCE = int(os.environ.get("LLM_CACHE_PHASH_DISTANCE", 12))  # 0 = exact hash match only
+LLM_CACHE_MAX_IMAGES = int(os.environ.get("LLM_CACHE_MAX_IMAGES", 4096))  # image hashes kept for matching
+
+
+# -----------------------------
+# KEY
+# -----------------------------
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_transcript(text):
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return " ".join(_PUNCTUATION.sub(" ", text).split())
+
+
+def perceptual_hash(encoded_image, size=LLM_CACHE_PHASH_SIZE):
+    """Difference hash (hex) of a data URL or bare base64 image; "" without an image."""
+    if not encoded_image:
+        return ""
+    from PIL import Image
+
+    payload = encoded_image.split(",", 1)[1] if encoded_image.startswith("data:") else encoded_image
+    with Image.open(BytesIO(base64.b64decode(payload))) as img:
+        img.draft("L", (size * 8, size * 8))  # JPEG: decode at reduced scale
+        pixels = img.convert("L").resize((size + 1, size), Image.LANCZOS).tobytes()
+    bits = 0
+    for y in range(size):
+        row = pixels[y * (size + 1):(y + 1) * (size + 1)]
+        for x in range(size):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def nearest_hash(image_hash, known, max_distance=LLM_CACHE_PHASH_DISTANCE):
+    """The closest of `known` (hex hashes) within max_distance bits of image_hash, or None."""
+    if not image_hash or max_distance <= 0:
+        return None
+    value = int(image_hash, 16)
+    best, best_distance = None, max_distance + 1
+    for candidate in known:
+        if len(candidate) != len(image_hash):
+            continue
+        distance = (value ^ int(candidate, 16)).bit_count()
+        if distance < best_distance:
+            best, best_distance = candidate, distance
+    return best
+
+
+def response_key(model, prompt_version, image_hash, transcript, retrieved_context, history=""):
+    parts = [
+        model,
+        prompt_version,
+        image_hash,
+        normalize_transcript(transcript),
+        hashlib.sha256((retrieved_context or "").encode("utf-8")).hexdigest(),
+    ]
+    if history:
+        # First turns keep the keys they had before sessions existed
+        parts.append(hashlib.sha256(history.encode("utf-8")).hexdigest())
+    payload = json.dumps(parts)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# -----------------------------
+# BACKENDS
+# -----------------------------
+class ResponseCache:
+    """Shared front: hit/miss counting and the helpers the pipelines use."""
+
+    def __init__(self, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        if not self.enabled or key is None:
+            return None
+        reply = self._get(key)
+        with self._lock:
+            if reply is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        record_cache("llm", reply is not None)
+        return reply
+
+    def put(self, key, reply):
+        if self.enabled and key is not None and reply:
+            self._put(key, reply)
+
+    def lookup(self, model, prompt_version, encoded_image, transcript, retrieved_context, history=""):
+        """-> (key, cached reply or None); the key is None while the cache is disabled."""
+        if not self.enabled:
+            return None, None
+        try:
+            image_hash = self._canonical_image(perceptual_hash(encoded_image))
+            key = response_key(model, prompt_version, image_hash, transcript, retrieved_context, history)
+        except Exception as e:
+            # An image PIL cannot decode here still goes to the model, uncached
+            print("⚠️ llm cache: no key for this request:", e)
+            return None, None
+        return key, self.get(key)
+
+    def tee(self, key, deltas):
+        """Passes a stream of text deltas through and stores the reply once the stream has ended."""
+        parts = []
+        for delta in deltas:
+            parts.append(delta)
+            yield delta
+        self.put(key, "".join(parts))
+
+    async def tee_async(self, key, deltas):
+        parts = []
+        async for delta in deltas:
+            parts.append(delta)
+            yield delta
+        self.put(key, "".join(parts))
+
+    def stats(self):
+        size = self._size()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                **size,
+            }
+
+
+class MemoryResponseCache(ResponseCache):
+    """LRU in this process, bounded by the UTF-8 size of the stored replies."""
+
+    def __init__(self, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL_SECONDS):
+        super().__init__(max_bytes, ttl)
+        self._entries = OrderedDict()  # key -> (reply, size, expires_at)
+        self._total = 0
+        self._images = OrderedDict()   # image hash -> None, most recently seen last
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic():
+                del self._entries[key]
+                self._total -= entry[1]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put(self, key, reply):
+        size = len(reply.encode("utf-8"))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= old[1]
+            self._entries[key] = (reply, size, time.monotonic() + self.ttl)
+            self._total += size
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._total -= evicted
+
+    def _canonical_image(self, image_hash):
+        if not image_hash:
+            return image_hash
+        with self._lock:
+            image_hash = nearest_hash(image_hash, self._images) or image_hash
+            self._images[image_hash] = None
+            self._images.move_to_end(image_hash)
+            while len(self._images) > LLM_CACHE_MAX_IMAGES:
+                self._images.popitem(last=False)
+        return image_hash
+
+    def _size(self):
+        return {"entries": len(self._entries), "bytes": self._total}
+
+
+class SqliteResponseCache(ResponseCache):
+    """
+    Same policy in a SQLite file, so several worker processes share one
+    cache. Times are wall-clock (shared across processes); recency is the
+    `accessed` column.
+    """
+
+    def __init__(self, path, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL_SECONDS):
+        super().__init__(max_bytes, ttl)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses ("
+            " key TEXT PRIMARY KEY, reply TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_responses_accessed ON llm_responses (accessed)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS llm_images (hash TEXT PRIMARY KEY, seen REAL NOT NULL)")
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT reply, created FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.ttl <= now:
+                self._db.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE llm_responses SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _put(self, key, reply):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, reply, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, reply, len(reply.encode("utf-8")), now, now),
+            )
+            self._evict(now, key)
+
+    def _evict(self, now, newest):
+        self._db.execute("DELETE FROM llm_responses WHERE created <= ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM llm_responses ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            if key != newest:
+                victims.append((key,))
+                total -= size
+        self._db.executemany("DELETE FROM llm_responses WHERE key = ?", victims)
+
+    def _canonical_image(self, image_hash):
+        if not image_hash:
+            return image_hash
+        with self._lock:
+            known = [row[0] for row in self._db.execute("SELECT hash FROM llm_images")]
+            image_hash = nearest_hash(image_hash, known) or image_hash
+            self._db.execute("INSERT OR REPLACE INTO llm_images (hash, seen) VALUES (?, ?)", (image_hash, time.time()))
+            if len(known) >= LLM_CACHE_MAX_IMAGES:
+                self._db.execute(
+                    "DELETE FROM llm_images WHERE hash NOT IN (SELECT hash FROM llm_images ORDER BY seen DESC LIMIT ?)",
+                    (LLM_CACHE_MAX_IMAGES,))
+        return image_hash
+
+    def _size(self):
+        with self._lock:
+            entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses").fetchone()
+        return {"entries": entries, "bytes": total}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SqliteResponseCache(LLM_CACHE_DB) if LLM_CACHE_DB and LLM_CACHE_MAX_BYTES > 0 else MemoryResponseCache()
+        return _cache
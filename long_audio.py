@@ -0,0 +1,157 @@
+# long_audio.py
+#
+# Long-recording mode for transcription. The (already trimmed, 16 kHz mono)
+# recording is split at the quietest point near every LONG_AUDIO_SEGMENT_MS
+# boundary, with LONG_AUDIO_OVERLAP_MS of shared audio around each cut.
+# Segments are transcribed in parallel (bounded by LONG_AUDIO_CONCURRENCY and
+# the shared STT limiter) and stitched back in order, dropping the words
+# repeated in the overlap. Wall time is roughly that of the slowest segment
+# instead of growing with the length of the recording, and no single upload
+# exceeds the provider's size limit.
+
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from audio_preprocess import (
+    TARGET_SAMPLE_RATE, VAD_FRAME_MS, encode_for_upload, finish_stats,
+    frame_dbfs, record_transcription, segment_samples
+)
+from resilience import call, call_async
+
+
+LONG_AUDIO_THRESHOLD_MS = int(os.environ.get("LONG_AUDIO_THRESHOLD_MS", 150_000))
+LONG_AUDIO_SEGMENT_MS = int(os.environ.get("LONG_AUDIO_SEGMENT_MS", 120_000))
+LONG_AUDIO_OVERLAP_MS = int(os.environ.get("LONG_AUDIO_OVERLAP_MS", 2_000))
+LONG_AUDIO_CONCURRENCY = int(os.environ.get("LONG_AUDIO_CONCURRENCY", 5))
+# Groq rejects uploads above 25 MB on the free tier
+STT_MAX_UPLOAD_BYTES = int(os.environ.get("STT_MAX_UPLOAD_BYTES", 24 * 1024 * 1024))
+
+# A cut is placed at the quietest frame in the last part of each segment
+CUT_SEARCH_FRACTION = 0.25
+# Overlap de-duplication looks at most this many words back
+MAX_OVERLAP_WORDS = 40
+
+
+def is_long(audio):
+    return len(audio) > LONG_AUDIO_THRESHOLD_MS
+
+
+# -----------------------------
+# SPLITTING
+# -----------------------------
+def plan_segments(levels, total_ms, segment_ms=LONG_AUDIO_SEGMENT_MS, overlap_ms=LONG_AUDIO_OVERLAP_MS):
+    """
+    Returns [(start_ms, end_ms), ...] covering [0, total_ms). `levels` are
+    per-frame dBFS values (audio_preprocess.frame_dbfs); each cut goes at
+    the quietest frame in the last CUT_SEARCH_FRACTION of a segment, and
+    neighbouring segments share overlap_ms around the cut.
+    """
+    segments = []
+    start = 0
+    half = overlap_ms // 2
+    search_ms = max(VAD_FRAME_MS, int(segment_ms * CUT_SEARCH_FRACTION))
+    while total_ms - start > segment_ms:
+        lo = (start + segment_ms - search_ms) // VAD_FRAME_MS
+        hi = max(lo + 1, min(len(levels), (start + segment_ms) // VAD_FRAME_MS))
+        window = levels[lo:hi]
+        # latest quietest frame, so uniform loudness still cuts near the full segment length
+        cut_frame = lo + len(window) - 1 - int(np.argmin(window[::-1])) if len(window) else hi
+        cut = cut_frame * VAD_FRAME_MS + VAD_FRAME_MS // 2
+        segments.append((start, min(total_ms, cut + half)))
+        start = max(start + 1, cut - half)
+    segments.append((start, total_ms))
+    return segments
+
+
+def split_audio(audio):
+    levels = frame_dbfs(segment_samples(audio), TARGET_SAMPLE_RATE)
+    return [audio[a:b] for a, b in plan_segments(levels, len(audio))]
+
+
+# -----------------------------
+# STITCHING
+# -----------------------------
+def _norm(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def stitch_transcripts(texts):
+    """
+    Joins segment transcripts in order. Where the end of one segment is
+    repeated at the start of the next (the overlap), the repeated words are
+    dropped from the later segment. The longest run of matching words within
+    the first few words of the next segment wins.
+    """
+    words = []
+    for text in texts:
+        new = text.split()
+        if words and new:
+            tail = [_norm(w) for w in words[-MAX_OVERLAP_WORDS:]]
+            head = [_norm(w) for w in new[:MAX_OVERLAP_WORDS + 5]]
+            drop = 0
+            for k in range(min(len(tail), len(head)), 0, -1):
+                suffix = tail[-k:]
+                # allow a few extra words at the start of the next segment
+                # (a clipped first word transcribed differently)
+                for offset in range(0, min(5, len(head) - k) + 1):
+                    if offset and k < 2:
+                        break  # a single shifted word is too weak a match
+                    if head[offset:offset + k] == suffix:
+                        drop = offset + k
+                        break
+                if drop:
+                    break
+            new = new[drop:]
+        words.extend(new)
+    return " ".join(words)
+
+
+# -----------------------------
+# PARALLEL TRANSCRIPTION
+# -----------------------------
+def _encode_segments(audio):
+    return [encode_for_upload(segment) for segment in split_audio(audio)]
+
+
+def transcribe_long(client, stt_model, audio, stats):
+    """Transcribes a long AudioSegment with a pool of at most LONG_AUDIO_CONCURRENCY requests."""
+    started = time.perf_counter()
+    uploads = _encode_segments(audio)
+    finish_stats(stats, sum(len(u[1]) for u in uploads), time.perf_counter() - started)
+
+    def transcribe(upload):
+        return call(
+            "groq", lambda: client.audio.transcriptions.create(model=stt_model, file=upload, language="en").text,
+            limit="stt")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(LONG_AUDIO_CONCURRENCY, len(uploads))) as pool:
+        texts = list(pool.map(transcribe, uploads))
+    record_transcription(stats, stats["upload_bytes"], time.perf_counter() - started)
+    print(f"🎙️ long audio: {len(uploads)} segments, {stats['duration_ms'] / 1000:.0f}s of speech")
+    return stitch_transcripts(texts)
+
+
+async def transcribe_long_async(client, stt_model, audio, stats):
+    started = time.perf_counter()
+    uploads = await asyncio.to_thread(_encode_segments, audio)
+    finish_stats(stats, sum(len(u[1]) for u in uploads), time.perf_counter() - started)
+    gate = asyncio.Semaphore(LONG_AUDIO_CONCURRENCY)
+
+    async def transcribe(upload):
+        async with gate:
+            result = await call_async(
+                "groq", lambda: client.audio.transcriptions.create(model=stt_model, file=upload, language="en"),
+                limit="stt")
+            return result.text
+
+    started = time.perf_counter()
+    texts = await asyncio.gather(*(transcribe(upload) for upload in uploads))
+    record_transcription(stats, stats["upload_bytes"], time.perf_counter() - started)
+    print(f"🎙️ long audio: {len(uploads)} segments, {stats['duration_ms'] / 1000:.0f}s of speech")
+    return stitch_transcripts(texts)
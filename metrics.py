@@ -0,0 +1,284 @@
+# metrics.py
+#
+# Latency / payload / cache / error metrics in the Prometheus text format,
+# plus optional per-request JSON traces.
+#
+#   with span("stt", "groq"):            # histogram + error counter
+#       ...
+#   trace = RequestTrace("ui")           # per request
+#   with trace.span("llm", "groq"): ...  # same, and recorded in the trace
+#   trace.finish()                       # one JSON line if TRACE_JSON=1
+#
+# render() produces the body served at /metrics (see gradio_app.py).
+# Hand-rolled rather than built on prometheus_client (which the Pipfile does
+# install): only counters, histograms and scrape-time gauges are needed, and
+# the same span() calls also feed the per-request traces below.
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+
+TRACE_JSON = os.environ.get("TRACE_JSON", "0") != "0"
+TRACE_FILE = os.environ.get("TRACE_FILE")  # default: stdout
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+# -----------------------------
+# METRIC TYPES
+# -----------------------------
+def _label_str(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def snapshot(self):
+        """{label values tuple: count}, copied under the lock."""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{self.name}_bucket{_label_str(names, key + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_label_str(names, key + ('+Inf',))} {state[-1]}")
+                lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {state[-2]}")
+                lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauge whose samples come from `fn()` -> {label_values_tuple: value} at scrape time."""
+
+    def __init__(self, name, documentation, labelnames, fn):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.fn()
+        except Exception as e:
+            lines.append(f"# collection failed: {e!r}")
+            return lines
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+_registry = []
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------
+# APP METRICS
+# -----------------------------
+REQUESTS = Counter("ai_doctor_requests_total", "Consultations started.", ["entrypoint"])
+STAGE_SECONDS = Histogram(
+    "ai_doctor_stage_duration_seconds",
+    "Duration of pipeline stages (stt, document_ingest, retrieval, image_encode, llm, tts, audio_finish, file_write).",
+    ["stage", "provider"])
+STAGE_ERRORS = Counter(
+    "ai_doctor_stage_errors_total", "Failed pipeline stages by provider and exception type.",
+    ["stage", "provider", "error"])
+PAYLOAD_BYTES = Counter(
+    "ai_doctor_payload_bytes_total", "Bytes sent to / received from providers.",
+    ["stage", "direction"])
+TIME_TO_FIRST_AUDIO = Histogram(
+    "ai_doctor_time_to_first_audio_seconds", "Request start to first playable audio segment.",
+    ["entrypoint"])
+CACHE_REQUESTS = Counter(
+    "ai_doctor_cache_requests_total", "Cache lookups by cache and result (hit/miss).",
+    ["cache", "result"])
+
+
+def _hit_ratios():
+    counts = CACHE_REQUESTS.snapshot()
+    ratios = {}
+    for cache in {cache for cache, _ in counts}:
+        hits = counts.get((cache, "hit"), 0)
+        total = hits + counts.get((cache, "miss"), 0)
+        ratios[(cache,)] = hits / total if total else 0.0
+    return ratios
+
+
+GaugeCallback("ai_doctor_cache_hit_ratio", "Hit ratio per cache since start.", ["cache"], _hit_ratios)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_payload(stage, direction, nbytes):
+    if nbytes:
+        PAYLOAD_BYTES.inc(nbytes, stage=stage, direction=direction)
+
+
+# -----------------------------
+# SPANS & TRACES
+# -----------------------------
+class Span:
+    """Times a block (sync `with` or `async with`); errors are counted per provider."""
+
+    def __init__(self, stage, provider=None, trace=None):
+        self.stage = stage
+        self.provider = provider or "local"
+        self.trace = trace
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(elapsed, stage=self.stage, provider=self.provider)
+        # A consumer closing a stream early (GeneratorExit) or a cancelled task is not a provider error
+        failed = exc_type is not None and not issubclass(exc_type, (GeneratorExit, asyncio.CancelledError))
+        if failed:
+            STAGE_ERRORS.inc(stage=self.stage, provider=self.provider, error=exc_type.__name__)
+        if self.trace is not None:
+            self.trace.spans.append({
+                "stage": self.stage,
+                "provider": self.provider,
+                "start_ms": round((self.started - self.trace.started) * 1000, 1),
+                "duration_ms": round(elapsed * 1000, 1),
+                "error": exc_type.__name__ if failed else None,
+            })
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def span(stage, provider=None, trace=None):
+    return Span(stage, provider, trace)
+
+
+class RequestTrace:
+    def __init__(self, entrypoint):
+        self.entrypoint = entrypoint
+        self.request_id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.spans = []
+        self.first_audio = None
+        self.fields = {}  # extra per-request numbers for the JSON trace (e.g. prompt tokens)
+        REQUESTS.inc(entrypoint=entrypoint)
+
+    def span(self, stage, provider=None):
+        return Span(stage, provider, self)
+
+    def first_audio_ready(self):
+        """Records time to first audio once; returns the seconds (None if already recorded)."""
+        if self.first_audio is not None:
+            return None
+        self.first_audio = time.perf_counter() - self.started
+        TIME_TO_FIRST_AUDIO.observe(self.first_audio, entrypoint=self.entrypoint)
+        return self.first_audio
+
+    def finish(self, **fields):
+        if not TRACE_JSON:
+            return
+        record = {
+            "request_id": self.request_id,
+            "entrypoint": self.entrypoint,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "time_to_first_audio_ms": round(self.first_audio * 1000, 1) if self.first_audio is not None else None,
+            "spans": self.spans,
+        }
+        record.update(self.fields)
+        record.update(fields)
+        line = json.dumps(record)
+        if TRACE_FILE:
+            with _trace_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        else:
+            print(line, file=sys.stdout, flush=True)
+
+
+_trace_lock = threading.Lock()
+
+
+def timed_iter(iterable, span_obj):
+    """Wraps a (streaming) iterator so the span covers its whole consumption."""
+    with span_obj:
+        yield from iterable
+
+
+async def timed_aiter(aiterable, span_obj):
+    async with span_obj:
+        async for item in aiterable:
+            yield item
@@ -0,0 +1,339 @@
+# pipeline.py
+#
+# The consultation pipeline shared by every entry point (Gradio UI, ...):
+# speech to text -> RAG context -> vision LLM -> text to speech.
+
+import hashlib
+import os
+
+from brain_of_the_doctor import encode_image, analyze_image_with_query, stream_image_with_query, iter_sentences
+from voice_of_the_patient import transcribe_with_groq
+from voice_of_the_doctor import text_to_speech_with_gtts, text_to_speech_with_elevenlabs, ELEVENLABS_MODEL_ID
+from clients import resolve_voice_id
+from tts_cache import synthesize_cached
+from tts_hedge import hedge_call
+from tts_profiles import get_profile, cache_format, finish_clip, record_served
+from llm_cache import get_llm_cache
+from prompt_budget import context_budget, pack_chunks, fit_transcript, record_prompt_tokens
+from rag_ingest import ingest_documents
+from retrieval_engine import get_engine
+from artifacts import get_artifact_store
+from sessions import get_session_store
+from metrics import RequestTrace, span, timed_iter, record_payload
+
+
+# -----------------------------
+# SYSTEM PROMPT
+# -----------------------------
+system_prompt = (
+    "You have to act as a professional doctor, i know you are not but this is for learning purpose. "
+    "What's in this image?. Do you find anything wrong with it medically? "
+    "If you make a differential, suggest some remedies for them. Donot add any numbers or special characters in "
+    "your response. Your response should be in one long paragraph. Also always answer as if you are answering to a real person. "
+    "Donot say 'In the image I see' but say 'With what I see, I think you have ....' "
+    "Dont respond as an AI model in markdown, your answer should mimic that of an actual doctor not an AI bot, "
+    "Keep your answer concise (max 2 sentences). No preamble, start your answer right away please"
+)
+# Part of the LLM cache key: editing the prompt retires the replies cached under the old one
+SYSTEM_PROMPT_VERSION = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+
+
+# -----------------------------
+# RAG (UPLOADED DOCUMENTS)
+# -----------------------------
+RAG_TOP_K = int(os.environ.get("RAG_TOP_K", 5))             # most chunks in a prompt (the token budget decides first)
+RAG_CANDIDATES = int(os.environ.get("RAG_CANDIDATES", 20))   # chunks retrieved for packing (prompt_budget.py)
+
+
+def prepare_documents(documents):
+    """
+    Ingests the uploads and opens their index. This is the slow part of RAG
+    (parse, embed, index build) and does not need the transcript, so callers
+    can run it while transcription is still in flight.
+    Returns (engine or None, message used when there is nothing to search).
+    """
+    if not documents:
+        return None, "No external medical documents uploaded. Using general medical knowledge."
+
+    ingested = [entry for entry in ingest_documents(documents) if entry[1]]
+    if not ingested:
+        return None, "Uploaded documents contained no readable text. Using general medical knowledge."
+    return get_engine(ingested), None
+
+
+def retrieve_context(prepared, query, history=""):
+    """
+    Hybrid (BM25 + dense) search over a prepared index, the transcript being
+    the query; the best distinct chunks that fit the prompt's token budget
+    (what the consultation history leaves) are kept (prompt_budget.py).
+    """
+    engine, message = prepared
+    if engine is None:
+        return message
+    if query:
+        candidates = engine.search(query, k=RAG_CANDIDATES)
+    else:
+        candidates = [(chunk, 0.0) for chunk in engine.chunks[:RAG_CANDIDATES]]
+
+    best = pack_chunks(candidates, context_budget(system_prompt, query, LLM_MODEL, history), RAG_TOP_K, LLM_MODEL)
+    if not best:
+        return "No retrieved passage fits the prompt budget. Using general medical knowledge."
+    lines = [f"- {chunk['text']}" for chunk in best]
+    return "Retrieved from uploaded medical documents:\n" + "\n".join(lines)
+
+
+# -----------------------------
+# RAG PROMPT
+# -----------------------------
+def build_rag_prompt(retrieved_context, speech_to_text_output, trace=None, history=""):
+    """The user message; system_prompt is sent separately as the `system` message."""
+    transcript = fit_transcript(speech_to_text_output, LLM_MODEL)
+    record_prompt_tokens(system_prompt, retrieved_context, transcript, LLM_MODEL, trace, history)
+    earlier = f"Consultation So Far:\n{history}\n\n" if history else ""
+    return (
+        f"{earlier}"
+        f"Medical Context:\n{retrieved_context}\n\n"
+        f"Patient Query:\n{transcript}"
+    )
+
+
+# -----------------------------
+# MULTI-TURN SESSIONS (sessions.py)
+# -----------------------------
+def open_session(session_id):
+    """The consultation `session_id` continues, or None for a one-off request."""
+    return get_session_store().get(session_id) if session_id else None
+
+
+def session_documents(session, documents):
+    """prepare_documents(), except that a follow-up reuses the index already built for its session."""
+    if session is not None:
+        prepared = session.documents_for(documents)
+        if prepared is not None:
+            return prepared
+    prepared = prepare_documents(documents)
+    if session is not None and documents:
+        session.set_documents(documents, prepared)
+    return prepared
+
+
+def session_image(session, image_filepath):
+    """encode_image(), except that a follow-up reuses the image already encoded for its session."""
+    if session is not None:
+        encoded = session.image_for(image_filepath)
+        if encoded is not None:
+            return encoded
+    if not image_filepath:
+        return None
+    encoded = encode_image(image_filepath)
+    if session is not None:
+        session.set_image(image_filepath, encoded)
+    return encoded
+
+
+def finish_session_turn(session, transcript, reply, retrieved_context):
+    if session is not None and reply:
+        get_session_store().finish_turn(session, transcript, reply, retrieved_context, LLM_MODEL)
+
+
+# -----------------------------
+# TEXT TO SPEECH (ONE CLIP, CACHED)
+# -----------------------------
+def _timed_synth(synth, provider, trace, profile, provider_format):
+    # Only cache misses reach the provider, so only those are timed as "tts"
+    def run(path):
+        with span("tts", provider, trace):
+            synth(path)
+        record_payload("tts", "received", os.path.getsize(path))
+        with span("audio_finish", None, trace):
+            finish_clip(path, profile, provider_format)
+    return run
+
+
+def _gtts_speech(text, output_audio_path, trace, profile):
+    return synthesize_cached(
+        text, "gtts", "en", "gtts", cache_format(profile, "mp3"),
+        _timed_synth(lambda path: text_to_speech_with_gtts(text, path), "gtts", trace, profile, "mp3"),
+        output_audio_path
+    )
+
+
+def synthesize_speech(text, output_audio_path, eleven_key, trace=None, profile=None):
+    """
+    Returns a playable path in the client's audio profile (tts_profiles.py);
+    repeated text is served from the TTS cache. ElevenLabs is hedged with
+    gTTS once it misses TTS_HEDGE_BUDGET_MS (tts_hedge.py).
+    """
+    profile = get_profile(profile)
+    if not eleven_key:
+        return _gtts_speech(text, output_audio_path, trace, profile)
+
+    def elevenlabs():
+        voice_id = resolve_voice_id(eleven_key)
+        output_format = profile.elevenlabs_format
+        return synthesize_cached(
+            text, "elevenlabs", voice_id, ELEVENLABS_MODEL_ID, cache_format(profile, output_format),
+            _timed_synth(
+                lambda path: text_to_speech_with_elevenlabs(
+                    input_text=text, output_filepath=path, voice_id=voice_id, output_format=output_format),
+                "elevenlabs", trace, profile, output_format
+            ),
+            output_audio_path
+        )
+
+    fallback_path = f"{os.path.splitext(output_audio_path)[0]}.gtts{profile.extension}"
+    return hedge_call(elevenlabs, lambda: _gtts_speech(text, fallback_path, trace, profile))
+
+
+# -----------------------------
+# MAIN PROCESS FUNCTION
+# -----------------------------
+# STREAMING_TTS=0 restores the old behaviour: wait for the whole reply,
+# then synthesize it as a single clip.
+STREAMING_TTS = os.environ.get("STREAMING_TTS", "1") != "0"
+LLM_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+STT_MODEL = "whisper-large-v3"
+NO_INPUT_MESSAGE = "No image or audio provided for analysis."
+
+
+def report_error(errors, message):
+    """
+    Failures are reported in the output text; `message` is also appended to
+    `errors` (a list, or None) for callers that must know whether the
+    request failed without parsing that text (batch_triage.py).
+    """
+    if errors is not None:
+        errors.append(message)
+    return message
+
+
+def process_inputs(audio_filepath, image_filepath, documents, session_id=None, tts_profile=None, errors=None):
+    """
+    Generator: yields (transcript, context, doctor_response, audio) as soon as
+    each piece is available. In streaming mode the LLM reply is cut into
+    sentences and every sentence is synthesized and yielded as its own audio
+    segment while the model is still generating the rest.
+    With a `session_id` the request is a turn of that consultation: the image
+    and documents of earlier turns are reused when none are uploaded, and the
+    model sees the conversation so far (sessions.py). `tts_profile` picks
+    the reply audio's format and bitrate (tts_profiles.py; default TTS_PROFILE).
+    Every failure shown in the outputs is also appended to `errors`, if given.
+    """
+    trace = RequestTrace("pipeline")
+    try:
+        yield from _process_inputs(trace, audio_filepath, image_filepath, documents, session_id, tts_profile, errors)
+    finally:
+        trace.finish()
+
+
+def _process_inputs(trace, audio_filepath, image_filepath, documents, session_id=None, tts_profile=None,
+                    errors=None):
+    # API KEYS
+    groq_key = os.environ.get("GROQ_API_KEY")
+    if not groq_key:
+        yield "", "", report_error(errors, "Error: GROQ_API_KEY not set"), None
+        return
+
+    eleven_key = os.environ.get("ELEVENLABS_API_KEY") or os.environ.get("ELEVEN_API_KEY")
+
+    # SPEECH TO TEXT
+    try:
+        speech_to_text_output = ""
+        if audio_filepath:
+            with trace.span("stt", "groq"):
+                speech_to_text_output = transcribe_with_groq(
+                    GROQ_API_KEY=groq_key,
+                    audio_filepath=audio_filepath,
+                    stt_model=STT_MODEL
+                )
+    except Exception as e:
+        yield "", "", report_error(errors, f"Error transcribing audio: {e}"), None
+        return
+
+    # SESSION (earlier turns of this consultation)
+    session = open_session(session_id)
+    history = session.history(LLM_MODEL) if session is not None else ""
+
+    # RAG CONTEXT
+    try:
+        with trace.span("document_ingest"):
+            prepared = session_documents(session, documents)
+    except Exception as e:
+        prepared = None, report_error(errors, f"Error ingesting documents: {e}")
+    with trace.span("retrieval"):
+        retrieved_context = retrieve_context(prepared, speech_to_text_output, history)
+    yield speech_to_text_output, retrieved_context, "", None
+
+    # RAG PROMPT
+    rag_prompt = build_rag_prompt(retrieved_context, speech_to_text_output, trace, history)
+
+    # IMAGE / LLM ANALYSIS
+    answered = False  # only a complete model reply becomes a session turn
+    try:
+        if image_filepath:
+            with trace.span("image_encode"):
+                encoded = session_image(session, image_filepath)
+        else:
+            encoded = session_image(session, None)
+        if not (encoded or speech_to_text_output):
+            sentences = iter([NO_INPUT_MESSAGE])
+        else:
+            llm_cache = get_llm_cache()
+            cache_key, cached_reply = llm_cache.lookup(
+                LLM_MODEL, SYSTEM_PROMPT_VERSION, encoded, speech_to_text_output, retrieved_context, history)
+            if cached_reply is not None:
+                sentences = iter_sentences(iter([cached_reply]))
+            elif STREAMING_TTS:
+                sentences = iter_sentences(llm_cache.tee(cache_key, timed_iter(stream_image_with_query(
+                    query=rag_prompt,
+                    encoded_image=encoded,
+                    model=LLM_MODEL,
+                    system=system_prompt
+                ), trace.span("llm", "groq"))))
+            else:
+                with trace.span("llm", "groq"):
+                    reply = analyze_image_with_query(
+                        query=rag_prompt,
+                        encoded_image=encoded,
+                        model=LLM_MODEL,
+                        system=system_prompt
+                    )
+                llm_cache.put(cache_key, reply)
+                sentences = iter([reply])
+            answered = True
+    except Exception as e:
+        sentences = iter([report_error(errors, f"Error running model: {e}")])
+
+    # TEXT TO SPEECH (SENTENCE BY SENTENCE, INTO THIS REQUEST'S OWN DIRECTORY)
+    artifacts = get_artifact_store().new_request()
+    profile = get_profile(tts_profile)
+    spoken = []
+    reply = []
+    index = 0
+    while True:
+        try:
+            sentence = next(sentences)
+        except StopIteration:
+            break
+        except Exception as e:
+            answered = False
+            spoken.append(report_error(errors, f"Error running model: {e}"))
+            yield speech_to_text_output, retrieved_context, " ".join(spoken), None
+            break
+
+        spoken.append(sentence)
+        reply.append(sentence)
+        audio_path = None
+        try:
+            audio_path = synthesize_speech(
+                sentence, artifacts.path(f"reply_{index:02d}{profile.extension}"), eleven_key, trace, profile)
+            index += 1
+        except Exception as e:
+            spoken.append(report_error(errors, f"TTS error: {e}"))
+        if audio_path:
+            trace.first_audio_ready()
+        record_served(profile, audio_path)
+        yield speech_to_text_output, retrieved_context, " ".join(spoken), audio_path
+
+    if answered:
+        finish_session_turn(session, speech_to_text_output, " ".join(reply), retrieved_context)
@@ -0,0 +1,187 @@
+# prompt_budget.py
+#
+# Token-budgeted prompt assembly. The text part of every LLM request is
+# bounded by PROMPT_TOKEN_BUDGET: the system prompt (sent as its own
+# `system` message) and the transcript (at most PROMPT_TRANSCRIPT_TOKENS)
+# are counted first, then the history of a multi-turn consultation (bounded
+# by sessions.py), and the retrieved context gets what is left (at most
+# PROMPT_CONTEXT_TOKENS). Context chunks are packed best-score first,
+# skipping near-duplicates of chunks already taken (word-trigram Jaccard
+# >= PROMPT_DEDUP_JACCARD) and chunks that no longer fit.
+#
+# Token counts use the model's own tokenizer when the `tokenizers` package
+# has it loaded (PROMPT_TOKENIZER, or the default for LLM models below);
+# otherwise a conservative estimate of one token per 3.5 characters.
+# Requests never download a tokenizer: a local tokenizer.json path loads on
+# first use, a Hugging Face repo only through load_tokenizer() at warm-up
+# (clients.warm_up), and until then the estimate is used.
+# The image is not part of the budget: its size is bounded by
+# image_preprocess.py.
+#
+# Exported: ai_doctor_prompt_tokens{part} (system, history, context,
+# transcript, total) per request; the per-request numbers also go to the JSON trace.
+
+import math
+import os
+import re
+import threading
+
+from metrics import Histogram
+
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 2048))
+PROMPT_CONTEXT_TOKENS = int(os.environ.get("PROMPT_CONTEXT_TOKENS", 1200))
+PROMPT_TRANSCRIPT_TOKENS = int(os.environ.get("PROMPT_TRANSCRIPT_TOKENS", 512))
+PROMPT_DEDUP_JACCARD = float(os.environ.get("PROMPT_DEDUP_JACCARD", 0.8))
+PROMPT_TOKENIZER = os.environ.get("PROMPT_TOKENIZER")  # tokenizer.json path or Hugging Face repo; overrides MODEL_TOKENIZERS
+
+# Tokenizer repo per Groq model id (gated repos need HF_TOKEN; without it the estimate is used)
+MODEL_TOKENIZERS = {
+    "meta-llama/llama-4-scout-17b-16e-instruct": "meta-llama/Llama-4-Scout-17B-16E-Instruct",
+    "meta-llama/llama-4-maverick-17b-128e-instruct": "meta-llama/Llama-4-Maverick-17B-128E-Instruct",
+}
+CHARS_PER_TOKEN = 3.5
+# Role headers and separators the chat template adds around each message
+MESSAGE_OVERHEAD_TOKENS = 8
+
+PROMPT_TOKENS = Histogram(
+    "ai_doctor_prompt_tokens", "Prompt tokens per LLM request by part (system, history, context, transcript, total).",
+    ["part"], buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192))
+
+
+# -----------------------------
+# TOKEN COUNTING
+# -----------------------------
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+def _tokenizer_name(model):
+    return PROMPT_TOKENIZER or MODEL_TOKENIZERS.get(model)
+
+
+def load_tokenizer(model):
+    """
+    Loads the tokenizer count_tokens uses for `model`; for a Hugging Face
+    repo that is a download, so call it at warm-up, not in a request.
+    Returns it, or None (none configured, or it failed to load).
+    """
+    name = _tokenizer_name(model)
+    if not name:
+        return None
+    with _tokenizers_lock:
+        if name not in _tokenizers:
+            try:
+                from tokenizers import Tokenizer
+                _tokenizers[name] = Tokenizer.from_file(name) if os.path.isfile(name) else Tokenizer.from_pretrained(name)
+            except Exception as e:
+                print(f"⚠️ tokenizer {name} unavailable, estimating prompt tokens: {e}")
+                _tokenizers[name] = None
+        return _tokenizers[name]
+
+
+def _get_tokenizer(model):
+    name = _tokenizer_name(model)
+    if not name:
+        return None
+    with _tokenizers_lock:
+        if name in _tokenizers:
+            return _tokenizers[name]
+    # A local file loads without the network; a Hub repo waits for load_tokenizer() at warm-up
+    return load_tokenizer(model) if os.path.isfile(name) else None
+
+
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer(model)
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens, model=None):
+    """`text` if it fits; else its start and end (where a question usually is) around " … "."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    # Shrink by characters until the count fits; the estimate makes this one or two rounds
+    keep = int(len(text) * max_tokens / count_tokens(text, model))
+    while keep > 0:
+        head = keep // 3
+        candidate = text[:head].rstrip() + " … " + text[len(text) - (keep - head):].lstrip()
+        if count_tokens(candidate, model) <= max_tokens:
+            return candidate
+        keep = int(keep * 0.9)
+    return ""
+
+
+# -----------------------------
+# CONTEXT PACKING
+# -----------------------------
+_WORD = re.compile(r"\w+")
+
+
+def _shingles(text):
+    words = _WORD.findall(text.lower())
+    if len(words) < 3:
+        return {tuple(words)}
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def _near_duplicate(shingles, taken):
+    for other in taken:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= PROMPT_DEDUP_JACCARD:
+            return True
+    return False
+
+
+def context_budget(system, transcript, model=None, history=""):
+    """Tokens left for retrieved context once the system prompt, the transcript and the history are counted."""
+    used = (count_tokens(system, model) + count_tokens(fit_transcript(transcript, model), model)
+            + count_tokens(history, model) + 2 * MESSAGE_OVERHEAD_TOKENS)
+    return max(0, min(PROMPT_CONTEXT_TOKENS, PROMPT_TOKEN_BUDGET - used))
+
+
+def pack_chunks(scored_chunks, budget, max_chunks=None, model=None):
+    """
+    Chunks from [(chunk, score)], best score first, without near-duplicates,
+    whose texts fit in `budget` tokens together (one line each).
+    """
+    packed, taken = [], []
+    remaining = budget
+    for chunk, _ in sorted(scored_chunks, key=lambda item: -item[1]):
+        if max_chunks is not None and len(packed) >= max_chunks:
+            break
+        shingles = _shingles(chunk["text"])
+        if _near_duplicate(shingles, taken):
+            continue
+        cost = count_tokens(f"- {chunk['text']}\n", model)
+        if cost > remaining:
+            continue  # a shorter, lower-ranked chunk may still fit
+        packed.append(chunk)
+        taken.append(shingles)
+        remaining -= cost
+    return packed
+
+
+def fit_transcript(transcript, model=None):
+    return truncate_to_tokens(transcript or "", PROMPT_TRANSCRIPT_TOKENS, model)
+
+
+# -----------------------------
+# REPORTING
+# -----------------------------
+def record_prompt_tokens(system, context, transcript, model=None, trace=None, history=""):
+    counts = {
+        "system": count_tokens(system, model),
+        "history": count_tokens(history, model),
+        "context": count_tokens(context, model),
+        "transcript": count_tokens(transcript, model),
+    }
+    counts["total"] = sum(counts.values()) + 2 * MESSAGE_OVERHEAD_TOKENS
+    for part, tokens in counts.items():
+        PROMPT_TOKENS.observe(tokens, part=part)
+    if trace is not None:
+        trace.fields["prompt_tokens"] = counts
+    return counts
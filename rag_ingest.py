@@ -0,0 +1,254 @@
+# rag_ingest.py
+#
+# Document ingestion for the RAG upload box:
+#   file -> text (page by page) -> overlapping chunks -> embeddings -> on-disk store
+# The store is keyed by SHA-256 of the file contents, so re-uploading the same
+# guideline PDF is a hash lookup instead of a re-parse and re-embed.
+# Uploads are file paths (Gradio) or in-memory Uploads (api.py, uploads.py).
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from metrics import record_cache
+from uploads import Upload, open_source, source_name
+
+
+RAG_STORE_DIR = os.environ.get("RAG_STORE_DIR", ".rag_store")
+EMBEDDING_MODEL = os.environ.get("RAG_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+CHUNK_SIZE = int(os.environ.get("RAG_CHUNK_SIZE", 800))
+CHUNK_OVERLAP = int(os.environ.get("RAG_CHUNK_OVERLAP", 150))
+
+# PDFs with more pages than this are parsed in the process pool
+PARALLEL_PDF_PAGES = int(os.environ.get("RAG_PARALLEL_PDF_PAGES", 40))
+PDF_PAGES_PER_TASK = 25
+PDF_WORKERS = int(os.environ.get("RAG_PDF_WORKERS", os.cpu_count() or 2))
+
+# Used only when sentence-transformers is not installed
+HASH_EMBEDDING_DIM = 384
+
+
+# -----------------------------
+# HASHING
+# -----------------------------
+def file_sha256(path, block_size=1 << 20):
+    if isinstance(path, Upload):
+        return hashlib.sha256(path.data).hexdigest()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# -----------------------------
+# TEXT EXTRACTION
+# -----------------------------
+def _extract_pdf_range(path, start, stop):
+    # Runs inside a worker process: open the PDF once, extract a range of pages
+    from pypdf import PdfReader
+    reader = PdfReader(open_source(path))
+    return [(i + 1, reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        return _pdf_pool
+
+
+def extract_pages(path):
+    """
+    Returns a list of (page_number, text). Text files are a single page.
+    Large PDFs are split into page ranges and parsed in a process pool.
+    """
+    if not source_name(path).lower().endswith(".pdf"):
+        if isinstance(path, Upload):
+            return [(1, bytes(path.data).decode("utf-8", errors="replace"))]
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return [(1, f.read())]
+
+    from pypdf import PdfReader
+    page_count = len(PdfReader(open_source(path)).pages)
+    if page_count <= PARALLEL_PDF_PAGES:
+        return _extract_pdf_range(path, 0, page_count)
+
+    pool = _get_pdf_pool()
+    futures = [
+        pool.submit(_extract_pdf_range, path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
+# -----------------------------
+# CHUNKING
+# -----------------------------
+def chunk_pages(pages, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Splits page texts into ~chunk_size character chunks that overlap by
+    `overlap` characters. Cuts are moved back to the nearest whitespace so
+    words are not split. Each chunk remembers the page it starts on.
+    """
+    chunks = []
+    for page_number, text in pages:
+        text = " ".join(text.split())
+        start = 0
+        while start < len(text):
+            end = min(start + chunk_size, len(text))
+            if end < len(text):
+                space = text.rfind(" ", start + overlap + 1, end)
+                if space != -1:
+                    end = space
+            piece = text[start:end].strip()
+            if piece:
+                chunks.append({"text": piece, "page": page_number})
+            if end >= len(text):
+                break
+            start = max(end - overlap, start + 1)
+            space = text.find(" ", start, end)
+            if space != -1:
+                start = space + 1
+    return chunks
+
+
+# -----------------------------
+# EMBEDDINGS
+# -----------------------------
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def _get_embedder():
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+                _embedder = SentenceTransformer(EMBEDDING_MODEL)
+            except Exception as e:
+                print("⚠️ sentence-transformers unavailable, using hashing embeddings:", e)
+                _embedder = False
+        return _embedder
+
+
+def embedding_model_name():
+    return EMBEDDING_MODEL if _get_embedder() else f"hashing-{HASH_EMBEDDING_DIM}"
+
+
+def _hash_embed(texts):
+    vectors = np.zeros((len(texts), HASH_EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in text.lower().split():
+            bucket = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "little")
+            vectors[row, bucket % HASH_EMBEDDING_DIM] += 1.0
+    return vectors
+
+
+def embed_texts(texts):
+    """Returns L2-normalized float32 embeddings, one row per text."""
+    if not texts:
+        return np.zeros((0, HASH_EMBEDDING_DIM), dtype=np.float32)
+    embedder = _get_embedder()
+    if embedder:
+        vectors = np.asarray(embedder.encode(list(texts), batch_size=64), dtype=np.float32)
+    else:
+        vectors = _hash_embed(texts)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# -----------------------------
+# ON-DISK STORE (keyed by SHA-256)
+# -----------------------------
+def _entry_dir(sha):
+    return os.path.join(RAG_STORE_DIR, sha)
+
+
+def load_entry(sha):
+    """Returns (chunks, vectors) for a stored document, or None (missing or other embedding model)."""
+    entry = _entry_dir(sha)
+    try:
+        with open(os.path.join(entry, "chunks.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("model") != embedding_model_name():
+            return None
+        chunks = meta["chunks"]
+        vectors = np.load(os.path.join(entry, "vectors.npy"))
+    except (OSError, ValueError, KeyError):
+        return None
+    return chunks, vectors
+
+
+def _save_entry(sha, source_name, chunks, vectors):
+    # Write into a temp dir and rename, so readers never see a half-written entry
+    os.makedirs(RAG_STORE_DIR, exist_ok=True)
+    entry = _entry_dir(sha)
+    tmp = tempfile.mkdtemp(dir=RAG_STORE_DIR, prefix=".tmp-")
+    try:
+        with open(os.path.join(tmp, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"source": source_name, "model": embedding_model_name(), "chunks": chunks}, f)
+        np.save(os.path.join(tmp, "vectors.npy"), vectors)
+        if os.path.isdir(entry) and load_entry(sha) is None:
+            # Embedded with another model (or damaged): a rename cannot replace a non-empty directory
+            shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+    except OSError as e:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # Fine when another worker stored the same document first
+        if load_entry(sha) is None:
+            print(f"⚠️ Could not store {source_name} in {RAG_STORE_DIR}: {e}")
+
+
+def ingest_document(path):
+    """
+    Returns (sha, chunks, vectors) for one uploaded file. Already-seen
+    contents are served from the store without parsing or embedding.
+    """
+    sha = file_sha256(path)
+    cached = load_entry(sha)
+    record_cache("rag_documents", cached is not None)
+    if cached is not None:
+        return (sha,) + cached
+
+    chunks = chunk_pages(extract_pages(path))
+    vectors = embed_texts([c["text"] for c in chunks])
+    _save_entry(sha, source_name(path), chunks, vectors)
+    return sha, chunks, vectors
+
+
+def _document_path(document):
+    # gr.File gives plain paths (gradio 4+) or tempfile wrappers with .name (older); the API gives Uploads
+    if isinstance(document, (str, Upload)):
+        return document
+    return getattr(document, "name", None)
+
+
+def ingest_documents(documents):
+    """Ingests every uploaded file; unreadable files are skipped with a log line."""
+    results = []
+    for document in documents or []:
+        path = _document_path(document)
+        if not path:
+            continue
+        try:
+            results.append(ingest_document(path))
+        except Exception as e:
+            print(f"⚠️ Could not ingest {source_name(path)}: {e}")
+    return results
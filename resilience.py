@@ -0,0 +1,332 @@
+# resilience.py
+#
+# Retries and circuit breakers shared by every provider call (Groq STT/LLM,
+# ElevenLabs and gTTS TTS).
+#   - 429, 5xx and connection/timeout errors are retried a bounded number of
+#     times with exponential backoff and jitter (Retry-After is honoured);
+#     other errors (bad request, auth) go straight back to the caller.
+#   - Each provider has a circuit breaker: after BREAKER_FAILURES consecutive
+#     retryable failures it opens, and calls fail immediately with
+#     ProviderUnavailable instead of waiting out the SDK timeout. After
+#     BREAKER_RESET_SECONDS one probe call is let through (half-open); its
+#     outcome closes the breaker or opens it again.
+# Each attempt takes its own slot/token from the scheduler limiter (`limit=`),
+# so the backoff sleep does not hold a slot.
+#
+# Environment:
+#   PROVIDER_RETRY_ATTEMPTS   attempts per call, first one included (3)
+#   PROVIDER_RETRY_BASE_MS    backoff before the second attempt (250)
+#   PROVIDER_RETRY_MAX_MS     cap on a single backoff (4000)
+#   BREAKER_FAILURES          consecutive failures that open a breaker (5)
+#   BREAKER_RESET_SECONDS     open time before the half-open probe (30)
+
+import asyncio
+import contextlib
+import os
+import random
+import threading
+import time
+
+from metrics import Counter, GaugeCallback
+from scheduler import provider_limit
+
+
+RETRY_ATTEMPTS = max(1, int(os.environ.get("PROVIDER_RETRY_ATTEMPTS", 3)))
+RETRY_BASE_SECONDS = float(os.environ.get("PROVIDER_RETRY_BASE_MS", 250)) / 1000
+RETRY_MAX_SECONDS = float(os.environ.get("PROVIDER_RETRY_MAX_MS", 4000)) / 1000
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", 30))
+
+# Transport failures, matched by class name so no SDK has to be imported here
+# (httpx, groq/openai, requests as used by gTTS)
+_TRANSIENT_ERRORS = {
+    "APIConnectionError", "APITimeoutError", "TimeoutException", "NetworkError",
+    "RemoteProtocolError", "ConnectionError", "Timeout",
+}
+
+RETRIES = Counter("ai_doctor_provider_retries_total", "Provider calls retried after a transient error.", ["provider"])
+REJECTIONS = Counter(
+    "ai_doctor_circuit_rejections_total", "Provider calls failed fast by an open circuit breaker.", ["provider"])
+
+
+class ProviderUnavailable(RuntimeError):
+    """Raised without calling the provider while its circuit breaker is open."""
+
+    def __init__(self, provider, retry_in):
+        super().__init__(
+            f"{provider} is temporarily unavailable after repeated failures; "
+            f"not calling it again for {max(retry_in, 0):.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+# -----------------------------
+# ERROR CLASSIFICATION
+# -----------------------------
+def _chain(exc):
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+
+
+def _response(exc):
+    # groq/httpx: .response; gTTS: .rsp
+    return getattr(exc, "response", None) or getattr(exc, "rsp", None)
+
+
+def status_code(exc):
+    for e in _chain(exc):
+        code = getattr(e, "status_code", None)
+        if code is None:
+            code = getattr(_response(e), "status_code", None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def is_retryable(exc):
+    if isinstance(exc, ProviderUnavailable):
+        return False
+    code = status_code(exc)
+    if code is not None:
+        return code == 429 or code >= 500
+    for e in _chain(exc):
+        if isinstance(e, (ConnectionError, TimeoutError)):
+            return True
+        if any(cls.__name__ in _TRANSIENT_ERRORS for cls in type(e).__mro__):
+            return True
+    return False
+
+
+def _retry_after(exc):
+    for e in _chain(exc):
+        headers = getattr(_response(e), "headers", None)
+        if not headers:
+            continue
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass  # HTTP-date form: fall back to our own backoff
+    return None
+
+
+def backoff_delay(attempt, exc=None):
+    """Seconds before attempt `attempt + 1`: exponential with equal jitter, at least Retry-After, capped."""
+    ceiling = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+    retry_after = _retry_after(exc) if exc is not None else None
+    if retry_after:
+        delay = max(delay, retry_after)
+    return min(delay, RETRY_MAX_SECONDS)
+
+
+# -----------------------------
+# CIRCUIT BREAKER
+# -----------------------------
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises ProviderUnavailable while open; in half-open lets a single probe through."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            retry_in = self.opened_at + self.reset_seconds - now
+            if self.state == OPEN and retry_in <= 0:
+                self.state = HALF_OPEN
+                self._probe_started = None
+            if self.state == HALF_OPEN:
+                # A probe that never reported back (cancelled caller) is replaced after reset_seconds
+                if self._probe_started is None or now - self._probe_started > self.reset_seconds:
+                    self._probe_started = now
+                    return
+                retry_in = self._probe_started + self.reset_seconds - now
+        REJECTIONS.inc(provider=self.name)
+        raise ProviderUnavailable(self.name, retry_in)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"✅ circuit {self.name}: closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and 0 < self.failure_threshold <= self.failures):
+                print(f"⚠️ circuit {self.name}: open for {self.reset_seconds:.0f}s after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_started = None
+
+    @property
+    def is_open(self):
+        return self.state == OPEN
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    """The shared breaker for "groq", "elevenlabs" or "gtts"."""
+    with _breakers_lock:
+        breaker = _breakers.get(provider)
+        if breaker is None:
+            breaker = _breakers[provider] = CircuitBreaker(provider)
+        return breaker
+
+
+def breaker_states():
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+GaugeCallback(
+    "ai_doctor_circuit_state", "Circuit breaker state per provider (0 closed, 1 half-open, 2 open).",
+    ["provider"], lambda: {(name,): _STATE_VALUES[state] for name, state in breaker_states().items()})
+
+
+# -----------------------------
+# CALLS
+# -----------------------------
+def _limit(name):
+    return provider_limit(name) if name else contextlib.nullcontext()
+
+
+def _after_failure(provider, breaker, exc, attempt):
+    """Seconds to wait before retrying, or None if the error should go to the caller."""
+    if not is_retryable(exc):
+        # The provider answered; the request itself was refused
+        breaker.record_success()
+        return None
+    breaker.record_failure()
+    if attempt >= RETRY_ATTEMPTS or breaker.is_open:
+        return None
+    RETRIES.inc(provider=provider)
+    return backoff_delay(attempt, exc)
+
+
+def call(provider, fn, limit=None):
+    """fn() with retries, behind `provider`'s breaker; each attempt runs inside the `limit` limiter."""
+    breaker = get_breaker(provider)
+    attempt = 0
+    while True:
+        attempt += 1
+        breaker.before_call()
+        try:
+            with _limit(limit):
+                result = fn()
+        except Exception as e:
+            delay = _after_failure(provider, breaker, e, attempt)
+            if delay is None:
+                raise
+        else:
+            breaker.record_success()
+            return result
+        time.sleep(delay)
+
+
+async def call_async(provider, fn, limit=None):
+    """Async form of call(): fn() returns an awaitable."""
+    breaker = get_breaker(provider)
+    attempt = 0
+    while True:
+        attempt += 1
+        breaker.before_call()
+        try:
+            async with _limit(limit):
+                result = await fn()
+        except Exception as e:
+            delay = _after_failure(provider, breaker, e, attempt)
+            if delay is None:
+                raise
+        else:
+            breaker.record_success()
+            return result
+        await asyncio.sleep(delay)
+
+
+def stream(provider, open_stream, limit=None):
+    """
+    Generator over open_stream() (an iterator). Attempts are retried until
+    the first item arrives; after that errors go to the caller, since part
+    of the stream has already been used. The `limit` slot is held until the
+    stream ends, never across a backoff.
+    """
+    breaker = get_breaker(provider)
+    attempt = 0
+    while True:
+        attempt += 1
+        breaker.before_call()
+        with _limit(limit):
+            items = iter(open_stream())
+            try:
+                first = next(items)
+            except StopIteration:
+                breaker.record_success()
+                return
+            except Exception as e:
+                delay = _after_failure(provider, breaker, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                breaker.record_success()
+                yield first
+                yield from items
+                return
+        time.sleep(delay)
+
+
+async def stream_async(provider, open_stream, limit=None):
+    """
+    Async generator over open_stream() (an async iterator). Attempts are
+    retried until the first item arrives; after that errors go to the
+    caller, since part of the stream has already been used. The `limit`
+    slot is held until the stream ends.
+    """
+    breaker = get_breaker(provider)
+    attempt = 0
+    while True:
+        attempt += 1
+        breaker.before_call()
+        async with _limit(limit):
+            stream = open_stream().__aiter__()
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                breaker.record_success()
+                return
+            except Exception as e:
+                delay = _after_failure(provider, breaker, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                breaker.record_success()
+                yield first
+                async for item in stream:
+                    yield item
+                return
+        await asyncio.sleep(delay)
@@ -0,0 +1,420 @@
+# retrieval_engine.py
+#
+# Hybrid top-k retrieval over the chunks produced by rag_ingest:
+#   - dense: chunk embeddings in one contiguous float32 matrix, memory-mapped
+#     from disk. Rows are grouped by k-means cluster (an IVF layout), so a
+#     query scores its nearest clusters as contiguous slices instead of
+#     streaming the whole matrix - that is what keeps ~1M chunks in single-digit ms.
+#   - lexical: BM25 inverted index (CSR postings) so drug names and exact
+#     terms still match when the embedding does not rank them. In large
+#     stores, terms found in more than RAG_BM25_MAX_DF of the chunks and in at
+#     least RAG_BM25_SKIP_MIN_DF chunks ("is", "my", "the") are skipped: their
+#     postings would make every query cost O(corpus), while their idf is low
+#     (about 1.6 at 20% of the chunks, against 10+ for a term in a handful).
+#     A few uploaded PDFs stay below that floor and score every term.
+# Candidates from both sides are blended with RAG_HYBRID_ALPHA and the top k
+# picked with argpartition.
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from rag_ingest import RAG_STORE_DIR, embed_texts, embedding_model_name
+
+
+HYBRID_ALPHA = float(os.environ.get("RAG_HYBRID_ALPHA", 0.5))  # 1.0 = dense only, 0.0 = BM25 only
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_MAX_DF = float(os.environ.get("RAG_BM25_MAX_DF", 0.2))  # share of chunks above which a term is skipped...
+BM25_SKIP_MIN_DF = int(os.environ.get("RAG_BM25_SKIP_MIN_DF", 5000))  # ...if it is also in at least this many
+MAX_OPEN_INDEXES = int(os.environ.get("RAG_MAX_OPEN_INDEXES", 8))
+MAX_DISK_INDEXES = int(os.environ.get("RAG_MAX_DISK_INDEXES", 64))  # least recently used beyond this are deleted
+
+# IVF layout: below IVF_MIN_CHUNKS the whole matrix is one list (exact search)
+IVF_MIN_CHUNKS = int(os.environ.get("RAG_IVF_MIN_CHUNKS", 20000))
+IVF_NPROBE = int(os.environ.get("RAG_IVF_NPROBE", 16))
+KMEANS_SAMPLE = 50000
+KMEANS_ITERATIONS = 10
+CANDIDATES_PER_SIDE = 50
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+# -----------------------------
+# INDEX BUILD
+# -----------------------------
+def _write_npy(path, array):
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=array.dtype, shape=array.shape)
+    out[...] = array
+    out.flush()
+    del out
+
+
+def _kmeans(vectors, n_clusters, seed=0):
+    # Spherical k-means on a sample; rows are L2-normalized so dot = cosine
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = sample[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    return centroids
+
+
+def _assign(vectors, centroids, block=65536):
+    return np.concatenate([
+        np.argmax(vectors[i:i + block] @ centroids.T, axis=1)
+        for i in range(0, len(vectors), block)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+
+def build_index(index_dir, chunks, vectors, model):
+    """
+    Writes the dense matrix and the BM25 postings for `chunks` to `index_dir`.
+    Large collections are clustered and stored cluster by cluster, with
+    list_ptr marking where each cluster's rows start. Per-posting BM25 weights
+    (idf * saturated tf) are precomputed here, so a query only has to add up
+    the weights of its terms. `model` names the embedding model of `vectors`;
+    queries must be embedded with the same one.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+    if len(chunks) >= IVF_MIN_CHUNKS:
+        n_clusters = int(np.sqrt(len(chunks)))
+        centroids = _kmeans(vectors, n_clusters)
+        assign = _assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        vectors = vectors[order]
+        chunks = [chunks[i] for i in order]
+        list_ptr = np.zeros(n_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_clusters), out=list_ptr[1:])
+    else:
+        centroids = np.zeros((1, vectors.shape[1] if vectors.ndim == 2 else 0), dtype=np.float32)
+        list_ptr = np.array([0, len(chunks)], dtype=np.int64)
+
+    vocab = {}
+    doc_terms = []
+    doc_len = np.zeros(len(chunks), dtype=np.float32)
+    for doc_id, chunk in enumerate(chunks):
+        counts = Counter(tokenize(chunk["text"]))
+        doc_len[doc_id] = sum(counts.values())
+        doc_terms.append([(vocab.setdefault(term, len(vocab)), tf) for term, tf in counts.items()])
+
+    # CSR postings: term -> [ptr[t], ptr[t+1]) slice of doc ids / weights
+    df = np.zeros(len(vocab), dtype=np.int64)
+    for terms in doc_terms:
+        for term_id, _ in terms:
+            df[term_id] += 1
+    ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(df, out=ptr[1:])
+    docs = np.empty(ptr[-1], dtype=np.int32)
+    weights = np.empty(ptr[-1], dtype=np.float32)
+
+    n_docs = max(len(chunks), 1)
+    avg_len = float(doc_len.mean()) if len(chunks) else 1.0
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+    fill = ptr[:-1].copy()
+    for doc_id, terms in enumerate(doc_terms):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[doc_id] / (avg_len or 1.0))
+        for term_id, tf in terms:
+            pos = fill[term_id]
+            docs[pos] = doc_id
+            weights[pos] = idf[term_id] * tf * (BM25_K1 + 1) / (tf + norm)
+            fill[term_id] += 1
+
+    _write_npy(os.path.join(index_dir, "embeddings.npy"), vectors)
+    _write_npy(os.path.join(index_dir, "centroids.npy"), centroids)
+    _write_npy(os.path.join(index_dir, "list_ptr.npy"), list_ptr)
+    _write_npy(os.path.join(index_dir, "postings_ptr.npy"), ptr)
+    _write_npy(os.path.join(index_dir, "postings_doc.npy"), docs)
+    _write_npy(os.path.join(index_dir, "postings_weight.npy"), weights)
+    with open(os.path.join(index_dir, "chunks.json"), "w", encoding="utf-8") as f:
+        json.dump(chunks, f)
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"model": model, "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0}, f)
+    # vocab.json last: its presence marks a complete index
+    with open(os.path.join(index_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f)
+
+
+# -----------------------------
+# ENGINE
+# -----------------------------
+class RetrievalEngine:
+    """Read-only hybrid index opened from disk with memory-mapped arrays."""
+
+    def __init__(self, index_dir, nprobe=IVF_NPROBE):
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode="r")
+        self.embeddings = load("embeddings.npy")
+        self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+        self.list_ptr = np.load(os.path.join(index_dir, "list_ptr.npy"))
+        self.postings_ptr = load("postings_ptr.npy")
+        self.postings_doc = load("postings_doc.npy")
+        self.postings_weight = load("postings_weight.npy")
+        with open(os.path.join(index_dir, "chunks.json"), "r", encoding="utf-8") as f:
+            self.chunks = json.load(f)
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        self.model = index_model(index_dir)
+        self.nprobe = min(nprobe, len(self.centroids))
+        self._scratch = threading.local()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _accumulator(self):
+        # One zeroed score per chunk, allocated once per thread and re-zeroed after each query
+        scores = getattr(self._scratch, "scores", None)
+        if scores is None:
+            scores = self._scratch.scores = np.zeros(len(self.chunks), dtype=np.float32)
+        return scores
+
+    def bm25_scores(self, query):
+        """
+        Sparse BM25: returns (doc_ids, scores) for docs containing any query
+        term. Cost follows the postings of the query's selective terms, not
+        the corpus size: in large stores, terms over BM25_MAX_DF are skipped
+        (unless nothing else matched), and weights are added in place into a per-thread
+        score array.
+        """
+        slices = []
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is not None:
+                slices.append((self.postings_ptr[term_id], self.postings_ptr[term_id + 1]))
+        max_df = max(BM25_SKIP_MIN_DF - 1, int(BM25_MAX_DF * len(self.chunks)))
+        selective = [(a, b) for a, b in slices if b - a <= max_df]
+        if not selective and slices:
+            selective = [min(slices, key=lambda s: s[1] - s[0])]
+        if not selective:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+        scores = self._accumulator()
+        touched = []
+        for a, b in selective:
+            docs = self.postings_doc[a:b]
+            # A term lists each doc once, so plain fancy-index addition is exact
+            scores[docs] += self.postings_weight[a:b]
+            touched.append(docs)
+        doc_ids = touched[0] if len(touched) == 1 else np.unique(np.concatenate(touched))
+        doc_ids = np.asarray(doc_ids)
+        result = scores[doc_ids]
+        scores[doc_ids] = 0
+        return doc_ids, result
+
+    def _dense_candidates(self, query_vector, centroid_scores, limit):
+        # Score the nearest clusters; their rows are contiguous slices of the memmap
+        if len(self.centroids) > 1:
+            probe = np.argpartition(-centroid_scores, self.nprobe - 1)[:self.nprobe]
+        else:
+            probe = [0]
+        ids = np.concatenate([np.arange(self.list_ptr[c], self.list_ptr[c + 1]) for c in probe])
+        rows = np.concatenate([self.embeddings[self.list_ptr[c]:self.list_ptr[c + 1]] for c in probe])
+        return self._top(ids, rows @ query_vector, limit)
+
+    @staticmethod
+    def _top(ids, scores, limit):
+        if len(ids) > limit:
+            keep = np.argpartition(-scores, limit - 1)[:limit]
+            return ids[keep]
+        return ids
+
+    def search_batch(self, queries, k=3, alpha=HYBRID_ALPHA):
+        """
+        Returns, for each query, a list of (chunk, score) best-first.
+        Query embeddings and centroid scores are computed for the whole batch
+        with one matrix product each; candidates from the probed clusters and
+        from BM25 are then rescored exactly and blended.
+        """
+        if not queries or not self.chunks:
+            return [[] for _ in queries]
+
+        query_vectors = embed_texts(queries)
+        centroid_scores = query_vectors @ self.centroids.T
+        limit = max(CANDIDATES_PER_SIDE, k)
+        results = []
+        for row, query in enumerate(queries):
+            lex_ids, lex_scores = self.bm25_scores(query)
+            candidates = [self._top(lex_ids, lex_scores, limit)]
+            if alpha > 0:
+                candidates.append(self._dense_candidates(query_vectors[row], centroid_scores[row], limit))
+            ids = np.unique(np.concatenate(candidates))
+            if len(ids) == 0:
+                results.append([])
+                continue
+
+            scores = alpha * (self.embeddings[ids] @ query_vectors[row])
+            if alpha < 1 and len(lex_ids):
+                lexical = np.zeros(len(ids), dtype=np.float32)
+                pos = np.searchsorted(lex_ids, ids)
+                pos[pos == len(lex_ids)] = 0
+                hit = lex_ids[pos] == ids
+                lexical[hit] = lex_scores[pos[hit]]
+                scores += (1 - alpha) * lexical / lex_scores.max()
+
+            top_k = min(k, len(ids))
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best])]
+            results.append([(self.chunks[ids[i]], float(scores[i])) for i in best])
+        return results
+
+    def search(self, query, k=3, alpha=HYBRID_ALPHA):
+        return self.search_batch([query], k=k, alpha=alpha)[0]
+
+
+# -----------------------------
+# INDEX CACHE (one index per set of uploaded documents)
+# -----------------------------
+# Indexes are built in a temp directory next to their final place and moved
+# there with os.replace, so a worker process never sees (or deletes) another
+# one's half-built index. Opening an index touches its directory; past
+# RAG_MAX_DISK_INDEXES, the least recently used ones are deleted.
+INDEXES_DIR = os.path.join(RAG_STORE_DIR, "indexes")
+_STALE_BUILD_SECONDS = 3600  # a .build- directory this old belongs to a crashed build
+
+_engines = OrderedDict()
+_engines_lock = threading.Lock()
+_build_locks = {}  # index key -> lock held while that index is built or opened
+
+
+def index_model(index_dir):
+    """Embedding model the index in `index_dir` was built with (None if unknown or incomplete)."""
+    try:
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("model")
+    except (OSError, ValueError):
+        return None
+
+
+def get_engine(ingested):
+    """
+    Returns a RetrievalEngine for the output of rag_ingest.ingest_documents.
+    The index is built once per distinct set of document hashes and
+    embedding model, and reopened from disk afterwards; recently used
+    engines stay open in memory. Builds of different indexes run in
+    parallel; callers wanting the same one wait for a single build.
+    """
+    model = embedding_model_name()
+    shas = sorted({sha for sha, _, _ in ingested})
+    key = hashlib.sha256("\n".join([model] + shas).encode("utf-8")).hexdigest()
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is not None:
+            _engines.move_to_end(key)
+            return engine
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+
+    try:
+        with build_lock:
+            with _engines_lock:
+                engine = _engines.get(key)
+            if engine is not None:
+                return engine
+
+            index_dir = os.path.join(INDEXES_DIR, key)
+            built = False
+            if not _index_ready(index_dir, model):
+                by_sha = {sha: (chunks, vectors) for sha, chunks, vectors in ingested}
+                chunks, vectors = [], []
+                for sha in shas:
+                    chunks.extend(by_sha[sha][0])
+                    vectors.append(by_sha[sha][1])
+                _build_in_place(index_dir, chunks, np.vstack(vectors), model)
+                built = True
+            os.utime(index_dir)
+            engine = RetrievalEngine(index_dir)
+
+            with _engines_lock:
+                _engines[key] = engine
+                while len(_engines) > MAX_OPEN_INDEXES:
+                    _engines.popitem(last=False)
+            if built:
+                prune_indexes()
+            return engine
+    finally:
+        with _engines_lock:
+            _build_locks.pop(key, None)
+
+
+def _index_ready(index_dir, model):
+    complete = os.path.exists(os.path.join(index_dir, "vocab.json"))
+    if complete and index_model(index_dir) != model:
+        print(f"⚠️ index {os.path.basename(index_dir)[:12]} was built with {index_model(index_dir)}, rebuilding for {model}")
+        return False
+    return complete
+
+
+def _build_in_place(index_dir, chunks, vectors, model):
+    """build_index into a temp directory, then moved to `index_dir`; a complete index another process put there first wins."""
+    os.makedirs(INDEXES_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".build-", dir=INDEXES_DIR)
+    try:
+        build_index(tmp_dir, chunks, vectors, model)
+        if os.path.isdir(index_dir) and not _index_ready(index_dir, model):
+            # Incomplete or built with another model: move it aside first, os.replace will not overwrite it
+            _remove_dir(index_dir)
+        try:
+            os.replace(tmp_dir, index_dir)
+        except OSError:
+            if not _index_ready(index_dir, model):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _remove_dir(path):
+    """Renames `path` out of the way before deleting it, so it disappears at once for other processes."""
+    doomed = tempfile.mkdtemp(prefix=".delete-", dir=INDEXES_DIR)
+    try:
+        os.replace(path, os.path.join(doomed, "index"))
+    except OSError:
+        pass
+    shutil.rmtree(doomed, ignore_errors=True)
+
+
+def prune_indexes(max_indexes=MAX_DISK_INDEXES):
+    """
+    Deletes the least recently used index directories past `max_indexes`
+    (those open in this process are kept), plus what crashed builds left.
+    """
+    try:
+        names = os.listdir(INDEXES_DIR)
+    except FileNotFoundError:
+        return
+    with _engines_lock:
+        open_keys = set(_engines)
+    now = time.time()
+    indexes = []
+    for name in names:
+        path = os.path.join(INDEXES_DIR, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if name.startswith("."):
+            if now - mtime > _STALE_BUILD_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        elif name not in open_keys:
+            indexes.append((mtime, path))
+    indexes.sort(reverse=True)
+    for _, path in indexes[max(0, max_indexes - len(open_keys)):]:
+        _remove_dir(path)
@@ -0,0 +1,229 @@
+# scheduler.py
+#
+# Per-provider admission control for outbound calls (STT, LLM, TTS):
+#   - a concurrency limit (how many calls may be in flight at once)
+#   - a token-bucket rate limit (requests per minute, with a burst allowance)
+# Calls wait here instead of hitting the provider and getting a 429, so under
+# bursts throughput stays at the provider's limit and the excess waits in the
+# Gradio queue. The same limiter works from threads (`with`) and from
+# asyncio (`async with`), so sync and async pipelines share one budget.
+#
+# "tts" is ElevenLabs; gTTS has its own "gtts" limiter, so the hedge fallback
+# (tts_hedge.py) never queues behind the ElevenLabs calls it routes around.
+#
+# Environment, per provider (STT_, LLM_, TTS_, GTTS_ prefix):
+#   <P>_CONCURRENCY     max in-flight calls
+#   <P>_RATE_PER_MIN    sustained requests per minute (0 = no rate limit)
+#   <P>_BURST           bucket size (defaults to the concurrency limit)
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import GaugeCallback
+
+
+DEFAULT_LIMITS = {
+    # provider: (concurrency, requests per minute)
+    "stt": (4, 20),
+    "llm": (4, 30),
+    "tts": (3, 0),
+    "gtts": (4, 0),
+}
+
+class TokenBucket:
+    def __init__(self, rate_per_min, burst):
+        self.rate = rate_per_min / 60.0
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Takes a token and returns 0, or returns the seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            delay = self._take()
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def acquire_async(self):
+        waited = 0.0
+        while True:
+            delay = self._take()
+            if not delay:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+
+class _Slots:
+    """Counting semaphore that threads and event-loop tasks can wait on together."""
+
+    def __init__(self, value):
+        self._value = value
+        self._cond = threading.Condition()
+        self._async_waiters = deque()  # (loop, future)
+
+    def acquire(self):
+        with self._cond:
+            while self._value <= 0:
+                self._cond.wait()
+            self._value -= 1
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._value > 0:
+                    self._value -= 1
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._cond:
+                    try:
+                        self._async_waiters.remove((loop, waiter))
+                    except ValueError:
+                        # Already woken: hand the wake-up to the next waiter
+                        self._wake_async()
+                raise
+
+    def _wake_async(self):
+        while self._async_waiters:
+            loop, waiter = self._async_waiters.popleft()
+            if not waiter.done():
+                loop.call_soon_threadsafe(_set_if_pending, waiter)
+                return
+
+    def release(self):
+        with self._cond:
+            self._value += 1
+            self._cond.notify()
+            self._wake_async()
+
+
+def _set_if_pending(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ProviderLimiter:
+    """Use as `with limiter:` in threads or `async with limiter:` in coroutines."""
+
+    def __init__(self, name, concurrency, rate_per_min, burst=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.slots = _Slots(concurrency)
+        self.bucket = TokenBucket(rate_per_min, burst or concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _admitted(self, waited):
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.throttled_seconds += waited
+
+    def __enter__(self):
+        with self._lock:
+            self.waiting += 1
+        start = time.monotonic()
+        self.slots.acquire()
+        self.bucket.acquire()
+        self._admitted(time.monotonic() - start)
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.in_flight -= 1
+        self.slots.release()
+        return False
+
+    async def __aenter__(self):
+        with self._lock:
+            self.waiting += 1
+        start = time.monotonic()
+        try:
+            await self.slots.acquire_async()
+        except BaseException:
+            with self._lock:
+                self.waiting -= 1
+            raise
+        try:
+            await self.bucket.acquire_async()
+        except BaseException:
+            with self._lock:
+                self.waiting -= 1
+            self.slots.release()
+            raise
+        self._admitted(time.monotonic() - start)
+        return self
+
+    async def __aexit__(self, *exc):
+        return self.__exit__(*exc)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+            }
+
+
+def _from_env(name):
+    concurrency, rate = DEFAULT_LIMITS[name]
+    prefix = name.upper()
+    concurrency = int(os.environ.get(f"{prefix}_CONCURRENCY", concurrency))
+    rate = float(os.environ.get(f"{prefix}_RATE_PER_MIN", rate))
+    burst = int(os.environ.get(f"{prefix}_BURST", concurrency))
+    return ProviderLimiter(name, concurrency, rate, burst)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def provider_limit(name):
+    """The shared limiter for "stt", "llm" or "tts"."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = _from_env(name)
+        return limiter
+
+
+def scheduler_stats():
+    return {name: provider_limit(name).stats() for name in DEFAULT_LIMITS}
+
+
+def _stat_gauge(field):
+    return lambda: {(name,): stats[field] for name, stats in scheduler_stats().items()}
+
+
+GaugeCallback("ai_doctor_provider_in_flight", "Provider calls currently in flight.", ["provider"], _stat_gauge("in_flight"))
+GaugeCallback("ai_doctor_provider_waiting", "Provider calls waiting for a slot or token.", ["provider"], _stat_gauge("waiting"))
+GaugeCallback(
+    "ai_doctor_provider_throttled_seconds", "Total time calls spent waiting in the limiter.",
+    ["provider"], _stat_gauge("throttled_seconds"))
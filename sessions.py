@@ -0,0 +1,262 @@
+# sessions.py
+#
+# Multi-turn consultations. A session (keyed by a server-issued id: the
+# Gradio session hash, or SessionStore.create() for the HTTP API) keeps,
+# server-side:
+#   - the preprocessed image, so a follow-up question about the same photo
+#     needs no re-upload and no re-encode,
+#   - the prepared document index and the last retrieved context,
+#   - the conversation: a running summary of older turns plus the latest
+#     turns verbatim.
+# The history is kept within SESSION_HISTORY_TOKENS: once it grows past
+# that, the oldest turns are folded into the summary in the background by a
+# small text model (SESSION_SUMMARY_MODEL), so follow-ups never wait on it.
+# Each session is capped at SESSION_MAX_BYTES (turns and then the image are
+# dropped past it); sessions idle for SESSION_IDLE_SECONDS expire, and the
+# least recently used are evicted beyond SESSION_MAX_SESSIONS.
+
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Counter, GaugeCallback
+from prompt_budget import count_tokens, truncate_to_tokens
+from uploads import source_key
+
+
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", 500))
+SESSION_IDLE_SECONDS = float(os.environ.get("SESSION_IDLE_SECONDS", 1800))
+SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", 2 * 1024 * 1024))
+SESSION_HISTORY_TOKENS = int(os.environ.get("SESSION_HISTORY_TOKENS", 600))
+SESSION_SUMMARY_TOKENS = int(os.environ.get("SESSION_SUMMARY_TOKENS", 250))
+SESSION_KEEP_TURNS = int(os.environ.get("SESSION_KEEP_TURNS", 2))  # latest turns always kept verbatim
+SESSION_SUMMARY_MODEL = os.environ.get("SESSION_SUMMARY_MODEL", "llama-3.1-8b-instant")
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You keep a doctor's running notes of a consultation. Merge the earlier notes and the new exchanges "
+    f"into one short paragraph (at most {SESSION_SUMMARY_TOKENS * 3 // 4} words): the patient's symptoms "
+    "and questions, what was seen in the photo, and the advice already given. No preamble."
+)
+
+SESSION_EVICTIONS = Counter("ai_doctor_session_evictions_total", "Sessions removed from the store.", ["reason"])
+SESSION_SUMMARIES = Counter("ai_doctor_session_summaries_total", "History compactions by outcome.", ["result"])
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def document_key(documents):
+    return tuple(source_key(document) for document in documents or ())
+
+
+class Session:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.encoded_image = None
+        self.image_source = None      # source_key() of the upload the image was encoded from
+        self.prepared = None          # prepare_documents() result for this consultation's uploads
+        self.documents = ()           # uploads `prepared` was built from
+        self.retrieved_context = ""
+        self.summary = ""
+        self.turns = []               # [(patient, doctor)], oldest first
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        self._compacting = False
+
+    # -----------------------------
+    # STATE
+    # -----------------------------
+    def image_for(self, image_filepath):
+        """The encoded image for a follow-up: the kept one when the upload is absent or unchanged, else None."""
+        with self.lock:
+            if image_filepath is None or source_key(image_filepath) == self.image_source:
+                return self.encoded_image
+            return None
+
+    def set_image(self, image_filepath, encoded_image):
+        with self.lock:
+            self.image_source = source_key(image_filepath)
+            self.encoded_image = encoded_image
+            self._enforce_cap()
+
+    def documents_for(self, documents):
+        """The prepared index for a follow-up: the kept one when no or the same uploads are given, else None."""
+        with self.lock:
+            if not documents or document_key(documents) == self.documents:
+                return self.prepared
+            return None
+
+    def set_documents(self, documents, prepared):
+        with self.lock:
+            self.documents = document_key(documents)
+            self.prepared = prepared
+
+    def add_turn(self, transcript, reply, retrieved_context):
+        with self.lock:
+            self.turns.append((transcript or "", reply or ""))
+            self.retrieved_context = retrieved_context or ""
+            self._enforce_cap()
+
+    def size_bytes(self):
+        text = self.summary + self.retrieved_context + "".join(p + d for p, d in self.turns)
+        return len(text.encode("utf-8")) + len(self.encoded_image or "")
+
+    def _enforce_cap(self):
+        # Oldest turns go first; the image only if the text alone is still too big
+        while self.size_bytes() > SESSION_MAX_BYTES and len(self.turns) > 1:
+            self.turns.pop(0)
+        if self.size_bytes() > SESSION_MAX_BYTES:
+            self.encoded_image = None
+
+    # -----------------------------
+    # HISTORY
+    # -----------------------------
+    def _format(self, summary, turns):
+        lines = [f"Summary of earlier turns: {summary}"] if summary else []
+        for patient, doctor in turns:
+            lines.append(f"Patient: {patient}")
+            lines.append(f"Doctor: {doctor}")
+        return "\n".join(lines)
+
+    def history(self, model=None):
+        """The conversation so far, within SESSION_HISTORY_TOKENS ("" on the first turn)."""
+        with self.lock:
+            text = self._format(self.summary, self.turns)
+        # Over budget only while a compaction is still running
+        return truncate_to_tokens(text, SESSION_HISTORY_TOKENS, model)
+
+    def needs_compaction(self, model=None):
+        with self.lock:
+            if self._compacting or len(self.turns) <= SESSION_KEEP_TURNS:
+                return False
+            text = self._format(self.summary, self.turns)
+        return count_tokens(text, model) > SESSION_HISTORY_TOKENS
+
+    def compact(self, summarize):
+        """Folds all but the last SESSION_KEEP_TURNS turns into the summary; the model call runs unlocked."""
+        with self.lock:
+            if self._compacting:
+                return
+            self._compacting = True
+            summary = self.summary
+            folded = self.turns[:max(0, len(self.turns) - SESSION_KEEP_TURNS)]
+        try:
+            if not folded:
+                return
+            try:
+                new_summary = summarize(summary, folded)
+                SESSION_SUMMARIES.inc(result="model")
+            except Exception as e:
+                print("⚠️ session summary failed, keeping an extract instead:", e)
+                new_summary = self._format(summary, folded)
+                SESSION_SUMMARIES.inc(result="extract")
+            new_summary = truncate_to_tokens(" ".join(new_summary.split()), SESSION_SUMMARY_TOKENS)
+            with self.lock:
+                # Turns added while the model was running stay verbatim
+                if self.turns[:len(folded)] == folded:
+                    del self.turns[:len(folded)]
+                    self.summary = new_summary
+        finally:
+            with self.lock:
+                self._compacting = False
+
+
+def summarize_with_model(summary, turns):
+    from brain_of_the_doctor import analyze_image_with_query
+
+    notes = f"Earlier notes: {summary}\n\n" if summary else ""
+    exchanges = "\n".join(f"Patient: {p}\nDoctor: {d}" for p, d in turns)
+    return analyze_image_with_query(
+        query=f"{notes}New exchanges:\n{exchanges}",
+        model=SESSION_SUMMARY_MODEL,
+        encoded_image=None,
+        system=SUMMARY_SYSTEM_PROMPT
+    )
+
+
+# -----------------------------
+# STORE
+# -----------------------------
+class SessionStore:
+    def __init__(self, max_sessions=SESSION_MAX_SESSIONS, idle_seconds=SESSION_IDLE_SECONDS,
+                 summarize=summarize_with_model):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.summarize = summarize
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="session-summary")
+
+    def get(self, session_id, create=True):
+        """
+        The live session for `session_id` (a new one if it expired or never
+        existed), or None. Only pass create=True for ids the server issued:
+        a client-chosen id could be another patient's.
+        """
+        if not session_id or not _SESSION_ID.match(session_id):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                if not create:
+                    return None
+                session = self._sessions[session_id] = Session(session_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    SESSION_EVICTIONS.inc(reason="lru")
+            self._sessions.move_to_end(session_id)
+            session.last_used = now
+            return session
+
+    def create(self):
+        """A new session under an unguessable id (for clients that name sessions themselves)."""
+        return self.get(secrets.token_urlsafe(24))
+
+    def reset(self, session_id):
+        """Starts the consultation over: forgets the image, documents and history."""
+        with self._lock:
+            if self._sessions.pop(session_id, None) is not None:
+                SESSION_EVICTIONS.inc(reason="reset")
+
+    def _expire(self, now):
+        # Oldest first, so the scan stops at the first session still in use
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.idle_seconds:
+                break
+            del self._sessions[session_id]
+            SESSION_EVICTIONS.inc(reason="idle")
+
+    def finish_turn(self, session, transcript, reply, retrieved_context, model=None):
+        """Records a completed turn and compacts the history in the background when it is over budget."""
+        session.add_turn(transcript, reply, retrieved_context)
+        if session.needs_compaction(model):
+            self._summarizer.submit(session.compact, self.summarize)
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {"sessions": len(sessions), "bytes": sum(s.size_bytes() for s in sessions)}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
+
+
+GaugeCallback("ai_doctor_sessions", "Consultation sessions held in memory.", [],
+              lambda: {(): get_session_store().stats()["sessions"]})
+GaugeCallback("ai_doctor_session_bytes", "Memory held by consultation sessions (images, history, context).", [],
+              lambda: {(): get_session_store().stats()["bytes"]})
@@ -0,0 +1,118 @@
+# test_batch_triage.py
+#
+# Every way the pipeline reports a failure must mark the batch case as
+# failed, so that --retry-failed re-runs it. Provider calls are replaced
+# with fakes; run with `python -m pytest test_batch_triage.py`.
+
+import pytest
+
+import batch_triage
+import pipeline
+
+
+class _NoLLMCache:
+    def lookup(self, *key):
+        return None, None
+
+    def tee(self, cache_key, chunks):
+        return chunks
+
+    def put(self, cache_key, reply):
+        pass
+
+
+def _reply(*chunks, error=None):
+    def stream(**kwargs):
+        yield from chunks
+        if error is not None:
+            raise error
+    return stream
+
+
+def _speech(text, output_audio_path, eleven_key, trace=None, profile=None):
+    with open(output_audio_path, "wb") as f:
+        f.write(b"audio")
+    return output_audio_path
+
+
+@pytest.fixture
+def case(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.delenv("ELEVENLABS_API_KEY", raising=False)
+    monkeypatch.delenv("ELEVEN_API_KEY", raising=False)
+    monkeypatch.setattr(pipeline, "transcribe_with_groq", lambda **kwargs: "I have a rash on my arm.")
+    monkeypatch.setattr(pipeline, "session_documents", lambda session, documents: (None, "No documents."))
+    monkeypatch.setattr(pipeline, "get_llm_cache", lambda: _NoLLMCache())
+    monkeypatch.setattr(pipeline, "stream_image_with_query", _reply("It looks like eczema. ", "Use a moisturizer."))
+    monkeypatch.setattr(pipeline, "synthesize_speech", _speech)
+    return {"case_id": "c001", "audio": "question.mp3", "image": None, "documents": ["guide.pdf"]}
+
+
+def _run(case, tmp_path):
+    return batch_triage.run_case(case, str(tmp_path / "out" / "audio"))
+
+
+def test_success_has_no_error(case, tmp_path):
+    result = _run(case, tmp_path)
+    assert result["error"] is None
+    assert len(result["audio"]) == 2
+
+
+def test_missing_api_key(case, tmp_path, monkeypatch):
+    monkeypatch.delenv("GROQ_API_KEY")
+    assert "GROQ_API_KEY not set" in _run(case, tmp_path)["error"]
+
+
+def test_transcription_error(case, tmp_path, monkeypatch):
+    def fail(**kwargs):
+        raise RuntimeError("stt down")
+    monkeypatch.setattr(pipeline, "transcribe_with_groq", fail)
+    assert _run(case, tmp_path)["error"] == "Error transcribing audio: stt down"
+
+
+def test_document_ingest_error_in_context(case, tmp_path, monkeypatch):
+    def fail(session, documents):
+        raise OSError("disk full")
+    monkeypatch.setattr(pipeline, "session_documents", fail)
+    result = _run(case, tmp_path)
+    assert result["context"] == "Error ingesting documents: disk full"
+    assert result["error"] == "Error ingesting documents: disk full"
+
+
+def test_model_error_before_reply(case, tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "stream_image_with_query", _reply(error=RuntimeError("llm down")))
+    assert _run(case, tmp_path)["error"] == "Error running model: llm down"
+
+
+def test_model_error_mid_stream(case, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        pipeline, "stream_image_with_query", _reply("It looks like eczema. ", error=RuntimeError("connection reset")))
+    result = _run(case, tmp_path)
+    assert not result["response"].startswith("Error")
+    assert result["error"] == "Error running model: connection reset"
+
+
+def test_tts_error(case, tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("tts down")
+    monkeypatch.setattr(pipeline, "synthesize_speech", fail)
+    assert "TTS error: tts down" in _run(case, tmp_path)["error"]
+
+
+def test_pipeline_exception(case, tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise ValueError("bad case")
+    monkeypatch.setattr(pipeline, "process_inputs", fail)
+    assert _run(case, tmp_path)["error"] == "ValueError: bad case"
+
+
+def test_retry_failed_reruns_failed_cases(case, tmp_path, monkeypatch):
+    out = str(tmp_path / "out")
+    monkeypatch.setattr(
+        pipeline, "stream_image_with_query", _reply("It looks like eczema. ", error=RuntimeError("connection reset")))
+    assert batch_triage.run_batch([case], out, workers=1) == (1, 1)
+    assert batch_triage.run_batch([case], out, workers=1) == (0, 0)
+
+    monkeypatch.setattr(pipeline, "stream_image_with_query", _reply("It looks like eczema."))
+    assert batch_triage.run_batch([case], out, workers=1, retry_failed=True) == (1, 0)
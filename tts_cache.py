@@ -0,0 +1,225 @@
+# tts_cache.py
+#
+# Content-addressed on-disk cache for synthesized speech.
+# Key: (normalized text, engine, voice_id, model_id, output_format).
+# Total size is capped at TTS_CACHE_MAX_BYTES; least recently used clips are
+# evicted first. Cached files are served to gr.Audio as-is, so a repeated
+# sentence ("No image or audio provided for analysis.") never reaches the provider.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from metrics import record_cache
+
+
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # 0 disables the cache
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(text, engine, voice_id, model_id, output_format):
+    payload = json.dumps([normalize_text(text), engine, voice_id, model_id, output_format])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    LRU over files in one directory. Recency is kept in memory and mirrored
+    to file mtimes, so a restarted process (or another worker) rebuilds the
+    same order from disk.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # filename -> size
+        self._total = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total += size
+        self._evict()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, key, extension):
+        name = key + extension
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                record_cache("tts", False)
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        path = self._path(name)
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted by another worker sharing the directory
+            with self._lock:
+                self._total -= self._entries.pop(name, 0)
+                self.hits -= 1
+                self.misses += 1
+            record_cache("tts", False)
+            return None
+        record_cache("tts", True)
+        return path
+
+    def put(self, key, extension, source_path):
+        """Moves `source_path` into the cache and returns the cached path."""
+        name = key + extension
+        path = self._path(name)
+        os.replace(source_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._total += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict()
+        return path
+
+    def _evict(self):
+        # Never evict the newest entry, even if it alone exceeds the cap
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTSCache()
+        return _cache
+
+
+def _reserve(text, engine, voice_id, model_id, output_format, output_filepath):
+    # -> (cache, key, extension, cached_path or None)
+    cache = get_tts_cache()
+    extension = os.path.splitext(output_filepath)[1] or ".mp3"
+    key = cache_key(text, engine, voice_id, model_id, output_format)
+    return cache, key, extension, cache.get(key, extension)
+
+
+def _tmp_path(cache, extension):
+    fd, tmp_path = tempfile.mkstemp(dir=cache.directory, prefix=".tmp-", suffix=extension)
+    os.close(fd)
+    return tmp_path
+
+
+def synthesize_cached(text, engine, voice_id, model_id, output_format, synth, output_filepath):
+    """
+    Returns a path to audio for `text`. On a hit that is the cached file;
+    on a miss `synth(path)` writes the clip, which is then stored in the cache.
+    With the cache disabled, `synth(output_filepath)` is called directly.
+    """
+    if not get_tts_cache().enabled:
+        synth(output_filepath)
+        return output_filepath
+
+    cache, key, extension, cached = _reserve(text, engine, voice_id, model_id, output_format, output_filepath)
+    if cached is not None:
+        return cached
+
+    tmp_path = _tmp_path(cache, extension)
+    try:
+        synth(tmp_path)
+        return cache.put(key, extension, tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def synthesize_cached_async(text, engine, voice_id, model_id, output_format, synth, output_filepath):
+    """Same as synthesize_cached, with `synth(path)` a coroutine function."""
+    if not get_tts_cache().enabled:
+        await synth(output_filepath)
+        return output_filepath
+
+    cache, key, extension, cached = _reserve(text, engine, voice_id, model_id, output_format, output_filepath)
+    if cached is not None:
+        return cached
+
+    tmp_path = _tmp_path(cache, extension)
+    try:
+        await synth(tmp_path)
+        return cache.put(key, extension, tmp_path)
+    except BaseException:
+        # BaseException: also clean up when the request task is cancelled
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def synthesize_cached_stream_async(text, engine, voice_id, model_id, output_format, stream_synth, output_filepath):
+    """
+    Streaming form of synthesize_cached_async. `stream_synth(path)` is an
+    async generator that writes the clip to `path` and yields playable
+    segments while it does; those are passed through on a miss, and the
+    finished clip is then cached. A hit yields the cached clip once.
+    """
+    if not get_tts_cache().enabled:
+        async for segment in stream_synth(output_filepath):
+            yield segment
+        return
+
+    cache, key, extension, cached = _reserve(text, engine, voice_id, model_id, output_format, output_filepath)
+    if cached is not None:
+        yield cached
+        return
+
+    tmp_path = _tmp_path(cache, extension)
+    try:
+        async for segment in stream_synth(tmp_path):
+            yield segment
+        cache.put(key, extension, tmp_path)
+    except BaseException:
+        # also when the consumer stops early (aclose) or the task is cancelled
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,153 @@
+# tts_hedge.py
+#
+# Hedged text to speech. ElevenLabs stays the primary engine, but it gets a
+# latency budget (TTS_HEDGE_BUDGET_MS): if no audio has arrived by then, a
+# gTTS request is started in parallel and whichever engine produces audio
+# first wins; the other one is cancelled. A slow ElevenLabs response then
+# costs at most budget + gTTS latency instead of stalling the reply.
+#
+# The budget counts from submission, time queued for a "tts" slot
+# (scheduler.py) included: when slow ElevenLabs calls hold every slot, new
+# sentences hedge to gTTS instead of waiting behind them. gTTS has its own
+# "gtts" limiter (and, in the sync path, its own threads), so the fallback
+# never waits for the ElevenLabs slots either.
+#
+# Exported (metrics.py): ai_doctor_tts_hedge_total{winner} with winner in
+#   primary       - ElevenLabs within budget (no hedge)
+#   primary_late  - budget missed, ElevenLabs still beat gTTS
+#   fallback      - budget missed, gTTS won
+#   failed        - both engines failed
+# plus ai_doctor_tts_budget_violations_total and the win ratio per engine.
+
+import asyncio
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import Counter, GaugeCallback
+
+
+TTS_HEDGE_BUDGET_MS = float(os.environ.get("TTS_HEDGE_BUDGET_MS", 1500))  # 0 disables hedging
+
+HEDGE_OUTCOMES = Counter("ai_doctor_tts_hedge_total", "Hedged TTS requests by winning engine.", ["winner"])
+BUDGET_VIOLATIONS = Counter(
+    "ai_doctor_tts_budget_violations_total", "Primary TTS produced no audio within TTS_HEDGE_BUDGET_MS.",
+    ["provider"])
+
+
+def _win_ratios():
+    totals = {w: HEDGE_OUTCOMES.value(winner=w) for w in ("primary", "primary_late", "fallback", "failed")}
+    n = sum(totals.values())
+    if not n:
+        return {}
+    return {
+        ("elevenlabs",): (totals["primary"] + totals["primary_late"]) / n,
+        ("gtts",): totals["fallback"] / n,
+    }
+
+
+GaugeCallback("ai_doctor_tts_hedge_win_ratio", "Share of hedged TTS requests won per engine.", ["engine"], _win_ratios)
+
+
+def budget_seconds():
+    return TTS_HEDGE_BUDGET_MS / 1000 if TTS_HEDGE_BUDGET_MS > 0 else None
+
+
+# -----------------------------
+# ASYNC (streaming primary)
+# -----------------------------
+async def _cancel(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def hedge_stream_async(primary, fallback, budget=None):
+    """
+    Async generator of playable paths. `primary` is an async iterator of
+    segment paths (ElevenLabs); `fallback()` is a coroutine returning one
+    clip path (gTTS), only started once the budget has passed without a
+    first segment, or when the primary fails before producing one.
+    """
+    budget = budget_seconds() if budget is None else budget
+    segments = primary.__aiter__()
+    first = asyncio.ensure_future(segments.__anext__())
+    try:
+        done, _ = await asyncio.wait({first}, timeout=budget)
+        if first in done and first.exception() is None:
+            HEDGE_OUTCOMES.inc(winner="primary")
+            winner = first
+        else:
+            if first not in done:
+                BUDGET_VIOLATIONS.inc(provider="elevenlabs")
+            backup = asyncio.ensure_future(fallback())
+            try:
+                winner = await _race(first, backup)
+            finally:
+                if not backup.done():
+                    await _cancel(backup)
+            if winner is backup:
+                await _cancel(first)
+                HEDGE_OUTCOMES.inc(winner="fallback")
+                yield backup.result()
+                return
+            HEDGE_OUTCOMES.inc(winner="primary_late")
+    except BaseException:
+        await _cancel(first)
+        raise
+
+    yield winner.result()
+    async for segment in segments:
+        yield segment
+
+
+async def _race(first, backup):
+    """The first of the two tasks to succeed; if both fail, raises the primary's error."""
+    pending = {first, backup}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in (first, backup):  # primary wins a tie
+            if task in done and not task.exception():
+                return task
+    HEDGE_OUTCOMES.inc(winner="failed")
+    error = first.exception()
+    if isinstance(error, StopAsyncIteration):
+        raise RuntimeError("primary TTS produced no audio") from backup.exception()
+    raise error
+
+
+# -----------------------------
+# SYNC (whole clips, threads)
+# -----------------------------
+_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("TTS_HEDGE_THREADS", 8)), thread_name_prefix="tts-hedge")
+# Backups get threads of their own: primaries stuck on a slow ElevenLabs must not hold them up
+_backup_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("TTS_HEDGE_THREADS", 8)), thread_name_prefix="tts-hedge-backup")
+
+
+def hedge_call(primary, fallback, budget=None):
+    """
+    Sync form for pipeline.process_inputs: `primary()` and `fallback()`
+    each return a clip path. The budget applies to the whole primary clip
+    (no first-byte signal here), queueing included; a losing thread cannot
+    be interrupted: its result is discarded when it finishes.
+    """
+    budget = budget_seconds() if budget is None else budget
+    first = _pool.submit(primary)
+    done, _ = wait({first}, timeout=budget)
+    if first in done and not first.exception():
+        HEDGE_OUTCOMES.inc(winner="primary")
+        return first.result()
+
+    if first not in done:
+        BUDGET_VIOLATIONS.inc(provider="elevenlabs")
+    backup = _backup_pool.submit(fallback)
+    pending = {first, backup}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in (first, backup):
+            if future in done and not future.exception():
+                for loser in pending:
+                    loser.cancel()
+                HEDGE_OUTCOMES.inc(winner="primary_late" if future is first else "fallback")
+                return future.result()
+    HEDGE_OUTCOMES.inc(winner="failed")
+    raise first.exception()
@@ -0,0 +1,133 @@
+# tts_profiles.py
+#
+# Output quality of the doctor's voice, per client profile. Speech does not
+# need 128 kbps stereo-grade audio, and on a mobile link the audio download
+# is a visible part of the wait, so each profile picks:
+#   - the format ElevenLabs is asked for (no local transcode needed), and
+#   - the container/codec/bitrate every finished clip ends up in; gTTS
+#     clips (always ~32 kbps MP3) are transcoded with pydub/ffmpeg when the
+#     profile wants something else.
+#
+#   high      MP3 44.1 kHz 128 kbps (the old fixed format)
+#   standard  MP3 44.1 kHz 64 kbps  (default, TTS_PROFILE)
+#   low       MP3 22.05 kHz 32 kbps (slow or metered links)
+#   opus      Ogg/Opus 48 kHz 32 kbps (API clients that can play Opus)
+#
+# Finished clips are also loudness-normalized (TTS_LOUDNESS_DBFS average,
+# peaks kept under TTS_PEAK_DBFS), so gTTS and ElevenLabs replies play at
+# the same volume. Segments streamed while ElevenLabs is still sending are
+# passed through as received; the normalized clip is what the TTS cache
+# keeps and serves from then on. TTS_LOUDNESS_NORMALIZE=0 turns it off.
+#
+# The UI's "auto" choice is `low` when the browser sends Save-Data or a
+# slow effective connection type (ECT client hint), else TTS_PROFILE.
+#
+# Exported: ai_doctor_tts_bytes_served_total{profile} - audio bytes handed
+# to clients.
+
+import os
+from collections import namedtuple
+
+from metrics import Counter
+
+
+TTS_PROFILE = os.environ.get("TTS_PROFILE", "standard")
+TTS_LOUDNESS_NORMALIZE = os.environ.get("TTS_LOUDNESS_NORMALIZE", "1") != "0"
+TTS_LOUDNESS_DBFS = float(os.environ.get("TTS_LOUDNESS_DBFS", -20.0))
+TTS_PEAK_DBFS = float(os.environ.get("TTS_PEAK_DBFS", -1.0))
+
+AudioProfile = namedtuple(
+    "AudioProfile", "name elevenlabs_format container codec bitrate sample_rate extension"
+)
+
+PROFILES = {
+    "high": AudioProfile("high", "mp3_44100_128", "mp3", "libmp3lame", "128k", 44100, ".mp3"),
+    "standard": AudioProfile("standard", "mp3_44100_64", "mp3", "libmp3lame", "64k", 44100, ".mp3"),
+    "low": AudioProfile("low", "mp3_22050_32", "mp3", "libmp3lame", "32k", 22050, ".mp3"),
+    "opus": AudioProfile("opus", "opus_48000_32", "ogg", "libopus", "32k", 48000, ".ogg"),
+}
+# Profiles offered in the browser UI (streaming gr.Audio plays MP3 everywhere)
+UI_PROFILES = ["auto", "standard", "low", "high"]
+# Effective connection types (ECT client hint) treated as a slow link
+SLOW_CONNECTIONS = {"slow-2g", "2g", "3g"}
+
+TTS_BYTES_SERVED = Counter(
+    "ai_doctor_tts_bytes_served_total", "Doctor's voice audio bytes handed to clients.", ["profile"])
+
+
+def get_profile(name=None):
+    """The named profile (or `name` itself if already one); unknown or empty names ("auto") give TTS_PROFILE."""
+    if isinstance(name, AudioProfile):
+        return name
+    return PROFILES.get(name) or PROFILES.get(TTS_PROFILE) or PROFILES["standard"]
+
+
+def profile_for_client(choice=None, headers=None):
+    """Explicit `choice` first; otherwise `low` for Save-Data or slow-connection hints."""
+    if choice in PROFILES:
+        return PROFILES[choice]
+    headers = {k.lower(): v for k, v in (headers or {}).items()}
+    if headers.get("save-data", "").strip().lower() == "on" or headers.get("ect", "").strip().lower() in SLOW_CONNECTIONS:
+        return PROFILES["low"]
+    return get_profile()
+
+
+def source_format(output_format):
+    """pydub/ffmpeg input format of a provider output format ("mp3_44100_64" -> "mp3")."""
+    codec = output_format.split("_", 1)[0]
+    return "ogg" if codec == "opus" else codec
+
+
+def source_rate(output_format):
+    """Sample rate stated in a provider output format ("mp3_44100_64" -> 44100), or None (gTTS "mp3")."""
+    parts = output_format.split("_")
+    return int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+
+
+def cache_format(profile, provider_format):
+    """TTS cache key part: the provider format plus whatever finish_clip does to it."""
+    loudness = f"{TTS_LOUDNESS_DBFS:g}dB" if TTS_LOUDNESS_NORMALIZE else "raw"
+    return f"{provider_format}>{profile.container}_{profile.sample_rate}_{profile.bitrate}_{loudness}"
+
+
+# -----------------------------
+# TRANSCODE + LOUDNESS
+# -----------------------------
+def finish_clip(path, profile, provider_format):
+    """
+    Rewrites the clip at `path` (as produced in `provider_format`) in the
+    profile's format and sample rate (so clips from either engine can be
+    played back to back), loudness-normalized. The bitrate is never raised
+    above the source's (a 32 kbps gTTS clip stays 32 kbps), and a clip
+    already in the profile's container and sample rate is left alone when
+    normalization is off.
+    """
+    same_container = source_format(provider_format) == profile.container
+    if not TTS_LOUDNESS_NORMALIZE and same_container and source_rate(provider_format) == profile.sample_rate:
+        return
+    from pydub import AudioSegment
+
+    source_bytes = os.path.getsize(path)
+    audio = AudioSegment.from_file(path, format=source_format(provider_format))
+    if not len(audio):
+        return
+    if not TTS_LOUDNESS_NORMALIZE and same_container and audio.frame_rate == profile.sample_rate:
+        return
+    if TTS_LOUDNESS_NORMALIZE and audio.dBFS != float("-inf"):
+        # Average loudness to the target, unless that would push the peaks past TTS_PEAK_DBFS
+        audio = audio.apply_gain(min(TTS_LOUDNESS_DBFS - audio.dBFS, TTS_PEAK_DBFS - audio.max_dBFS))
+    source_kbps = source_bytes * 8 // len(audio)  # bits per millisecond = kbps
+    bitrate = f"{max(16, min(int(profile.bitrate.rstrip('k')), source_kbps))}k"
+    audio = audio.set_channels(1).set_frame_rate(profile.sample_rate)
+    tmp_path = f"{path}.tmp{profile.extension}"
+    try:
+        audio.export(tmp_path, format=profile.container, codec=profile.codec, bitrate=bitrate)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def record_served(profile, path):
+    if path:
+        TTS_BYTES_SERVED.inc(os.path.getsize(path), profile=profile.name)
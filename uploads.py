@@ -0,0 +1,47 @@
+# uploads.py
+#
+# In-memory uploads. The HTTP API (api.py) hands small files to the
+# pipeline as Upload(filename, data) instead of spooling them to temp files
+# first (large ones arrive as paths to its spool directory); every stage that reads an input (audio, image, documents) accepts
+# either a file path or an Upload through the helpers below.
+
+import hashlib
+import os
+from collections import namedtuple
+from io import BytesIO
+
+
+Upload = namedtuple("Upload", "filename data")
+
+
+def source_name(source):
+    """Base file name of a path or an Upload."""
+    if isinstance(source, Upload):
+        return os.path.basename(source.filename or "upload")
+    return os.path.basename(source)
+
+
+def source_size(source):
+    return len(source.data) if isinstance(source, Upload) else os.path.getsize(source)
+
+
+def read_source(source):
+    if isinstance(source, Upload):
+        return bytes(source.data)
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def open_source(source):
+    """What file-reading libraries (pydub, pypdf) take: the path itself, or a buffer over the Upload."""
+    return BytesIO(source.data) if isinstance(source, Upload) else source
+
+
+def source_key(source):
+    """Identity of an input across requests: its path, or a digest of the uploaded bytes."""
+    if source is None:
+        return None
+    if isinstance(source, Upload):
+        return "sha256:" + hashlib.sha256(source.data).hexdigest()
+    # Gradio passes file paths (or objects with .name); the same upload keeps its path across submits
+    return str(getattr(source, "name", source))
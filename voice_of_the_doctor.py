@@ -3,8 +3,10 @@
 # load_dotenv()
 
 # Step1a: Setup Text to Speechâ€“TTSâ€“model with gTTS
+import asyncio
 import os
 import platform
+import shutil
 import subprocess
 import traceback
 import types
@@ -16,31 +18,36 @@ try:
 except Exception:
     pass
 
-from gtts import gTTS
+from clients import get_elevenlabs_client, get_async_elevenlabs_client, resolve_voice_id
+from scheduler import provider_limit
+from resilience import ProviderUnavailable, call, stream_async
+from metrics import span
+from audio_stream import StreamingAudioWriter
 
 def text_to_speech_with_gtts(input_text, output_filepath):
+    from gtts import gTTS  # imported on first use; keeps startup fast
     language = "en"
     audioobj = gTTS(text=input_text, lang=language, slow=False)
-    audioobj.save(output_filepath)
-
-
-# quick gTTS generation (kept as in your original)
-input_text = "Hi this is Ai with Hassan!"
-text_to_speech_with_gtts(input_text=input_text, output_filepath="gtts_testing.mp3")
+    call("gtts", lambda: audioobj.save(output_filepath), limit="gtts")
 
 
 # Step1b: Setup Text to Speechâ€“TTSâ€“model with ElevenLabs (modern usage)
 # We'll prefer environment variable ELEVENLABS_API_KEY (also accept ELEVEN_API_KEY)
 ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY") or os.environ.get("ELEVEN_API_KEY")
+ELEVENLABS_MODEL_ID = "eleven_multilingual_v2"
+ELEVENLABS_OUTPUT_FORMAT = "mp3_44100_128"  # default; callers pass the client's profile format (tts_profiles.py)
 
-def _autoplay(output_filepath: str):
-    """Play the saved audio file (best-effort); used after successful generation.
+def play_audio(output_filepath, wait=False):
+    """Play a saved audio file locally (best-effort). CLI use only: the app and
+    pipelines never call this, so a request never waits on (or spawns) a player
+    on the server. Starts the player in the background and returns the
+    process, or None; wait=True blocks until playback ends.
 
-    - On macOS: uses afplay (sync)
+    - On macOS: afplay
     - On Windows:
-        - uses Media.SoundPlayer.PlaySync() only for .wav files
-        - uses Start (default associated app) for other extensions (mp3)
-    - On Linux: tries aplay (may not support mp3; user can install mpg123/ffplay)
+        - Media.SoundPlayer for .wav files
+        - the default associated app (start) for other extensions (mp3)
+    - On Linux: ffplay or mpg123 if installed (mp3), else aplay (wav)
     """
     os_name = platform.system()
     try:
@@ -48,28 +55,32 @@ def _autoplay(output_filepath: str):
         ext = (ext or "").lower()
 
         if os_name == "Darwin":
-            subprocess.run(['afplay', output_filepath], check=False)
-            return
-
-        if os_name == "Windows":
-            # Use SoundPlayer only for WAV (synchronous). For mp3, open default app.
+            command = ['afplay', output_filepath]
+        elif os_name == "Windows":
             if ext == ".wav":
-                # synchronous playback for .wav files
-                subprocess.run(['powershell', '-c', f'(New-Object Media.SoundPlayer \"{output_filepath}\").PlaySync();'], check=False)
+                command = ['powershell', '-c', f'(New-Object Media.SoundPlayer \"{output_filepath}\").PlaySync();']
             else:
-                # For mp3 (and other non-wav), open the default associated player (non-blocking).
-                # Use cmd start via subprocess so it works from both PowerShell and cmd.
                 # The empty title "" after start is required when the filename might be quoted.
-                subprocess.run(['cmd', '/c', 'start', '', output_filepath], check=False, shell=False)
-            return
+                command = ['cmd', '/c', 'start', '', output_filepath]
+        elif os_name == "Linux":
+            if shutil.which("ffplay"):
+                command = ['ffplay', '-nodisp', '-autoexit', '-loglevel', 'quiet', output_filepath]
+            elif shutil.which("mpg123"):
+                command = ['mpg123', '-q', output_filepath]
+            else:
+                command = ['aplay', output_filepath]
+        else:
+            return None
 
-        if os_name == "Linux":
-            subprocess.run(['aplay', output_filepath], check=False)
-            return
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if wait:
+            process.wait()
+        return process
 
     except Exception as e:
-        # Don't fail the overall flow just because autoplay failed
+        # Don't fail the caller just because playback failed
         print(f"An error occurred while trying to play the audio: {e}")
+        return None
 
 
 def _write_audio_result(res, output_filepath):
@@ -86,21 +97,18 @@ def _write_audio_result(res, output_filepath):
     if isinstance(res, (bytes, bytearray)):
         with open(output_filepath, "wb") as f:
             f.write(res)
-        _autoplay(output_filepath)
         return True
 
     # Object with .content
     if hasattr(res, "content"):
         with open(output_filepath, "wb") as f:
             f.write(res.content)
-        _autoplay(output_filepath)
         return True
 
     # Object with save_to_file
     if hasattr(res, "save_to_file"):
         try:
             res.save_to_file(output_filepath)
-            _autoplay(output_filepath)
             return True
         except Exception:
             # continue to other strategies if save_to_file fails
@@ -110,26 +118,23 @@ def _write_audio_result(res, output_filepath):
     # Detect generator specifically
     if isinstance(res, types.GeneratorType) or (hasattr(res, "__iter__") and not isinstance(res, (str, bytes, bytearray))):
         try:
-            chunks = []
-            # If object has an iterator producing chunks
-            for chunk in res:
-                if chunk is None:
-                    continue
-                if isinstance(chunk, (bytes, bytearray)):
-                    chunks.append(chunk)
-                elif hasattr(chunk, "content"):
-                    chunks.append(chunk.content)
-                else:
-                    # try to coerce to bytes
-                    try:
-                        chunks.append(bytes(chunk))
-                    except Exception:
-                        # fallback to string encoding
-                        chunks.append(str(chunk).encode("utf-8"))
-            data = b"".join(chunks)
-            with open(output_filepath, "wb") as f:
-                f.write(data)
-            _autoplay(output_filepath)
+            # Each chunk goes to disk as it arrives; the clip is never held in memory
+            with StreamingAudioWriter(output_filepath) as writer:
+                for chunk in res:
+                    if chunk is None:
+                        continue
+                    if isinstance(chunk, (bytes, bytearray)):
+                        writer.write(chunk)
+                    elif hasattr(chunk, "content"):
+                        writer.write(chunk.content)
+                    else:
+                        # try to coerce to bytes
+                        try:
+                            writer.write(bytes(chunk))
+                        except Exception:
+                            # fallback to string encoding
+                            writer.write(str(chunk).encode("utf-8"))
+                writer.close()
             return True
         except Exception as e_stream:
             # re-raise with context
@@ -140,7 +145,6 @@ def _write_audio_result(res, output_filepath):
         b = bytes(res)
         with open(output_filepath, "wb") as f:
             f.write(b)
-        _autoplay(output_filepath)
         return True
     except Exception:
         raise RuntimeError("Unknown response type from ElevenLabs TTS call: " + repr(type(res)))
@@ -172,50 +176,21 @@ def text_to_speech_with_elevenlabs(input_text, output_filepath):
 
 
 # Modern, robust ElevenLabs TTS function
-def text_to_speech_with_elevenlabs(input_text, output_filepath="elevenlabs_output.mp3"):
+def text_to_speech_with_elevenlabs(input_text, output_filepath="elevenlabs_output.mp3", voice_id=None, output_format=None):
     """
     Modern ElevenLabs TTS helper using elevenlabs.client.ElevenLabs.
-    Voice selection order:
+    Voice selection order (unless voice_id is passed in):
       1) ELEVEN_VOICE_ID env var
-      2) client.voices.get_all() (if allowed)
+      2) client.voices.get_all() (if allowed; cached by clients.resolve_voice_id)
       3) guaranteed default voice '21m00Tcm4TlvDq8ikWAM' (Rachel)
     """
     api_key = ELEVENLABS_API_KEY
     if not api_key:
         raise RuntimeError("ELEVENLABS_API_KEY not set in environment (or ELEVEN_API_KEY).")
 
-    try:
-        from elevenlabs.client import ElevenLabs  # type: ignore
-    except Exception as e:
-        print("DEBUG: failed to import ElevenLabs from elevenlabs.client:", repr(e))
-        raise
-
-    client = ElevenLabs(api_key=api_key)
-    print("DEBUG: ElevenLabs client created:", type(client))
-
-    # ------------------------------
-    # Voice selection (robust)
-    # ------------------------------
-    # 1) env var
-    voice_id = os.environ.get("ELEVEN_VOICE_ID") or os.environ.get("ELEVEN_VOICEID")
-    if voice_id:
-        print("DEBUG: using voice_id from env ELEVEN_VOICE_ID:", voice_id)
-    else:
-        # 2) try list voices (may raise ApiError / be blocked)
-        try:
-            voices_resp = client.voices.get_all()
-            voices_list = getattr(voices_resp, "voices", None) or voices_resp
-            if voices_list and len(voices_list) > 0:
-                first = voices_list[0]
-                voice_id = getattr(first, "voice_id", None) or getattr(first, "id", None) or getattr(first, "voiceId", None)
-                print("DEBUG: Auto-discovered voice_id:", voice_id, "name:", getattr(first, "name", None) or getattr(first, "voice_name", None))
-        except Exception as e:
-            print("DEBUG: Voice listing failed:", repr(e))
-
-    # 3) final fallback: guaranteed default voice (Rachel)
-    if not voice_id:
-        voice_id = "21m00Tcm4TlvDq8ikWAM"
-        print("DEBUG: Using DEFAULT fallback voice_id:", voice_id)
+    # Pooled client + TTL-cached voice_id: no handshake or voice listing after the first call
+    client = get_elevenlabs_client(api_key)
+    voice_id = voice_id or resolve_voice_id(api_key)
 
     # ------------------------------
     # Call TTS convert (voice_id guaranteed)
@@ -226,42 +201,54 @@ def text_to_speech_with_elevenlabs(input_text, output_filepath="elevenlabs_outpu
             kwargs = {
                 "text": input_text,
                 "voice_id": voice_id,
-                "model_id": "eleven_multilingual_v2",
-                "output_format": "mp3_44100_128",
+                "model_id": ELEVENLABS_MODEL_ID,
+                "output_format": output_format or ELEVENLABS_OUTPUT_FORMAT,
             }
-            res = client.text_to_speech.convert(**kwargs)
 
-            # Use helper to handle all response shapes (bytes, object, generator, etc.)
-            _write_audio_result(res, output_filepath)
+            def synthesize():
+                res = client.text_to_speech.convert(**kwargs)
+
+                # Use helper to handle all response shapes (bytes, object, generator, etc.)
+                # (for a streamed response this also covers reading the stream)
+                with span("file_write"):
+                    _write_audio_result(res, output_filepath)
+
+            # Retried on 429/5xx (the file is rewritten from the start); fails fast while ElevenLabs is down.
+            # Each attempt takes its own TTS slot, so backoff sleeps do not hold one.
+            call("elevenlabs", synthesize, limit="tts")
             return output_filepath
 
         # fallback probing (if convert isn't present)
         print("DEBUG: client.text_to_speech.convert not found â€” falling back to probing methods")
-        if hasattr(client, "text_to_speech"):
-            tts_obj = getattr(client, "text_to_speech")
-            if callable(tts_obj):
-                res = _call_with_fallback(tts_obj, input_text)
+        with provider_limit("tts"):
+            if hasattr(client, "text_to_speech"):
+                tts_obj = getattr(client, "text_to_speech")
+                if callable(tts_obj):
+                    res = _call_with_fallback(tts_obj, input_text)
+                else:
+                    res = _try_methods_on_obj(tts_obj, input_text)
             else:
-                res = _try_methods_on_obj(tts_obj, input_text)
-        else:
-            found = False
-            for nm in ("generate", "synthesize", "create", "stream", "speak"):
-                if hasattr(client, nm):
-                    method = getattr(client, nm)
-                    if callable(method):
-                        try:
-                            res = _call_with_fallback(method, input_text)
-                            found = True
-                            break
-                        except Exception as e_method:
-                            print(f"DEBUG: client.{nm} failed: {repr(e_method)}")
-            if not found:
-                raise RuntimeError("No TTS entrypoint found on client. Available names: " + ", ".join([n for n in dir(client) if not n.startswith('_')]))
-
-        # save fallback result shapes using the same helper
-        _write_audio_result(res, output_filepath)
-        return output_filepath
+                found = False
+                for nm in ("generate", "synthesize", "create", "stream", "speak"):
+                    if hasattr(client, nm):
+                        method = getattr(client, nm)
+                        if callable(method):
+                            try:
+                                res = _call_with_fallback(method, input_text)
+                                found = True
+                                break
+                            except Exception as e_method:
+                                print(f"DEBUG: client.{nm} failed: {repr(e_method)}")
+                if not found:
+                    raise RuntimeError("No TTS entrypoint found on client. Available names: " + ", ".join([n for n in dir(client) if not n.startswith('_')]))
+
+            # save fallback result shapes using the same helper
+            with span("file_write"):
+                _write_audio_result(res, output_filepath)
+            return output_filepath
 
+    except ProviderUnavailable:
+        raise
     except Exception as e:
         print("DEBUG: TTS call failed:", repr(e))
         traceback.print_exc()
@@ -309,14 +296,66 @@ def _try_methods_on_obj(obj, text, method_names=("convert", "synthesize", "creat
     raise RuntimeError("No suitable method on object produced audio. Checked methods: " + ", ".join(method_names)) from last_exc
 
 
+# Async variants (used by async_pipeline.py)
+async def text_to_speech_with_gtts_async(input_text, output_filepath):
+    # gTTS has no async API; keep it off the event loop
+    await asyncio.to_thread(text_to_speech_with_gtts, input_text, output_filepath)
+
+
+async def stream_tts_with_elevenlabs_async(input_text, output_filepath, voice_id=None, segment_prefix=None, output_format=None):
+    """
+    Async generator: writes the clip to output_filepath chunk by chunk as
+    ElevenLabs streams it. With segment_prefix it also yields playable
+    segment files (audio_stream.py) as soon as each one is complete.
+    """
+    api_key = ELEVENLABS_API_KEY
+    if not api_key:
+        raise RuntimeError("ELEVENLABS_API_KEY not set in environment (or ELEVEN_API_KEY).")
+
+    client = get_async_elevenlabs_client(api_key)
+    voice_id = voice_id or await asyncio.to_thread(resolve_voice_id, api_key)
+
+    with StreamingAudioWriter(output_filepath, segment_prefix) as writer:
+        # Retried until the first chunk arrives; the TTS slot is held while streaming
+        async for chunk in stream_async("elevenlabs", lambda: client.text_to_speech.convert(
+            text=input_text,
+            voice_id=voice_id,
+            model_id=ELEVENLABS_MODEL_ID,
+            output_format=output_format or ELEVENLABS_OUTPUT_FORMAT,
+        ), limit="tts"):
+            for segment in writer.write(chunk):
+                yield segment
+        for segment in writer.close():
+            yield segment
+
+
+async def text_to_speech_with_elevenlabs_async(input_text, output_filepath="elevenlabs_output.mp3", voice_id=None, output_format=None):
+    async for _ in stream_tts_with_elevenlabs_async(input_text, output_filepath, voice_id, output_format=output_format):
+        pass
+    return output_filepath
+
+
 # Step2: Use Model for Text output to Voice (example usage)
+#   python voice_of_the_doctor.py [--play]
 if __name__ == "__main__":
-    # example gTTS usage (already generated earlier; comment if you don't want it repeated)
-    # text_to_speech_with_gtts("Hello from gTTS", "gtts_test.mp3")
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate the sample TTS clips.")
+    parser.add_argument("--play", action="store_true", help="play each clip locally once it is written")
+    args = parser.parse_args()
+
+    # quick gTTS generation (used to run at import time; now only when run as a script)
+    try:
+        text_to_speech_with_gtts(input_text="Hi this is Ai with Hassan!", output_filepath="gtts_testing.mp3")
+        if args.play:
+            play_audio("gtts_testing.mp3", wait=True)
+    except Exception as e:
+        print("gTTS failed:", e)
 
     # ElevenLabs modern test
     try:
         out = text_to_speech_with_elevenlabs("This is a short test from local environment", "final_test.mp3")
         print("Wrote:", out)
+        if args.play:
+            play_audio(out, wait=True)
     except Exception as e:
         print("ElevenLabs TTS failed:", e)
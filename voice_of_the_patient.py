@@ -7,8 +7,6 @@
 #step 2 setup speech to text-STT model for transcription
 
 import logging
-import speech_recognition as sr
-from pydub import AudioSegment
 from io import BytesIO
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,6 +20,10 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
     timeout (int): Maximum time to wait for a phrase to start (in seconds).
     phrase_time_lfimit (int): Maximum time for the phrase to be recorded (in seconds).
     """
+    # Microphone/pydub are only needed for local recording, not by the server
+    import speech_recognition as sr
+    from pydub import AudioSegment
+
     recognizer = sr.Recognizer()
     
     try:
@@ -37,7 +39,9 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
             # Convert the recorded audio to an MP3 file
             wav_data = audio_data.get_wav_data()
             audio_segment = AudioSegment.from_wav(BytesIO(wav_data))
-            audio_segment.export(file_path, format="mp3", bitrate="128k")
+            # Speech only needs 16 kHz mono; 128k stereo-grade MP3 just slows the upload
+            audio_segment = audio_segment.set_channels(1).set_frame_rate(16000)
+            audio_segment.export(file_path, format="mp3", bitrate="32k")
             
             logging.info(f"Audio saved to {file_path}")
 
@@ -48,20 +52,102 @@ audio_filepath="patient_voice_test_for_patient.mp3"
 #record_audio(file_path=audio_filepath)
 
 #Step2: Setup Speech to text–STT–model for transcription
+import asyncio
 import os
-from groq import Groq
+import time
+from clients import get_groq_client, get_async_groq_client
+from resilience import call, call_async
+from audio_preprocess import AUDIO_PREPROCESS, load_trimmed, encode_for_upload, finish_stats, record_transcription
+from long_audio import STT_MAX_UPLOAD_BYTES, is_long, transcribe_long, transcribe_long_async
+from uploads import read_source, source_name, source_size
 
 GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
 stt_model="whisper-large-v3"
+MAX_PROMPT_CHARS=800  # Whisper only looks at the last ~224 tokens of the prompt
 
-def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY):
-    client=Groq(api_key=GROQ_API_KEY)
-    
-    audio_file=open(audio_filepath, "rb")
-    transcription=client.audio.transcriptions.create(
-        model=stt_model,
-        file=audio_file,
-        language="en"
+def prepare_upload(audio_filepath, preprocess=AUDIO_PREPROCESS):
+    """
+    Returns (kind, payload, stats):
+      ("single", (filename, bytes), stats) - one upload; resampled, silence-trimmed
+          and re-encoded when preprocessing is on (see audio_preprocess.py)
+      ("long", AudioSegment, stats)        - long recording for long_audio.py
+      ("single", (filename, bytes), None)  - the raw file (preprocessing off or failed)
+    Files over the provider's upload limit are always decoded, so they can be split.
+    `audio_filepath` may also be an in-memory Upload (uploads.py).
+    """
+    if preprocess or source_size(audio_filepath) > STT_MAX_UPLOAD_BYTES:
+        try:
+            audio, stats = load_trimmed(audio_filepath)
+        except Exception as e:
+            logging.warning(f"Audio preprocessing failed, uploading raw file: {e}")
+        else:
+            if is_long(audio):
+                return "long", audio, stats
+            started = time.perf_counter()
+            upload = encode_for_upload(audio)
+            return "single", upload, finish_stats(stats, len(upload[1]), time.perf_counter() - started)
+    return "single", (source_name(audio_filepath), read_source(audio_filepath)), None
+
+def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY, preprocess=AUDIO_PREPROCESS):
+    client=get_groq_client(GROQ_API_KEY)
+    kind, upload, stats=prepare_upload(audio_filepath, preprocess)
+    if kind == "long":
+        return transcribe_long(client, stt_model, upload, stats)
+
+    def transcribe():
+        started=time.perf_counter()
+        transcription=client.audio.transcriptions.create(
+            model=stt_model,
+            file=upload,
+            language="en"
+        )
+        record_transcription(stats, len(upload[1]), time.perf_counter()-started)
+        return transcription.text
+
+    return call("groq", transcribe, limit="stt")
+
+async def transcribe_with_groq_async(stt_model, audio_filepath, GROQ_API_KEY, preprocess=AUDIO_PREPROCESS):
+    client=get_async_groq_client(GROQ_API_KEY)
+    kind, upload, stats=await asyncio.to_thread(prepare_upload, audio_filepath, preprocess)
+    if kind == "long":
+        return await transcribe_long_async(client, stt_model, upload, stats)
+
+    async def transcribe():
+        started=time.perf_counter()
+        transcription=await client.audio.transcriptions.create(
+            model=stt_model,
+            file=upload,
+            language="en"
+        )
+        record_transcription(stats, len(upload[1]), time.perf_counter()-started)
+        return transcription.text
+
+    return await call_async("groq", transcribe, limit="stt")
+
+async def transcribe_segment_async(stt_model, audio, GROQ_API_KEY, prompt=None):
+    """
+    Transcribes one in-memory utterance (16 kHz mono AudioSegment) from the
+    live microphone mode. `prompt` is the text heard so far, which keeps
+    spelling and wording consistent across utterances.
+    """
+    client=get_async_groq_client(GROQ_API_KEY)
+    started=time.perf_counter()
+    upload=await asyncio.to_thread(encode_for_upload, audio)
+    stats=finish_stats(
+        {"original_bytes": len(audio.raw_data), "trimmed_ms": 0, "duration_ms": len(audio), "preprocess_seconds": 0.0},
+        len(upload[1]), time.perf_counter()-started
     )
+    options={"prompt": prompt[-MAX_PROMPT_CHARS:]} if prompt else {}
+
+    async def transcribe():
+        started=time.perf_counter()
+        transcription=await client.audio.transcriptions.create(
+            model=stt_model,
+            file=upload,
+            language="en",
+            **options
+        )
+        record_transcription(stats, len(upload[1]), time.perf_counter()-started)
+        return transcription.text
 
-    return transcription.text
\ No newline at end of file
+    return await call_async("groq", transcribe, limit="stt")